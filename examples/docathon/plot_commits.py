@@ -1,6 +1,6 @@
 import numpy as np
 import os
-from watchtower import commits_
+from watchtower import commits_, rollup
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 import calendar
@@ -26,32 +26,19 @@ def plot_commits(user, project, search_queries=None,
     # Load commit data and return the date of each commit
     if search_queries is None:
         search_queries = ['DOC', 'docs', 'docstring']
-    since = pd.to_datetime(since)
+    since = pd.to_datetime(since, utc=True)
     commits = commits_.load_commits(user, project)
-    dates = pd.to_datetime([ii['author']['date']
-                           for ii in commits['commit']])
     # Remove commits from the past we don't want
-    mask_since = dates > since
-    commits = commits[mask_since]
-    dates = dates[mask_since]
+    commits = commits[commits['authored_at'] > since]
+    # Match the queries against all the messages at once
+    is_doc = commits_.find_word_in_string(commits['message'], search_queries)
+    # Count all and doc commits for each unit of time
+    counts = rollup(commits, 'authored_at', freq=groupby,
+                    by=is_doc.rename('doc'))
+    n_commits = counts['all'].values
+    doc_commits = counts['doc'].values
 
-    n_commits = []
-    doc_commits = []
-
-    iter_dates = range(1, 13) if groupby == 'month' else range(7)
-    for ii_time in iter_dates:
-        if commits is None:
-            doc_commits.append(0)
-            n_commits.append(0)
-            continue
-        # Count commits for this unit of time
-        mask = getattr(dates, groupby) == ii_time
-        n_commits.append(mask.sum())
-
-        # Now count how many commits match the query
-        doc_commits.append(sum(any(qu in c['message']
-                                   for qu in search_queries)
-                               for c in commits[mask]['commit']))
+    iter_dates = counts.index
     # Generate barplots
     fig, ax = plt.subplots(figsize=(8, 4))
     ax.bar(np.arange(len(n_commits)), n_commits, label="all")
@@ -9,9 +9,8 @@ In this small examples, we compare labels between the different projects:
     - watchtower
 
 """
-import numpy as np
 import pandas as pd
-from watchtower import issues_
+from watchtower import issues_, rollup
 import matplotlib.pyplot as plt
 
 projects = (("scikit-learn", "scikit-learn"),
@@ -25,20 +24,12 @@ for user, project in projects:
         max_pages=1, per_page=50)
 
     open_issues = all_issues[all_issues["state"] == "open"]
-    # Extract the names of the labels
-    all_labels = np.array([label["name"] for labels in all_issues['labels']
-                           for label in labels])
-    open_labels = np.array([label["name"] for labels in open_issues['labels']
-                           for label in labels])
-
-    unique_labels = np.unique(all_labels)
-    counts = dict()
-    for label in unique_labels:
-        n_instances = np.sum(all_labels == label)
-        n_open = np.sum(open_labels == label)
-        counts[label] = (n_instances, n_open)
-    counts = pd.DataFrame(counts).T
-    counts.columns = ['all', 'open']
+    # Count the issues of each label, over their whole history
+    counts = pd.DataFrame({
+        'all': rollup(all_issues, "created_at", freq="Y",
+                      by="label_names").sum(),
+        'open': rollup(open_issues, "created_at", freq="Y",
+                       by="label_names").sum()}).drop("all").fillna(0)
     counts = counts.sort_values('all', ascending=False)
 
     fig = plt.figure(figsize=(14, 5))
@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from watchtower import commits_
+from watchtower import commits_, load_rollup
 
 projects = [('docathon', 'watchtower'),
             ('scikit-learn', 'scikit-learn')]
@@ -33,17 +33,13 @@ since = pd.to_datetime(since)
 # Now plot pushes each day
 fig, axs = plt.subplots(nrows=2, figsize=(8, 6), sharex=True, sharey=True)
 for (user, project), ax in zip(projects, axs):
-    proj = commits_.load_commits(user, project)
-    proj['is_doc'] = commits_.is_doc(proj)
-    proj["datetime"] = [t.to_datetime() for t in proj["date"]]
-    proj = proj[proj["datetime"] > since]
-    proj.set_index("datetime", inplace=True)
-    all_commits = proj.resample(
-        '7D').count().replace(np.nan, 0).astype(int)
-    doc_commits = proj.resample(
-        '7D').sum().replace(np.nan, 0).astype(int)
-    ax.bar(np.arange(len(all_commits)), all_commits['is_doc'], label='all')
-    ax.bar(np.arange(len(doc_commits)), doc_commits['is_doc'], label='doc')
+    # Weekly counts of all and doc commits, updated by update_commits
+    counts = load_rollup(user, project, "commits", freq="W", by="doc",
+                         since=since)
+    # Categories without any commit have no column
+    counts = counts.reindex(columns=['all', 'doc'], fill_value=0)
+    ax.bar(np.arange(len(counts)), counts['all'], label='all')
+    ax.bar(np.arange(len(counts)), counts['doc'], label='doc')
     ax.set_title("{}/{}".format(user, project))
     ax.set_ylabel('# Commits', fontweight="bold")
 axs[-1].legend()
@@ -31,6 +31,7 @@ if __name__ == "__main__":
           description=DESCRIPTION,
           version=VERSION,
           install_requires=['tqdm', 'pandas', 'requests'],
+          extras_require={'parquet': ['pyarrow']},
           zip_safe=False,  # the package can run out of an .egg file
           classifiers=[
               'Intended Audience :: Developers',
@@ -1,3 +1,11 @@
 from . import commits_
 from . import issues_
 from . import comments_
+from ._catalog import list_datasets
+from ._rollups import rollup, load_rollup
+from ._config import set_storage
+from ._sqlite import query
+from ._rate_limit import TokenPool
+from ._github_api import make_session, make_cassette_session, set_session
+from ._http_cache import get_cache
+from ._load_cache import get_load_cache
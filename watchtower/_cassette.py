@@ -0,0 +1,243 @@
+"""
+Record / replay of GitHub's responses, to run syncs offline.
+
+A cassette is a folder holding the responses of a series of requests. In
+"record" mode, requests go to GitHub and the responses, headers included, are
+written to the cassette. In "replay" mode, requests are answered from the
+cassette, optionally after a simulated latency, and never reach the network.
+This makes the `update_*` functions repeatable, so their throughput and
+output can be measured offline and in CI.
+
+Requests are matched on their method, URL (with sorted query parameters) and
+json payload. Credentials are never written to the cassette. When a request
+is sent several times (e.g. when it is retried after a server error), the
+responses are replayed in the order they were recorded, the last one being
+repeated.
+
+The validators of the cache of `_http_cache` (`If-None-Match`,
+`If-Modified-Since`) are stripped from the requests to record, so that the
+cassette holds whole responses, along with their `ETag` and `Last-Modified`.
+A conditional request is then replayed whatever the state of the cache: it
+is answered `304 Not Modified` if its validators match the recorded response,
+and with the recorded response otherwise.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import RequestException
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+MODES = ("record", "replay", "auto")
+
+_CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+
+class CassetteMiss(RequestException):
+    """
+    Raised when a request to replay is not in the cassette.
+    """
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    A transport adapter recording responses to, or replaying them from, a
+    cassette.
+
+    Parameters
+    ----------
+    path : string
+        The folder of the cassette.
+
+    mode : "record" | "replay" | "auto", optional, default: "replay"
+        "record" sends every request and (over)writes its responses in the
+        cassette. "replay" answers from the cassette only, and raises
+        `CassetteMiss` for requests that were not recorded. "auto" replays
+        recorded requests and records the others.
+
+    latency : float, optional, default: 0.
+        The delay, in seconds, before a replayed response is returned.
+
+    adapter : requests.adapters.BaseAdapter | None, optional, default: None
+        The adapter used to send the requests to record. Defaults to an
+        `HTTPAdapter`.
+
+    sleep : callable, optional, default: time.sleep
+        Function used to simulate the latency.
+
+    Attributes
+    ----------
+    recorded : int
+        The number of responses written to the cassette.
+
+    replayed : int
+        The number of responses read from the cassette.
+    """
+
+    def __init__(self, path, mode="replay", latency=0., adapter=None,
+                 sleep=time.sleep):
+        if mode not in MODES:
+            raise ValueError("Unknown cassette mode %r, expected one of %s" %
+                             (mode, ", ".join(MODES)))
+        super(CassetteAdapter, self).__init__()
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.adapter = HTTPAdapter() if adapter is None else adapter
+        self.sleep = sleep
+        self.recorded = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
+        # Number of times each interaction was played in this session
+        self._plays = {}
+
+    def send(self, request, **kwargs):
+        key = _key(request)
+        if self.mode != "record":
+            response = self._replay(request, key)
+            if response is not None:
+                if self.latency:
+                    self.sleep(self.latency)
+                return response
+            if self.mode == "replay":
+                raise CassetteMiss(
+                    "%s %s is not in the cassette %s" % (
+                        request.method, request.url, self.path),
+                    request=request)
+
+        if _conditional(request):
+            # A 304 would not hold the body for a replay with a cold cache
+            request = request.copy()
+            for header in _CONDITIONAL_HEADERS:
+                request.headers.pop(header, None)
+        response = self.adapter.send(request, **kwargs)
+        self._record(request, key, response)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def _replay(self, request, key):
+        try:
+            with open(self._filename(key), "r") as f:
+                interaction = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        with self._lock:
+            play = self._plays.get(key, 0)
+            self._plays[key] = play + 1
+            self.replayed += 1
+        responses = interaction["responses"]
+        recorded = responses[min(play, len(responses) - 1)]
+        if _not_modified(request, recorded):
+            recorded = dict(recorded, status_code=304, reason="Not Modified",
+                            body="", encoding="utf-8")
+        return _build_response(request, recorded)
+
+    def _record(self, request, key, response):
+        filename = self._filename(key)
+        with self._lock:
+            # The first response of a session replaces the ones recorded by
+            # previous sessions.
+            responses = []
+            if self._plays.get(key):
+                with open(filename, "r") as f:
+                    responses = json.load(f)["responses"]
+            self._plays[key] = self._plays.get(key, 0) + 1
+            responses.append(_dump_response(response))
+            interaction = {"request": _dump_request(request),
+                           "responses": responses}
+            try:
+                os.makedirs(os.path.dirname(filename))
+            except OSError:
+                pass
+            with open(filename, "w") as f:
+                json.dump(interaction, f, indent=1, sort_keys=True)
+            self.recorded += 1
+
+
+def _conditional(request):
+    return any(h in request.headers for h in _CONDITIONAL_HEADERS)
+
+
+def _not_modified(request, recorded):
+    """
+    Return whether the validators of a conditional request match a recorded
+    response.
+    """
+    if recorded["status_code"] != 200:
+        return False
+    headers = requests.structures.CaseInsensitiveDict(recorded["headers"])
+    etag = request.headers.get("If-None-Match")
+    if etag is not None:
+        return etag == headers.get("ETag")
+    modified_since = request.headers.get("If-Modified-Since")
+    return (modified_since is not None and
+            modified_since == headers.get("Last-Modified"))
+
+
+def _normalized_url(url):
+    url = urlparse(url)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    return url._replace(query=query).geturl()
+
+
+def _body(request):
+    body = request.body
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    return body
+
+
+def _dump_request(request):
+    # Only what identifies the request: its headers hold the credentials,
+    # and its validators depend on the state of the cache.
+    return {"method": request.method,
+            "url": _normalized_url(request.url),
+            "body": _body(request)}
+
+
+def _key(request):
+    description = json.dumps(_dump_request(request), sort_keys=True)
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+
+def _dump_response(response):
+    content = response.content
+    try:
+        body, encoding = content.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        body, encoding = base64.b64encode(content).decode("ascii"), "base64"
+    return {"status_code": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "body": body,
+            "encoding": encoding}
+
+
+def _build_response(request, recorded):
+    response = requests.Response()
+    response.request = request
+    response.url = request.url
+    response.status_code = recorded["status_code"]
+    response.reason = recorded.get("reason")
+    response.headers.update(recorded["headers"])
+    # The body is stored decoded.
+    for header in ("Content-Encoding", "Content-Length",
+                   "Transfer-Encoding"):
+        response.headers.pop(header, None)
+    if recorded.get("encoding") == "base64":
+        response._content = base64.b64decode(recorded["body"])
+    else:
+        response._content = recorded["body"].encode("utf-8")
+    response.encoding = "utf-8"
+    return response
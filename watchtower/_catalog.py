@@ -0,0 +1,232 @@
+"""
+A catalog of the datasets stored in a data home.
+
+Finding out which datasets are stored, and how fresh they are, would
+otherwise take walking the data home and reading every dataset. The catalog,
+"<data_home>/catalog.json", holds one entry per dataset, updated each time
+the dataset is written (see `_io._update_and_save`) or synced (see
+`_sync.record_sync`):
+
+- "user", "project", "branch" (of the commits, None for the other resources)
+  and "resource";
+- "records", the number of records, and "bytes", their size on disk. With
+  the "sqlite" storage, this is the size of the database of the project;
+- "min_date" and "max_date", the range of the creation dates of the
+  records;
+- "saved_at" and "synced_at", the dates of the last write and sync.
+"""
+
+import os
+import json
+
+import pandas as pd
+
+from ._config import get_data_home, get_storage, DATETIME_FORMAT
+from . import _io
+from . import _sqlite
+
+CATALOG = "catalog.json"
+
+COLUMNS = ["user", "project", "branch", "resource", "records", "bytes",
+           "min_date", "max_date", "saved_at", "synced_at"]
+
+
+def list_datasets(data_home=None, user=None, project=None, resource=None):
+    """
+    List the datasets stored in a data home.
+
+    Only the catalog is read, whatever the number and size of the datasets.
+
+    Parameters
+    ----------
+    data_home : string, optional, default: None
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    user, project, resource : string | None, optional, default: None
+        Only list the datasets of this user, project, or resource (e.g.
+        "issues").
+
+    Returns
+    -------
+    datasets : pd.DataFrame
+        One row per dataset, with the columns described in `_catalog`,
+        sorted by user, project, resource and branch.
+    """
+    entries = _read(os.path.join(get_data_home(data_home), CATALOG))
+    entries = [entry for entry in entries.values()
+               if (user is None or entry["user"] == user) and
+               (project is None or entry["project"] == project) and
+               (resource is None or entry["resource"] == resource)]
+    datasets = pd.DataFrame(entries, columns=COLUMNS)
+    for column in ("min_date", "max_date", "saved_at", "synced_at"):
+        datasets[column] = pd.to_datetime(datasets[column], utc=True)
+    return datasets.sort_values(
+        ["user", "project", "resource", "branch"]).reset_index(drop=True)
+
+
+def update_dataset(data_home, filename, raw, added=None, replace=False):
+    """
+    Update the entry of a dataset after a write.
+
+    Parameters
+    ----------
+    data_home : string
+        The data home of the dataset.
+
+    filename : string
+        The path of the dataset, in `data_home`.
+
+    raw : pd.DataFrame
+        The records written.
+
+    added : int | None, optional, default: None
+        The number of records the write added to the dataset, if known.
+
+    replace : bool, optional, default: False
+        Whether `raw` replaced the content of the dataset.
+    """
+    dataset = _dataset(data_home, filename)
+    if dataset is None:
+        return
+
+    def update(entry):
+        if entry is None and not replace:
+            # Written before the catalog existed: read it once.
+            entry = _describe(filename, dataset)
+        else:
+            entry = dict(entry or _new_entry(dataset))
+            dates = ([] if replace else
+                     [entry["min_date"], entry["max_date"]])
+            entry["min_date"], entry["max_date"] = _date_range(raw, dates)
+            if added is not None and entry.get("records") is not None:
+                entry["records"] += added
+            else:
+                entry["records"] = _count(filename, raw, replace)
+        entry["bytes"] = _size(filename)
+        entry["saved_at"] = _now()
+        return entry
+
+    _update(data_home, dataset, update)
+
+
+def record_sync(data_home, filename, run_at):
+    """
+    Record the date of the last sync of a dataset.
+    """
+    dataset = _dataset(data_home, filename)
+    if dataset is None:
+        return
+
+    def update(entry):
+        if entry is None:
+            entry = _describe(filename, dataset)
+        entry = dict(entry, synced_at=run_at)
+        return entry
+
+    _update(data_home, dataset, update)
+
+
+def _dataset(data_home, filename):
+    """
+    Return the user, project, branch and resource of a dataset, or None if
+    it is not laid out as in a data home.
+    """
+    parts = os.path.relpath(filename, data_home).split(os.sep)
+    resource = os.path.splitext(parts[-1])[0]
+    if resource not in _sqlite.RESOURCES or ".." in parts:
+        return None
+    if resource == "commits" and len(parts) == 4:
+        return parts[0], parts[1], parts[2], resource
+    if len(parts) == 3:
+        return parts[0], parts[1], None, resource
+    return None
+
+
+def _key(dataset):
+    return "/".join(part for part in dataset if part is not None)
+
+
+def _new_entry(dataset):
+    user, project, branch, resource = dataset
+    return {"user": user, "project": project, "branch": branch,
+            "resource": resource, "records": 0, "bytes": 0,
+            "min_date": None, "max_date": None, "saved_at": None,
+            "synced_at": None}
+
+
+def _describe(filename, dataset):
+    """
+    Return the entry of a dataset, reading it.
+    """
+    entry = _new_entry(dataset)
+    try:
+        raw = _io._load(filename, columns=list(_io.PARTITION_COLUMNS))
+    except (ValueError, IOError):
+        return entry
+    entry["records"] = len(raw)
+    entry["min_date"], entry["max_date"] = _date_range(raw)
+    entry["bytes"] = _size(filename)
+    return entry
+
+
+def _date_range(raw, dates=()):
+    dates = [pd.Timestamp(date) for date in dates if date is not None]
+    for column in _io.PARTITION_COLUMNS:
+        if column in raw.columns:
+            created = pd.to_datetime(raw[column], utc=True,
+                                     errors="coerce").dropna()
+            if len(created):
+                dates.extend([created.min(), created.max()])
+            break
+    if not dates:
+        return None, None
+    return (min(dates).strftime(DATETIME_FORMAT),
+            max(dates).strftime(DATETIME_FORMAT))
+
+
+def _count(filename, raw, replace):
+    if replace:
+        return len(raw)
+    if get_storage() == "sqlite":
+        return _sqlite.count(filename)
+    return _io._count_keys(_io._partition_dir(filename))
+
+
+def _size(filename):
+    if get_storage() == "sqlite":
+        database = _sqlite._dataset(filename)[0]
+        filenames = [database, database + "-wal"]
+    else:
+        filenames = _io._list_partitions(_io._partition_dir(filename))
+    return sum(os.path.getsize(f) for f in filenames if os.path.exists(f))
+
+
+def _now():
+    return pd.Timestamp.utcnow().strftime(DATETIME_FORMAT)
+
+
+def _read(catalog_filename):
+    try:
+        with open(catalog_filename, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _update(data_home, dataset, update):
+    """
+    Replace the entry of `dataset` by `update(entry)`, entry being None if
+    the dataset is not in the catalog yet.
+    """
+    catalog_filename = os.path.join(data_home, CATALOG)
+    key = _key(dataset)
+    # Several processes may write datasets of the same data home
+    with _io._locked(catalog_filename):
+        entries = _read(catalog_filename)
+        entries[key] = update(entries.get(key))
+
+        def write(tmp_filename):
+            with open(tmp_filename, "w") as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+
+        _io._replace_atomically(catalog_filename, write)
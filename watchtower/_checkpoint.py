@@ -0,0 +1,127 @@
+"""
+Pagination checkpoints, so that an interrupted download can be resumed.
+
+While a listing is downloaded, each page is appended to a spool file stored
+next to the dataset, and the number of the last page fetched is recorded,
+along with the size of the spool once the page is written. If the download is
+interrupted, the next one with the same URL and parameters replays the
+spooled pages and carries on from the following page. Whatever was appended
+to the spool after the last recorded page, e.g. a line cut by a crash, is
+dropped.
+"""
+
+import os
+import json
+
+from ._io import _replace_atomically
+
+
+class PaginationCheckpoint(object):
+    """
+    Checkpoint of the download of a listing into a dataset.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset the listing is downloaded into.
+
+    url : string
+        The URL of the listing.
+
+    params : dict
+        The query parameters of the listing, except the page.
+
+    Attributes
+    ----------
+    page : int
+        The last page fetched, 0 if there is none.
+    """
+
+    def __init__(self, filename, url, params):
+        self.filename = filename
+        self.state_filename, self.pages_filename = _filenames(filename)
+        self.key = {"url": url,
+                    "params": {str(k): str(v) for k, v in params.items()
+                               if v is not None and k != "page"}}
+        self.page = 0
+        try:
+            with open(self.state_filename, "r") as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            state = None
+        if state is not None and state.get("key") == self.key:
+            self.page = state["page"]
+            self._truncate(state["offset"])
+        else:
+            # A checkpoint of another listing is stale.
+            self.clear()
+
+    def pages(self):
+        """
+        Yield the pages fetched before the interruption.
+        """
+        if not self.page:
+            return
+        with open(self.pages_filename, "rb") as f:
+            for line in f:
+                yield json.loads(line.decode("utf-8"))
+
+    def commit(self, page, entries):
+        """
+        Record that `page` was fetched, with content `entries`.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.pages_filename))
+        except OSError:
+            pass
+        with open(self.pages_filename, "ab") as f:
+            f.write((json.dumps(entries) + "\n").encode("utf-8"))
+            offset = f.tell()
+        self.page = page
+        state = {"key": self.key, "page": page, "offset": offset}
+
+        def write(tmp_filename):
+            with open(tmp_filename, "w") as f:
+                json.dump(state, f)
+
+        _replace_atomically(self.state_filename, write)
+
+    def _truncate(self, offset):
+        """
+        Drop what was appended to the spool after the last recorded page.
+        """
+        if not self.page:
+            return
+        try:
+            size = os.path.getsize(self.pages_filename)
+        except OSError:
+            size = 0
+        if size < offset:
+            # The spool lost pages: download them again
+            self.clear()
+        elif size > offset:
+            with open(self.pages_filename, "r+b") as f:
+                f.truncate(offset)
+
+    def clear(self):
+        """
+        Remove the checkpoint.
+        """
+        clear_checkpoint(self.filename)
+        self.page = 0
+
+
+def _filenames(filename):
+    stem = os.path.splitext(filename)[0]
+    return stem + ".checkpoint.json", stem + ".checkpoint.jsonl"
+
+
+def clear_checkpoint(filename):
+    """
+    Remove the checkpoint of the dataset `filename`, once it is saved.
+    """
+    for path in _filenames(filename):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
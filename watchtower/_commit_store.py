@@ -0,0 +1,272 @@
+"""
+A commit store shared by the branches of a project.
+
+Branches share most of their history: storing the commits of each branch on
+its own would store, and download, the shared history once per branch.
+Instead, the commits of all the branches of a project are stored once, keyed
+by sha, in "<data_home>/<user>/<project>/commit_store.json". The dataset of a
+branch, "<data_home>/<user>/<project>/<branch>/commits.json", only lists the
+commits of the branch: their "sha", and their "date" to partition them.
+
+A branch sync stops at the first page of commits that are all in the store:
+their ancestors are known too. The commits of the branch are then the ones
+downloaded, and their ancestors in the store, found by following the
+"parents" of the commits.
+
+The datasets of branches written by older versions, with whole commits, are
+still read as is, and moved to the store on their next sync.
+"""
+
+import os
+
+import pandas as pd
+
+from ._io import _load, _save, _update_and_save
+from . import _rollups
+
+STORE = "commit_store.json"
+
+# The columns of the dataset of a branch.
+MEMBERSHIP_COLUMNS = ["sha", "date"]
+
+
+def store_filename(filename):
+    """
+    Return the path of the store of the project of a branch dataset.
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(filename)), STORE)
+
+
+def load_branch(filename, columns=None):
+    """
+    Read the commits of a branch.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset of the branch, e.g.
+        "<data_home>/matplotlib/matplotlib/master/commits.json".
+
+    columns : list of strings | None, optional, default: None
+        The columns to read from the store. If None, all the columns are
+        read.
+
+    Returns
+    -------
+    commits : pd.DataFrame
+
+    Raises
+    ------
+    IOError if the dataset does not exist, ValueError if it can't be parsed.
+    """
+    members = _load(filename)
+    if _is_legacy(members):
+        if columns is not None:
+            members = members[[c for c in columns if c in members.columns]]
+        return members
+    read = None
+    if columns is not None:
+        read = list(columns) + ([] if "sha" in columns else ["sha"])
+    store = _load(store_filename(filename), columns=read)
+    shas = members["sha"] if "sha" in members.columns else []
+    commits = store[store["sha"].isin(shas)].reset_index(drop=True)
+    if columns is not None:
+        commits = commits[[c for c in columns if c in commits.columns]]
+    return commits
+
+
+def known_shas(filename):
+    """
+    Return the shas of the commits in the store of the project of a branch
+    dataset.
+    """
+    try:
+        store = _load(store_filename(filename), columns=["sha"])
+    except (ValueError, IOError):
+        return set()
+    return set(store["sha"]) if "sha" in store.columns else set()
+
+
+def load_index(filename):
+    """
+    Return the index of a branch, to pass to `add_commits` when storing
+    several batches of commits, so that it is read once.
+
+    Returns
+    -------
+    index : dict
+        With keys "members", the shas of the commits of the branch, "known",
+        the ones of the store, and "parents", the parents of the commits of
+        the store, read when first needed.
+    """
+    try:
+        members = set(_load(filename, columns=["sha"])["sha"])
+    except (ValueError, IOError, KeyError):
+        members = set()
+    return {"members": members, "known": known_shas(filename),
+            "parents": None}
+
+
+def add_commits(filename, raw, data_home=None, index=None):
+    """
+    Store commits of a branch: in the store, and in the dataset of the
+    branch, along with their ancestors, which are added to the counts of
+    activity of the branch (see `_rollups`).
+
+    The ancestors are found from the "parents" of `raw`. The store is only
+    read for the ancestors of the commits that are in the store, but not in
+    the branch, e.g. for the first sync of a branch forked from a synced
+    one.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset of the branch.
+
+    raw : pd.DataFrame
+        The commits, with their "sha", "date" and "parents".
+
+    data_home : string | None, optional, default: None
+        The data home of the datasets, whose catalog is updated.
+
+    index : dict | None, optional, default: None
+        The index of the branch, as returned by `load_index`, and updated
+        with the commits stored. Read if None.
+    """
+    if not len(raw):
+        return
+    if index is None:
+        index = load_index(filename)
+    members, known = index["members"], index["known"]
+    store = store_filename(filename)
+    _update_and_save(store, raw, data_home=data_home)
+
+    shas = set(raw["sha"])
+    parents = _parents(raw)
+    found = _ancestors(shas, parents, members)
+    # Ancestors outside of the batch, in the store but not in the branch
+    stored = (found - shas) & known
+    if stored:
+        if index["parents"] is None:
+            index["parents"] = _parents(_load(store,
+                                              columns=["sha", "parents"]))
+        found |= _ancestors(stored, index["parents"], members)
+    if index["parents"] is not None:
+        index["parents"].update(parents)
+
+    new = raw[raw["sha"].isin(found)]
+    ancestors = (found - shas) & known
+    if ancestors:
+        commits = _load(store, columns=MEMBERSHIP_COLUMNS + [
+            "message", "author_login"])
+        new = pd.concat([new, commits[commits["sha"].isin(ancestors)]],
+                        ignore_index=True, sort=False)
+    _update_and_save(filename, new[MEMBERSHIP_COLUMNS], data_home=data_home)
+    # The commits of a new branch are all in `new`
+    _rollups.add(filename, new, "commits", complete=not members)
+    members.update(new["sha"])
+    known.update(shas)
+
+
+def migrate_branch(filename, data_home=None):
+    """
+    Move the commits of a branch dataset written by an older version to the
+    store.
+    """
+    try:
+        raw = _load(filename)
+    except (ValueError, IOError):
+        return
+    if not _is_legacy(raw):
+        return
+    _update_and_save(store_filename(filename), raw, data_home=data_home)
+    _save(filename, raw[[c for c in MEMBERSHIP_COLUMNS if c in raw.columns]],
+          data_home=data_home)
+
+
+def stop_at_known(batches, known, info=None):
+    """
+    Yield batches of commits, listed from the most recent, and stop after the
+    first batch of commits that are all in the store.
+
+    Parameters
+    ----------
+    batches : iterator of lists of dicts
+        The commits, e.g. as yielded by `_github_api.iter_records`.
+
+    known : set of strings
+        The shas of the commits in the store.
+
+    info : dict | None, optional, default: None
+        The pagination info of the listing, marked complete when the listing
+        is stopped.
+    """
+    try:
+        for batch in batches:
+            yield batch
+            if _all_known(batch, known):
+                if info is not None:
+                    info["complete"] = True
+                return
+    finally:
+        # Stops the downloads in flight
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+
+
+async def astop_at_known(batches, known, info=None):
+    """
+    Asynchronous version of `stop_at_known`.
+    """
+    try:
+        async for batch in batches:
+            yield batch
+            if _all_known(batch, known):
+                if info is not None:
+                    info["complete"] = True
+                return
+    finally:
+        await batches.aclose()
+
+
+def _all_known(batch, known):
+    return all(_sha(commit) in known for commit in batch)
+
+
+def _sha(commit):
+    # The git backend yields commits along with their files
+    if isinstance(commit, tuple):
+        commit = commit[0]
+    return commit["sha"]
+
+
+def _is_legacy(raw):
+    return bool(set(raw.columns) - set(MEMBERSHIP_COLUMNS))
+
+
+def _parents(commits):
+    """
+    Return the shas of the parents of commits, by sha.
+    """
+    if "parents" not in commits.columns:
+        return {}
+    return {sha: [p["sha"] for p in ps if isinstance(p, dict)]
+            for sha, ps in zip(commits["sha"], commits["parents"])
+            if isinstance(ps, list)}
+
+
+def _ancestors(shas, parents, members):
+    """
+    Return the commits of `shas` and their ancestors that are not in
+    `members`, following `parents`.
+    """
+    found = set()
+    stack = [sha for sha in shas if sha not in members]
+    while stack:
+        sha = stack.pop()
+        if sha in found or sha in members:
+            continue
+        found.add(sha)
+        stack.extend(parents.get(sha, ()))
+    return found
@@ -7,10 +7,20 @@ from os.path import join
 from os.path import exists
 from os.path import expanduser
 from os import makedirs
+import re
 import shutil
 
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+# The storages of the datasets, see get_storage.
+STORAGES = ("files", "sqlite")
+
+# Storage set with set_storage, overriding the environment.
+_STORAGE = None
+
+# The compressions of the dataset files, see get_compression.
+COMPRESSIONS = ("none", "gzip", "zstd")
+
 
 def get_data_home(data_home=None):
     """Return the path of the watchtower data dir.
@@ -48,6 +58,87 @@ def get_data_home(data_home=None):
     return data_home
 
 
+def get_storage(storage=None):
+    """Return the storage of the datasets.
+
+    Parameters
+    ----------
+    storage : "files" | "sqlite" | None, optional, default: None
+        If None, the storage set with `set_storage` is used, else the one
+        given by the 'WATCHTOWER_STORAGE' environment variable, and "files"
+        if it is not set.
+
+        With "files", each dataset is a folder of monthly Parquet (or json)
+        partitions. With "sqlite", the datasets of a project are stored in
+        an indexed SQLite database, "<data_home>/<user>/<project>/
+        watchtower.sqlite", which can be queried with `_sqlite.query`.
+
+    Returns
+    -------
+    storage : string
+    """
+    if storage is None:
+        storage = _STORAGE
+    if storage is None:
+        storage = environ.get('WATCHTOWER_STORAGE', 'files')
+    if storage not in STORAGES:
+        raise ValueError("Unknown storage %r, expected one of %s" % (
+            storage, ", ".join(STORAGES)))
+    return storage
+
+
+def set_storage(storage):
+    """Set the storage of the datasets used by `load_*` and `update_*`.
+
+    Parameters
+    ----------
+    storage : "files" | "sqlite" | None
+        See `get_storage`. If None, the environment decides again.
+    """
+    global _STORAGE
+    if storage is not None:
+        get_storage(storage)
+    _STORAGE = storage
+
+
+def get_compression(compression=None):
+    """Return the compression of the dataset files.
+
+    Parameters
+    ----------
+    compression : "none" | "gzip" | "zstd" | None, optional, default: None
+        If None, the 'WATCHTOWER_COMPRESSION' environment variable is used,
+        and "gzip" if it is not set. Parquet files are compressed by pyarrow,
+        see `get_parquet_compression`. json files are compressed as a whole,
+        zstd requiring the zstandard package.
+
+    Returns
+    -------
+    compression : string
+    """
+    if compression is None:
+        compression = environ.get('WATCHTOWER_COMPRESSION', 'gzip')
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression %r, expected one of %s" % (
+            compression, ", ".join(COMPRESSIONS)))
+    return compression
+
+
+def get_parquet_compression():
+    """Return the compression of the Parquet files.
+
+    Returns
+    -------
+    compression : "none" | "gzip" | "zstd" | None
+        The compression set by the 'WATCHTOWER_COMPRESSION' environment
+        variable, or None if it is not set, for pyarrow's default codec
+        (snappy), faster to decompress than gzip.
+    """
+    if 'WATCHTOWER_COMPRESSION' not in environ:
+        return None
+    return get_compression()
+
+
 def get_API_token(token_key="GITHUB_API"):
     """Return the API token.
 
@@ -71,6 +162,31 @@ def get_API_token(token_key="GITHUB_API"):
     return token
 
 
+def get_API_tokens(token_key="GITHUB_API"):
+    """Return all the API tokens found in the environment.
+
+    Parameters
+    ----------
+    token_key : string
+        The prefix of the variables of `os.environ` pointing to API tokens.
+        `token_key` itself is used, as well as the same name followed by a
+        number, e.g. GITHUB_API, GITHUB_API2, GITHUB_API_3.
+
+    Returns
+    -------
+    tokens : list of strings
+        The github API tokens found, `token_key` first, then by number.
+    """
+    pattern = re.compile("^%s(?:_?([0-9]+))?$" % re.escape(token_key))
+    numbers = {}
+    for key in environ:
+        match = pattern.match(key)
+        if match:
+            numbers[key] = int(match.group(1) or 0)
+    keys = sorted(numbers, key=lambda key: (numbers[key], key))
+    return [environ[key] for key in keys]
+
+
 def clear_data_home(data_home=None):
     """
     Delete all the content of the data home cache.
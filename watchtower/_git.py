@@ -0,0 +1,138 @@
+"""
+A local git clone backend to read the commits of a project.
+
+With the REST API, the listing of commits takes one request per 100 commits,
+bounded by `max_pages`, and the files changed by each commit one request per
+commit. Reading a clone takes no request at all: `git log --numstat` is
+streamed, and its records are converted to the same format as the REST API,
+so that they can be stored in the same datasets. The commits are not
+attributed to GitHub users: their "author" and "committer" are None.
+"""
+
+import subprocess
+
+# Separators of the fields and records of the `git log` output, which are
+# unlikely to be in commit messages.
+_FIELD = "\x1f"
+_START = "\x1e"
+_END = "\x1d"
+
+_FORMAT = _START + _FIELD.join(
+    ["%H", "%P", "%an", "%ae", "%aI", "%cn", "%ce", "%cI", "%B"]) + _END
+
+
+def resolve_ref(clone, branch):
+    """
+    Return the ref of `branch` in a clone: the local branch, or else the one
+    of the "origin" remote.
+    """
+    for ref in (branch, "origin/" + branch):
+        result = subprocess.run(
+            ["git", "-C", clone, "rev-parse", "--verify", "--quiet",
+             ref + "^{commit}"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            return ref
+    raise ValueError("No branch %r in the clone %s" % (branch, clone))
+
+
+def iter_commits(clone, ref, user, project, since=None):
+    """
+    Yield the commits of a branch of a clone, from the most recent.
+
+    Parameters
+    ----------
+    clone : string
+        The path of the clone.
+
+    ref : string
+        The branch, as returned by `resolve_ref`.
+
+    user, project : string
+        The GitHub project of the clone, for the URLs of the commits.
+
+    since : string | None, optional, default: None
+        Only yield the commits committed since this date.
+
+    Yields
+    ------
+    commit, detail : dict, dict
+        The commit, as listed by the REST API, and its details, with the
+        "files" and "stats" of the commit, as returned for a single commit.
+    """
+    # Paths with non-ASCII characters are not quoted
+    command = ["git", "-C", clone, "-c", "core.quotePath=false", "log", ref,
+               "--numstat", "--no-renames", "--format=" + _FORMAT]
+    if since is not None:
+        command.append("--since=%s" % since)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, encoding="utf-8",
+                               errors="replace")
+    try:
+        header = None
+        commit = None
+        for line in process.stdout:
+            if header is not None:
+                # Still in the message of the commit
+                header.append(line)
+                if _END in line:
+                    commit = _parse_header("".join(header), user, project)
+                    header = None
+            elif line.startswith(_START):
+                if commit is not None:
+                    yield commit
+                commit = None
+                header = [line[len(_START):]]
+                if _END in line:
+                    commit = _parse_header("".join(header), user, project)
+                    header = None
+            elif commit is not None and line.strip():
+                _add_numstat(commit[1], line)
+        if commit is not None:
+            yield commit
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise ValueError("git log failed: %s" % stderr.strip())
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def _parse_header(header, user, project):
+    header = header[:header.rindex(_END)]
+    (sha, parents, author_name, author_email, authored_at, committer_name,
+     committer_email, committed_at, message) = header.split(_FIELD, 8)
+    commit = {
+        "sha": sha,
+        "url": "https://api.github.com/repos/%s/%s/commits/%s" % (
+            user, project, sha),
+        "html_url": "https://github.com/%s/%s/commit/%s" % (
+            user, project, sha),
+        "commit": {
+            "message": message.strip(),
+            "author": {"name": author_name, "email": author_email,
+                       "date": authored_at},
+            "committer": {"name": committer_name, "email": committer_email,
+                          "date": committed_at},
+        },
+        "author": None,
+        "committer": None,
+        "parents": [{"sha": parent} for parent in parents.split()],
+    }
+    detail = {"sha": sha, "files": [],
+              "stats": {"additions": 0, "deletions": 0}}
+    return commit, detail
+
+
+def _add_numstat(detail, line):
+    additions, deletions, filename = line.rstrip("\n").split("\t", 2)
+    # Binary files have no line counts
+    additions = 0 if additions == "-" else int(additions)
+    deletions = 0 if deletions == "-" else int(deletions)
+    detail["files"].append({"filename": filename, "additions": additions,
+                            "deletions": deletions})
+    detail["stats"]["additions"] += additions
+    detail["stats"]["deletions"] += deletions
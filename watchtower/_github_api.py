@@ -5,19 +5,69 @@ and testing…
 Mostly this is some copy paste of github_state's code
 """
 
+import asyncio
+import functools
 import requests
 import collections
+import itertools
+import random
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from requests.exceptions import ConnectionError as NetworkError, Timeout
+from requests.utils import parse_header_links
+from urllib.parse import urlparse, parse_qs
 from pandas import to_datetime
 from numpy import ndarray
 
+from ._config import get_API_tokens
+from ._rate_limit import TokenPool
+from ._checkpoint import PaginationCheckpoint
+from ._cassette import CassetteAdapter
+from ._schema import project_records
+
 Auth = collections.namedtuple('Auth', 'user auth')
 # else, it raises weird errors from time to time.
 # cf https://github.com/tqdm/tqdm/issues/481
 tqdm.monitor_interval = 0
 
+DEFAULT_HEADERS = {
+    "Accept": "application/vnd.github.v3+json",
+    "User-Agent": "watchtower",
+}
+
+# Shared session, lazily created by get_session.
+_SESSION = None
+
+# The number of times a request is retried when GitHub asks to back off.
+MAX_RATE_LIMIT_RETRIES = 5
+
+# The number of times a request is retried on a server or network error, and
+# the base delay (in seconds) of the exponential backoff between attempts.
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class PaginationError(HTTPError):
+    """
+    Raised when a page of a listing can't be fetched, after the first one.
+
+    Attributes
+    ----------
+    page : int
+        The page that failed.
+    """
+
+    def __init__(self, page, error):
+        self.page = page
+        super(PaginationError, self).__init__(
+            "Could not fetch page %d, the listing is incomplete: %s" % (
+                page, error),
+            response=getattr(error, "response", None))
+
 
 def colon_seperated_pair(arg):
     pair = arg.split(':', 1)
@@ -27,28 +77,329 @@ def colon_seperated_pair(arg):
         return Auth(*pair)
 
 
+def get_auth(auth=None):
+    """
+    Return the pool of credentials to use for the requests.
+
+    Parameters
+    ----------
+    auth : string | list of strings | TokenPool | None, optional
+        The username / API key for github, separated by a colon, or a list
+        of those. If None, all the `GITHUB_API*` keys found in `environ` are
+        used (see `_config.get_API_tokens`), and requests are anonymous if
+        there are none.
+
+    Returns
+    -------
+    pool : TokenPool
+    """
+    if isinstance(auth, TokenPool):
+        return auth
+    if auth is None:
+        auth = get_API_tokens()
+    elif isinstance(auth, (str, Auth)):
+        auth = [auth]
+    auths = [colon_seperated_pair(a) if isinstance(a, str) else a
+             for a in auth]
+    return TokenPool(auths if len(auths) else [None])
+
+
+def make_session(auth=None, pool_connections=10, pool_maxsize=10,
+                 headers=None, keep_alive=True):
+    """
+    Create a pooled HTTP session to talk to GitHub's API.
+
+    Parameters
+    ----------
+    auth : tuple | Auth | None, optional, default: None
+        Default credentials used by every request of the session.
+
+    pool_connections : int, optional, default: 10
+        The number of connection pools (one per host) to cache.
+
+    pool_maxsize : int, optional, default: 10
+        The maximum number of connections kept alive in each pool.
+
+    headers : dict | None, optional, default: None
+        Extra headers sent with every request, on top of
+        `DEFAULT_HEADERS`.
+
+    keep_alive : bool, optional, default: True
+        Whether to reuse connections between requests.
+
+    Returns
+    -------
+    session : requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    if headers is not None:
+        session.headers.update(headers)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    if auth is not None:
+        session.auth = auth
+    return session
+
+
+def make_cassette_session(path, mode="replay", latency=0., **kwargs):
+    """
+    Create a session recording responses to, or replaying them from, a
+    cassette.
+
+    Parameters
+    ----------
+    path : string
+        The folder of the cassette.
+
+    mode : "record" | "replay" | "auto", optional, default: "replay"
+        Whether to record the responses of GitHub, replay the recorded ones
+        without hitting the network, or replay the recorded ones and record
+        the others. See `_cassette.CassetteAdapter`.
+
+    latency : float, optional, default: 0.
+        The delay, in seconds, added to each replayed response.
+
+    kwargs : dict
+        Passed to `make_session`.
+
+    Returns
+    -------
+    session : requests.Session
+        The session. Its cassette adapter, with the "recorded" and
+        "replayed" counters, is `session.get_adapter("https://")`.
+
+    Examples
+    --------
+    Record a sync once, then replay it offline:
+
+    >>> set_session(make_cassette_session("cassette", mode="record"))
+    >>> update_issues("matplotlib", "matplotlib")
+    >>> set_session(make_cassette_session("cassette", latency=0.05))
+    >>> update_issues("matplotlib", "matplotlib")
+    """
+    session = make_session(**kwargs)
+    adapter = CassetteAdapter(path, mode=mode, latency=latency,
+                              adapter=session.get_adapter("https://"))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(session=None):
+    """
+    Return the session to use for a request.
+
+    Parameters
+    ----------
+    session : requests.Session | None, optional, default: None
+        If provided, returned as is. Else, the shared session is returned,
+        created with `make_session` on first use.
+
+    Returns
+    -------
+    session : requests.Session
+    """
+    global _SESSION
+    if session is not None:
+        return session
+    if _SESSION is None:
+        _SESSION = make_session()
+    return _SESSION
+
+
+def set_session(session):
+    """
+    Set the session shared by all the `update_*` functions.
+
+    Parameters
+    ----------
+    session : requests.Session | None
+        The new shared session. If None, a default one will be created on
+        next use.
+    """
+    global _SESSION
+    _SESSION = session
+
+
+def _get_json(session, url, params=None, auth=None, cache=None):
+    """
+    Send a GET request and return the decoded json and the headers.
+
+    If a `ValidatorCache` is provided, the request is made conditional on the
+    validators of the last response, and the cached body is returned when
+    GitHub answers `304 Not Modified`.
+    """
+    entry = None
+    headers = {}
+    if cache is not None:
+        entry = cache.get(url, params)
+        headers = cache.conditional_headers(entry)
+    r = _send(session, url, params=params, auth=auth, headers=headers)
+    if entry is not None and r.status_code == 304:
+        cache.count(hit=True)
+        cached_headers = dict(entry["headers"])
+        cached_headers.update(r.headers)
+        return entry["body"], cached_headers
+
+    r.raise_for_status()
+    json = r.json()
+    if cache is not None:
+        cache.count(hit=False)
+        cache.set(url, params, r.headers, json)
+    return json, r.headers
+
+
+def _parse_links(headers):
+    """
+    Return the pagination links of a response, as a {rel: url} dictionary.
+    """
+    link = headers.get("Link", headers.get("link"))
+    if not link:
+        return {}
+    return {link["rel"]: link["url"] for link in parse_header_links(link)
+            if "rel" in link}
+
+
+def _page_number(url):
+    """
+    Return the page number of a pagination URL.
+    """
+    query = parse_qs(urlparse(url).query)
+    return int(query.get("page", ["1"])[0])
+
+
+def _send(session, url, params=None, auth=None, headers=None,
+          method="GET", json=None):
+    """
+    Send a request, scheduling the credentials of the pool `auth`.
+
+    Requests hitting the secondary rate limit are retried after the delay
+    given by `Retry-After`. Requests hitting the primary rate limit are
+    retried with another credential of the pool, or once the limit resets.
+    Server and network errors are retried `MAX_RETRIES` times, with a
+    jittered exponential backoff.
+    """
+    pool = auth if isinstance(auth, TokenPool) else TokenPool([auth])
+    retries = 0
+    attempt = 0
+    while True:
+        token = pool.acquire()
+        try:
+            r = session.request(method, url,
+                                params=params,
+                                auth=token,
+                                headers=headers,
+                                json=json)
+        except (NetworkError, Timeout):
+            if attempt >= MAX_RETRIES:
+                raise
+            pool.wait(token, _backoff(attempt))
+            attempt += 1
+            continue
+        pool.update(token, r.headers)
+        if r.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            pool.wait(token, _backoff(attempt))
+            attempt += 1
+            continue
+        if r.status_code not in (403, 429) or \
+                retries >= MAX_RATE_LIMIT_RETRIES:
+            return r
+        retry_after = r.headers.get("Retry-After")
+        if retry_after is not None:
+            retries += 1
+            pool.wait(token, int(retry_after))
+        elif r.headers.get("X-RateLimit-Remaining") == "0":
+            # acquire will switch to another token, or wait for the reset.
+            retries += 1
+        else:
+            return r
+
+
+def _backoff(attempt):
+    """
+    Return the delay before retrying for the `attempt`-th time ("full
+    jitter": uniformly drawn below an exponentially growing bound).
+    """
+    return random.uniform(0, BACKOFF_FACTOR * 2 ** attempt)
+
+
 def get_frames(auth, url, max_pages=100, per_page=100,
-               verbose=False, direction="asc", **params):
+               verbose=False, direction="asc", session=None, cache=None,
+               n_jobs=4, checkpoint=None, **params):
     """Return all commit data from a URL"""
     entries = get_entries(auth, url, max_pages=max_pages,
                           per_page=per_page, verbose=verbose,
-                          direction=direction,
+                          direction=direction, session=session,
+                          cache=cache, n_jobs=n_jobs, checkpoint=checkpoint,
                           **params)
-    total = sum(entries, [])
+    total = list(itertools.chain.from_iterable(entries))
     return total
 
 
+def iter_records(auth, url, max_pages=100, per_page=100, batch_size=None,
+                 verbose=False, direction="asc", session=None, cache=None,
+                 n_jobs=4, checkpoint=None, projection=None, info=None,
+                 **params):
+    """
+    Yield the records of a listing as the pages arrive.
+
+    Parameters
+    ----------
+    batch_size : int | None, optional, default: None
+        If None, records are yielded one by one. Else, they are yielded as
+        lists of `batch_size` records (the last one may be shorter).
+
+    projection : dict | None, optional, default: None
+        If provided, each page is projected on these fields as it arrives
+        (see `_schema.get_fields`).
+
+    All other parameters are passed to `get_entries`.
+
+    Yields
+    ------
+    record : dict | list of dicts
+        A record, or a batch of records.
+    """
+    entries = get_entries(auth, url, max_pages=max_pages,
+                          per_page=per_page, verbose=verbose,
+                          direction=direction, session=session,
+                          cache=cache, n_jobs=n_jobs, checkpoint=checkpoint,
+                          info=info, **params)
+    entries = (project_records(entry, projection) for entry in entries)
+    if batch_size is None:
+        for entry in entries:
+            for record in entry:
+                yield record
+        return
+
+    batch = []
+    for entry in entries:
+        batch.extend(entry)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
 def get_entries(auth, url, max_pages=100, per_page=100,
                 direction="asc",
-                verbose=False, **params):
+                verbose=False, session=None, cache=None, n_jobs=4,
+                checkpoint=None, info=None, **params):
     """
     Get entries from GitHub
 
     Parameters
     ----------
-    auth : string
+    auth : Auth | TokenPool
         GitHub's authentification hash:
             username:858354186d58153086706507501f5a84423426a1
+        or a pool of those, as returned by `get_auth`.
     url : string
         The URL of the github repository
     max_pages : int
@@ -59,43 +410,170 @@ def get_entries(auth, url, max_pages=100, per_page=100,
         Controls progress bar display.
     direction : string, optional, default="asc"
         "asc" or "desc"
+    session : requests.Session | None, optional, default: None
+        The session to use. Defaults to the shared session.
+    cache : ValidatorCache | None, optional, default: None
+        If provided, requests are made conditional on the ETag /
+        Last-Modified of the previous run, and unchanged pages are read
+        from the cache.
+    n_jobs : int, optional, default: 4
+        The number of pages fetched concurrently once the number of pages
+        is known from the `Link` header of the first response.
+    checkpoint : string | None, optional, default: None
+        The path of the dataset the entries are downloaded into. If
+        provided, fetched pages are checkpointed next to it, and a download
+        interrupted by an error resumes where it stopped. The checkpoint
+        must be removed with `_checkpoint.clear_checkpoint` once the dataset
+        is saved.
+    info : dict | None, optional, default: None
+        If provided, filled with "last_page" (the last page fetched),
+        "etag" (the ETag of the first page) and "complete" (whether the
+        listing was read to its end, rather than stopped by `max_pages` or
+        an error).
     params : dict-like
-        Will be passed to requests.get
+        Will be passed as query parameters to `session.get`
 
     Yields
     ------
     json : json object
         The returned commit information.
     """
-    # TODO this should only fetch new stuff.
     params = {} if params is None else params
-    iter_indices = range(1, max_pages + 1)
     if 'per_page' not in params.keys():
         params['per_page'] = per_page
     params["direction"] = direction
     if verbose is True:
         print('Updating repository: {}\nParams: {}'.format(url, params))
-        iter_indices = tqdm(iter_indices)
-    for page in iter_indices:  # for safety
-        params["page"] = str(page)
-        try:
-            r = requests.get(url,
-                             params=params,
-                             auth=auth)
-
-            r.raise_for_status()
-            json = r.json()
-            if not json:
-                # empty list
-                break
+    info = {} if info is None else info
+    info.update(last_page=0, etag=None, complete=False)
+    start_page = 1
+    if checkpoint is not None:
+        checkpoint = PaginationCheckpoint(checkpoint, url, params)
+        if checkpoint.page and verbose is True:
+            print("Resuming from page %d" % (checkpoint.page + 1))
+        for json in checkpoint.pages():
             yield json
+        start_page = checkpoint.page + 1
+        info["last_page"] = checkpoint.page
+    pages = _iter_pages(auth, url, params, max_pages=max_pages,
+                        session=session, cache=cache, n_jobs=n_jobs,
+                        verbose=verbose, start_page=start_page, info=info)
+    for page, json in pages:
+        if checkpoint is not None:
+            checkpoint.commit(page, json)
+        info["last_page"] = page
+        yield json
+
+
+def _iter_pages(auth, url, params, max_pages=100, session=None, cache=None,
+                n_jobs=4, verbose=False, start_page=1, info=None):
+    """
+    Yield (page number, json) for each non-empty page of a listing.
+
+    The first page is fetched on its own. If its `Link` header points to the
+    last page, the remaining pages are then fetched concurrently, `n_jobs` at
+    a time, and yielded in order. Else, `next` links are followed one page at
+    a time.
+
+    An error on the first page is turned into a warning, as before. An error
+    on a later page raises a `PaginationError`, as the listing would
+    otherwise silently be truncated.
+
+    If provided, `info["etag"]` is set to the ETag of the first page, and
+    `info["complete"]` to True once the end of the listing is reached.
+    """
+    session = get_session(session)
+    info = {} if info is None else info
+
+    def fetch(page):
+        page_params = dict(params)
+        page_params["page"] = str(page)
+        return _get_json(session, url, params=page_params, auth=auth,
+                         cache=cache)
+
+    if start_page > max_pages:
+        return
+    progress = tqdm(total=max_pages, initial=start_page - 1) \
+        if verbose is True else None
+    executor = None
+    futures = ()
+    try:
+        try:
+            json, headers = fetch(start_page)
         except HTTPError as e:
+            if start_page > 1:
+                raise PaginationError(start_page, e)
             # Github sometimes just throws an error
             warnings.warn("Latest request raised an error: %s" % e)
-            break
+            return
+        if start_page == 1:
+            info["etag"] = headers.get("ETag")
+        if not json:
+            # empty list
+            info["complete"] = True
+            return
+        if progress is not None:
+            progress.update()
+        yield start_page, json
+        links = _parse_links(headers)
 
+        if "last" in links:
+            last_page = min(_page_number(links["last"]), max_pages)
+            if progress is not None:
+                progress.total = last_page
+                progress.refresh()
+            n_jobs = max(1, n_jobs)
+            pages = iter(range(start_page + 1, last_page + 1))
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            # At most `n_jobs` pages are in flight: the pages past them are
+            # only requested as the listing is consumed, so that no request
+            # is spent on them if the consumer stops early.
+            futures = collections.deque(
+                (page, executor.submit(fetch, page))
+                for page in itertools.islice(pages, n_jobs))
+            # Results are consumed in page order.
+            while futures:
+                page, future = futures.popleft()
+                try:
+                    json, _ = future.result()
+                except (HTTPError, NetworkError, Timeout) as e:
+                    raise PaginationError(page, e)
+                for next_page in itertools.islice(pages, 1):
+                    futures.append((next_page,
+                                    executor.submit(fetch, next_page)))
+                if not json:
+                    info["complete"] = True
+                    return
+                if progress is not None:
+                    progress.update()
+                yield page, json
+            info["complete"] = _page_number(links["last"]) <= max_pages
+        else:
+            page = start_page
+            while "next" in links and page < max_pages:
+                page += 1
+                try:
+                    json, headers = fetch(page)
+                except (HTTPError, NetworkError, Timeout) as e:
+                    raise PaginationError(page, e)
+                if not json:
+                    info["complete"] = True
+                    return
+                if progress is not None:
+                    progress.update()
+                yield page, json
+                links = _parse_links(headers)
+            info["complete"] = "next" not in links
+    finally:
+        if executor is not None:
+            for _, future in futures:
+                future.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+        if progress is not None:
+            progress.close()
 
-def get_detailed_page(auth, url, params=None):
+
+def get_detailed_page(auth, url, params=None, session=None, cache=None):
     """
     Get detailed page
 
@@ -109,14 +587,18 @@ def get_detailed_page(auth, url, params=None):
         
     url : string
         The URl of the github repository
+
+    session : requests.Session | None, optional, default: None
+        The session to use. Defaults to the shared session.
+
+    cache : ValidatorCache | None, optional, default: None
+        If provided, the request is made conditional on the ETag /
+        Last-Modified of the previous run.
     """
+    session = get_session(session)
     try:
-        r = requests.get(url,
-                         params=params,
-                         auth=auth)
-
-        r.raise_for_status()
-        json = r.json()
+        json, _ = _get_json(session, url, params=params, auth=auth,
+                            cache=cache)
         if not json:
             # empty list
             return
@@ -127,6 +609,110 @@ def get_detailed_page(auth, url, params=None):
         return
 
 
+# Returned by `next` once a listing is read to its end.
+_DONE = object()
+
+
+async def _arun(limiter, func, *args, **kwargs):
+    """
+    Run the blocking `func` in the default executor of the running loop,
+    holding the semaphore `limiter`.
+    """
+    loop = asyncio.get_running_loop()
+    async with limiter:
+        return await loop.run_in_executor(
+            None, functools.partial(func, *args, **kwargs))
+
+
+async def aget_entries(auth, url, max_pages=100, per_page=100,
+                       direction="asc", verbose=False, session=None,
+                       cache=None, n_jobs=4, checkpoint=None, limiter=None,
+                       info=None, **params):
+    """
+    Asynchronous version of `get_entries`.
+
+    The pages are read from `get_entries`, advanced in the default executor
+    of the running loop, so that the pagination, caching, rate limiting,
+    retry and checkpoint logic are the ones of `get_entries`.
+
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once, each of them
+        fetching up to `n_jobs` pages concurrently. Share the same semaphore
+        between calls to bound the concurrency of a whole sync. If None, the
+        listing is not bounded by other calls.
+
+    All other parameters are the ones of `get_entries`.
+
+    Yields
+    ------
+    json : json object
+        The pages of the listing, in order.
+    """
+    loop = asyncio.get_running_loop()
+    limiter = asyncio.Semaphore(1) if limiter is None else limiter
+    entries = get_entries(auth, url, max_pages=max_pages, per_page=per_page,
+                          direction=direction, verbose=verbose,
+                          session=session, cache=cache, n_jobs=n_jobs,
+                          checkpoint=checkpoint, info=info, **params)
+    step = None
+    try:
+        while True:
+            async with limiter:
+                step = loop.run_in_executor(None, next, entries, _DONE)
+                # If the task is cancelled, the page is still being fetched
+                json = await asyncio.shield(step)
+            if json is _DONE:
+                return
+            yield json
+    finally:
+        if step is not None and not step.done():
+            await asyncio.wait([step])
+        # Stops the downloads in flight
+        await loop.run_in_executor(None, entries.close)
+
+
+async def aiter_records(auth, url, batch_size=None, projection=None,
+                        **kwargs):
+    """
+    Asynchronous version of `iter_records`.
+
+    All parameters but `batch_size` and `projection` are passed to
+    `aget_entries`.
+    """
+    batch = []
+    async for entry in aget_entries(auth, url, **kwargs):
+        entry = project_records(entry, projection)
+        if batch_size is None:
+            for record in entry:
+                yield record
+            continue
+        batch.extend(entry)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+async def aget_detailed_page(auth, url, params=None, session=None,
+                             cache=None, limiter=None):
+    """
+    Asynchronous version of `get_detailed_page`.
+
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of requests in flight, when shared between calls.
+
+    All other parameters are the ones of `get_detailed_page`.
+    """
+    limiter = asyncio.Semaphore(1) if limiter is None else limiter
+    return await _arun(limiter, get_detailed_page, auth, url, params=params,
+                       session=session, cache=cache)
+
+
 def parse_github_dates(dates, tz='US/Pacific'):
     """Parse github dates so they can be read with strptime.
 
@@ -0,0 +1,295 @@
+"""
+A GraphQL (API v4) backend to download pull requests with their reviews and
+comments.
+
+With the REST API, this takes one listing of the pull requests, one request
+per pull request for the details, and one listing of reviews per pull
+request. With GraphQL, pull requests come by batches of up to 100, with
+their details and their first reviews and comments, in a single request.
+The records are converted to the same format as the REST API so that they
+can be stored in the same datasets.
+"""
+
+import warnings
+
+from pandas import Timestamp
+from requests.exceptions import HTTPError
+
+from . import _github_api
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+# The number of reviews and comments fetched along with each pull request.
+# Pull requests with more are completed with extra requests.
+NESTED_PAGE_SIZE = 50
+
+_REVIEW_FIELDS = """
+        databaseId state body submittedAt url
+        author { login }
+"""
+
+_COMMENT_FIELDS = """
+        databaseId body createdAt updatedAt url
+        author { login }
+"""
+
+PULLS_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $cursor: String,
+      $states: [PullRequestState!], $orderBy: IssueOrder,
+      $nested: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(first: $first, after: $cursor, states: $states,
+                 orderBy: $orderBy) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        databaseId number title state url body locked
+        createdAt updatedAt closedAt mergedAt merged
+        author { login }
+        baseRefName headRefName
+        additions deletions changedFiles
+        commits { totalCount }
+        labels(first: 50) { nodes { name color } }
+        reviews(first: $nested) {
+          pageInfo { hasNextPage endCursor }
+          nodes { %s }
+        }
+        comments(first: $nested) {
+          pageInfo { hasNextPage endCursor }
+          nodes { %s }
+        }
+      }
+    }
+  }
+}
+""" % (_REVIEW_FIELDS, _COMMENT_FIELDS)
+
+NESTED_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      %s(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { %s }
+      }
+    }
+  }
+}
+"""
+
+_STATES = {"all": None, "open": ["OPEN"], "closed": ["CLOSED", "MERGED"]}
+
+
+class GraphQLError(HTTPError):
+    """
+    Raised when GitHub answers a GraphQL query with errors.
+    """
+
+
+def query(auth, text, variables, session=None):
+    """
+    Run a GraphQL query.
+
+    Parameters
+    ----------
+    auth : Auth | TokenPool
+        The credentials to use.
+
+    text : string
+        The GraphQL query.
+
+    variables : dict
+        The variables of the query.
+
+    session : requests.Session | None, optional, default: None
+        The session to use. Defaults to the shared session.
+
+    Returns
+    -------
+    data : dict
+        The "data" member of the response.
+    """
+    session = _github_api.get_session(session)
+    r = _github_api._send(session, GRAPHQL_URL, auth=auth, method="POST",
+                          json={"query": text, "variables": variables})
+    r.raise_for_status()
+    response = r.json()
+    if response.get("errors"):
+        raise GraphQLError(
+            "; ".join(e.get("message", str(e)) for e in response["errors"]),
+            response=r)
+    return response["data"]
+
+
+def get_pulls(auth, user, project, state="all", since=None,
+              direction="asc", max_pages=100, per_page=100, session=None,
+              verbose=False):
+    """
+    Download pull requests, with their reviews and comments.
+
+    Parameters
+    ----------
+    auth : Auth | TokenPool
+        The credentials to use.
+
+    user : string
+        user or organization name, e.g. "matplotlib"
+
+    project : string
+        project name, e.g, "matplotlib".
+
+    state : 'all' | 'open' | 'closed'
+        Whether to include only a subset, or all pulls.
+
+    since : string | None
+        Only download pull requests updated since this date.
+
+    direction : ["asc", "desc"]
+        Whether to download the oldest or newest pull requests first.
+
+    max_pages : int
+        The maximum number of batches of pull requests to download.
+
+    per_page : int
+        The number of pull requests per batch (at most 100).
+
+    Returns
+    -------
+    pulls, reviews, comments : lists of dicts
+        The records, in the format of the REST API.
+    """
+    if since is not None:
+        # There is no "since" filter: walk from the most recently updated,
+        # and stop at the first one older than since.
+        order_by = {"field": "UPDATED_AT", "direction": "DESC"}
+        since = _to_utc(since)
+    else:
+        order_by = {"field": "CREATED_AT", "direction": direction.upper()}
+    variables = {"owner": user, "name": project,
+                 "first": min(per_page, 100), "cursor": None,
+                 "states": _STATES[state], "orderBy": order_by,
+                 "nested": NESTED_PAGE_SIZE}
+
+    pulls, reviews, comments = [], [], []
+    for page in range(max_pages):
+        try:
+            data = query(auth, PULLS_QUERY, variables, session=session)
+        except HTTPError as e:
+            if page == 0:
+                warnings.warn("Latest request raised an error: %s" % e)
+                break
+            raise _github_api.PaginationError(page + 1, e)
+        connection = data["repository"]["pullRequests"]
+        done = False
+        for node in connection["nodes"]:
+            if since is not None and _to_utc(node["updatedAt"]) < since:
+                done = True
+                break
+            pulls.append(_pull_record(node, user, project))
+            for kind, records, convert in (
+                    ("reviews", reviews, _review_record),
+                    ("comments", comments, _comment_record)):
+                nodes = _nested_nodes(auth, user, project, node, kind,
+                                      session=session)
+                records.extend(convert(n, user, project, node["number"])
+                               for n in nodes)
+        if verbose:
+            print("Downloaded %d pulls" % len(pulls))
+        info = connection["pageInfo"]
+        if done or not info["hasNextPage"]:
+            break
+        variables["cursor"] = info["endCursor"]
+    return pulls, reviews, comments
+
+
+def _nested_nodes(auth, user, project, node, kind, session=None):
+    """
+    Return all the reviews or comments of a pull request node, fetching the
+    ones that did not fit in the main query.
+    """
+    connection = node[kind]
+    nodes = list(connection["nodes"])
+    info = connection["pageInfo"]
+    fields = _REVIEW_FIELDS if kind == "reviews" else _COMMENT_FIELDS
+    while info["hasNextPage"]:
+        data = query(auth, NESTED_QUERY % (kind, fields),
+                     {"owner": user, "name": project,
+                      "number": node["number"], "cursor": info["endCursor"]},
+                     session=session)
+        connection = data["repository"]["pullRequest"][kind]
+        nodes.extend(connection["nodes"])
+        info = connection["pageInfo"]
+    return nodes
+
+
+def _to_utc(date):
+    date = Timestamp(date)
+    if date.tzinfo is None:
+        return date.tz_localize("UTC")
+    return date.tz_convert("UTC")
+
+
+def _login(node):
+    author = node.get("author")
+    return None if author is None else {"login": author["login"]}
+
+
+def _api_url(user, project, kind, number):
+    return "https://api.github.com/repos/{}/{}/{}/{}".format(
+        user, project, kind, number)
+
+
+def _pull_record(node, user, project):
+    url = _api_url(user, project, "pulls", node["number"])
+    state = "open" if node["state"] == "OPEN" else "closed"
+    details = {
+        "merged": node["merged"],
+        "merged_at": node["mergedAt"],
+        "additions": node["additions"],
+        "deletions": node["deletions"],
+        "changed_files": node["changedFiles"],
+        "commits": node["commits"]["totalCount"],
+    }
+    return {
+        "id": node["databaseId"],
+        "number": node["number"],
+        "title": node["title"],
+        "state": state,
+        "locked": node["locked"],
+        "url": url,
+        "html_url": node["url"],
+        "body": node["body"],
+        "user": _login(node),
+        "labels": node["labels"]["nodes"],
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "closed_at": node["closedAt"],
+        "merged_at": node["mergedAt"],
+        "base": {"ref": node["baseRefName"]},
+        "head": {"ref": node["headRefName"]},
+        "_links": {"self": {"href": url}},
+        "detailed_pulls": dict(details, number=node["number"], state=state),
+    }
+
+
+def _review_record(node, user, project, number):
+    return {
+        "id": node["databaseId"],
+        "user": _login(node),
+        "body": node["body"],
+        "state": node["state"],
+        "submitted_at": node["submittedAt"],
+        "html_url": node["url"],
+        "pull_request_url": _api_url(user, project, "pulls", number),
+    }
+
+
+def _comment_record(node, user, project, number):
+    return {
+        "id": node["databaseId"],
+        "user": _login(node),
+        "body": node["body"],
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "html_url": node["url"],
+        "issue_url": _api_url(user, project, "issues", number),
+    }
@@ -0,0 +1,161 @@
+"""
+An on-disk cache of HTTP validators (ETag / Last-Modified).
+
+GitHub answers a conditional request with `304 Not Modified` when the
+resource did not change, and such answers are not counted against the rate
+limit. The cache stores, for each URL and set of parameters, the validators
+and the body of the last successful response so that it can be reused on a
+304.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+from ._config import get_data_home
+from ._io import _replace_atomically
+
+
+# One cache per folder, so that counters are shared between calls.
+_CACHES = {}
+
+
+class ValidatorCache(object):
+    """
+    HTTP validator cache stored in a folder.
+
+    Parameters
+    ----------
+    path : string
+        The folder in which the cached responses are stored.
+
+    Attributes
+    ----------
+    hits : int
+        The number of requests answered with a `304 Not Modified`.
+
+    misses : int
+        The number of requests for which the body had to be downloaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # The counters are updated by the threads fetching pages
+        self._lock = threading.Lock()
+
+    def _key(self, url, params):
+        params = {} if params is None else params
+        params = sorted((str(k), str(v)) for k, v in params.items()
+                        if v is not None)
+        key = json.dumps([url, params])
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _filename(self, url, params):
+        key = self._key(url, params)
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def get(self, url, params=None):
+        """
+        Return the cached entry for this request, or None.
+
+        The entry is a dictionary with keys "etag", "last_modified",
+        "headers" and "body".
+        """
+        filename = self._filename(url, params)
+        try:
+            with open(filename, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, url, params, headers, body):
+        """
+        Store the validators and body of a response.
+
+        Nothing is stored if the response has no validator.
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+        entry = {"etag": etag, "last_modified": last_modified,
+                 "headers": dict(headers), "body": body}
+
+        def write(filename):
+            with open(filename, "w") as f:
+                json.dump(entry, f)
+        # Several workers may share the data home
+        _replace_atomically(self._filename(url, params), write)
+
+    def conditional_headers(self, entry):
+        """
+        Return the headers making a request conditional on `entry`.
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag") is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified") is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def count(self, hit):
+        """
+        Count a request answered from the cache if `hit`, or downloaded.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def info(self):
+        """
+        Return the hit / miss counters of the cache.
+
+        Returns
+        -------
+        info : dict
+            with keys "hits", "misses" and "hit_rate".
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            hit_rate = float(self.hits) / total if total else 0.
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": hit_rate}
+
+    def clear(self):
+        """
+        Remove all the cached responses and reset the counters.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def get_cache(data_home=None):
+    """
+    Return the validator cache of a data home.
+
+    Parameters
+    ----------
+    data_home : string, optional, default: None
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    Returns
+    -------
+    cache : ValidatorCache
+        The cache, stored in the "http_cache" folder of the data home. The
+        same object is returned for a given data home, so its counters
+        accumulate across `update_*` calls.
+    """
+    path = os.path.join(get_data_home(data_home), "http_cache")
+    if path not in _CACHES:
+        _CACHES[path] = ValidatorCache(path)
+    return _CACHES[path]
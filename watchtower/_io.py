@@ -1,26 +1,893 @@
 import pandas as pd
 import os
+import io
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import contextlib
 
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
 
-def _update_and_save(filename, raw, old_raw=None):
+from ._config import get_storage, get_compression
+from ._config import get_parquet_compression
+from . import _sqlite
+from . import _load_cache
+from . import _catalog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Datasets are then stored as json
+    pa = pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The number of records converted to a DataFrame at once when building a
+# dataset from a stream of records.
+BATCH_SIZE = 1000
+
+
+def _frame_from_batches(batches):
+    """
+    Build a DataFrame from an iterable of lists of records.
+
+    Each batch is converted on its own, so that the records of a batch can be
+    released before the next one arrives.
+    """
+    frames = [pd.DataFrame(batch) for batch in batches]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+# The columns by which records are assigned to monthly partitions, by order
+# of preference.
+PARTITION_COLUMNS = ("created_at", "submitted_at", "date")
+
+# The partition of records without a date.
+UNDATED = "undated"
+
+
+# The extensions of the partition files, and of the json files by
+# compression.
+PARTITION_EXTENSIONS = (".parquet", ".json", ".json.gz", ".json.zst")
+JSON_EXTENSIONS = {"none": ".json", "gzip": ".json.gz", "zstd": ".json.zst"}
+
+# The folder of a dataset's folder holding its key index, in a file per
+# partition.
+KEY_INDEX = "_keys"
+
+
+def _update_and_save(filename, raw, data_home=None):
+    """
+    Upsert records into a dataset.
+
+    Records are matched on their "id" (or "sha" for commits). A record
+    replaces the stored version unless that one was updated more recently,
+    according to "updated_at".
+
+    A key index, persisted next to the partitions, tells when each record
+    was last updated. It is sharded by partition: the records are stored in
+    the partition of their creation date, which doesn't change, so that a
+    record is looked up in the shard of its partition only (and in the one
+    of the records without a date, in case it was stored before its date was
+    known). Records that are not newer than the stored version are discarded
+    without reading the dataset, and only the partitions receiving records,
+    and their shards, are read and rewritten: the cost of an update grows
+    with the number of incoming records, not with the size of the dataset.
+
+    The dataset is locked during the update, so that concurrent updates
+    don't clobber each other. Readers are never blocked (see `_load`).
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, see `_load`.
+
+    raw : pd.DataFrame
+        The new records.
+
+    data_home : string | None, optional, default: None
+        The data home of the dataset. If given, the entry of the dataset in
+        its catalog is updated (see `_catalog`).
+    """
+    if not len(raw):
+        return
+    added = None
+    if get_storage() == "sqlite":
+        _migrate_to_sqlite(filename)
+        _sqlite.upsert(filename, raw)
+    else:
+        with _locked(filename):
+            _migrate(filename)
+            added = _upsert(filename, raw)
+    if data_home is not None:
+        _catalog.update_dataset(data_home, filename, raw, added=added)
+
+
+def _upsert(filename, raw):
     """
+    Upsert records in a dataset stored as files, and return the number of
+    records added.
     """
-    if old_raw is not None:
-        raw = pd.concat([raw, old_raw], ignore_index=True)
-        if "id" in raw.columns:
-            subset_column = "id"
-        elif "sha" in raw.columns:
-            subset_column = "sha"
-        else:
-            raise ValueError("No known column to distinguish subsets")
-        raw = raw.drop_duplicates(subset=[subset_column])
+    path = _partition_dir(filename)
+    key_column = _key_column(raw)
+    raw = _newest(raw, key_column)
+    keys = [str(key) for key in raw[key_column]]
+    updates = _updated_at(raw)
+    names = _partition_names(raw)
+    shards = {name: _load_key_shard(path, name)
+              for name in set(names) | {UNDATED}}
 
-    _save(filename, raw)
+    keep = []
+    touched = set()
+    added = 0
+    for key, updated_at, name in zip(keys, updates, names):
+        stored_name = next((n for n in (name, UNDATED) if key in shards[n]),
+                           None)
+        if stored_name is None:
+            added += 1
+        elif _older(updated_at, shards[stored_name][key]):
+            keep.append(False)
+            continue
+        elif stored_name != name:
+            # The record moves, its date being known now
+            del shards[stored_name][key]
+            touched.add(stored_name)
+        keep.append(True)
+        touched.add(name)
+        shards[name][key] = (None if pd.isna(updated_at)
+                             else updated_at.isoformat())
+    if not any(keep):
+        return 0
 
+    raw = raw[keep]
+    names = names[keep]
+    upserted = set(k for k, kept in zip(keys, keep) if kept)
+    for name in sorted(touched):
+        partition = raw[names == name]
+        old_partition = _read_existing_partition(path, name)
+        if old_partition is not None:
+            replaced = old_partition[key_column].map(str).isin(upserted)
+            partition = pd.concat([partition, old_partition[~replaced]],
+                                  ignore_index=True, sort=False)
+        partition_filename = _partition_filename(path, name)
+        if len(partition):
+            _write_partition(partition_filename, partition)
+        elif os.path.exists(partition_filename):
+            os.remove(partition_filename)
+        _save_key_shard(path, name, shards[name])
+    return added
 
-def _save(filename, raw):
+
+def _key_column(raw):
+    if "id" in raw.columns:
+        return "id"
+    elif "sha" in raw.columns:
+        return "sha"
+    raise ValueError("No known column to distinguish subsets")
+
+
+def _updated_at(raw):
+    if "updated_at" not in raw.columns:
+        return pd.Series(pd.NaT, index=raw.index)
+    return pd.to_datetime(raw["updated_at"], utc=True, errors="coerce")
+
+
+def _older(updated_at, stored_updated_at):
+    """
+    Whether a record updated at `updated_at` is older than the stored one.
+    """
+    if pd.isna(updated_at) or stored_updated_at is None:
+        return False
+    return updated_at < pd.Timestamp(stored_updated_at)
+
+
+def _newest(raw, key_column):
+    """
+    Keep the most recently updated version of each record of a batch (the
+    first one, for equal or unknown update times).
+    """
+    if not raw[key_column].duplicated().any():
+        return raw
+    order = _updated_at(raw).rank(method="first", ascending=False,
+                                  na_option="bottom")
+    raw = raw.iloc[order.argsort(kind="stable").values]
+    return raw.drop_duplicates(subset=[key_column])
+
+
+def _read_existing_partition(path, name, columns=None):
+    for extension in PARTITION_EXTENSIONS:
+        filename = os.path.join(path, name + extension)
+        if os.path.exists(filename):
+            return _read_partition(filename, columns=columns)
+    return None
+
+
+def _load_key_shard(path, name):
+    """
+    Return the key index of a partition of a dataset: {key: updated_at}.
+
+    The shard is rebuilt from the partition if it is missing.
+    """
     try:
-        os.makedirs(os.path.dirname(filename))
+        with open(_key_shard_filename(path, name), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        pass
+    shard = {}
+    partition = _read_existing_partition(path, name,
+                                         columns=["id", "sha", "updated_at"])
+    if partition is None or not len(partition):
+        return shard
+    keys = partition[_key_column(partition)]
+    for key, updated_at in zip(keys, _updated_at(partition)):
+        shard[str(key)] = (None if pd.isna(updated_at)
+                           else updated_at.isoformat())
+    return shard
+
+
+def _save_key_shard(path, name, shard):
+    filename = _key_shard_filename(path, name)
+    if not shard:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+
+    def write(tmp_filename):
+        with open(tmp_filename, "w") as f:
+            json.dump(shard, f)
+    _replace_atomically(filename, write)
+
+
+def _key_shard_filename(path, name):
+    return os.path.join(path, KEY_INDEX, name + ".json")
+
+
+def _count_keys(path):
+    """
+    Return the number of records of a dataset stored as files, from its key
+    index.
+    """
+    return sum(len(_load_key_shard(path, _partition_name(filename)))
+               for filename in _list_partitions(path))
+
+
+def _remove_key_index(path):
+    shutil.rmtree(os.path.join(path, KEY_INDEX), ignore_errors=True)
+
+
+def _save(filename, raw, data_home=None):
+    """
+    Write a dataset, replacing all of its content.
+
+    If `data_home` is given, the entry of the dataset in its catalog is
+    updated (see `_catalog`).
+    """
+    if get_storage() == "sqlite":
+        _sqlite.replace(filename, raw)
+    else:
+        with _locked(filename):
+            path = _partition_dir(filename)
+            written = _write_partitions(path, raw)
+            for partition_filename in _list_partitions(path):
+                if partition_filename not in written:
+                    os.remove(partition_filename)
+            _remove_key_index(path)
+            _remove_legacy(filename)
+    if data_home is not None:
+        _catalog.update_dataset(data_home, filename, raw, replace=True)
+
+
+def _write_partitions(path, raw):
+    """
+    Write the partitions of a dataset, and return their filenames.
+    """
+    written = set()
+    for name, partition in _partitions(raw):
+        partition_filename = _partition_filename(path, name)
+        _write_partition(partition_filename, partition)
+        written.add(partition_filename)
+    return written
+
+
+def _remove_legacy(filename):
+    """
+    Remove the unpartitioned version of a dataset written by older versions.
+    """
+    for legacy_filename in (filename, _parquet_filename(filename)):
+        if os.path.exists(legacy_filename):
+            os.remove(legacy_filename)
+
+
+def _load(filename, columns=None):
+    """
+    Read a dataset.
+
+    A dataset is stored in a folder of monthly partitions, named after the
+    date of creation of the records, e.g. "issues/2017-01.parquet". Datasets
+    stored as a single file by older versions are migrated on first load.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, e.g.
+        "<data_home>/matplotlib/matplotlib/issues.json". The partitions are
+        in the folder of the same name, without the extension. They are
+        Parquet files if pyarrow is installed, json files otherwise.
+
+    columns : list of strings | None, optional, default: None
+        The columns to read. Parquet files only read these columns from
+        disk. Columns that are not in the dataset are ignored. If None, all
+        the columns are read.
+
+    Returns
+    -------
+    raw : pd.DataFrame
+
+    Raises
+    ------
+    IOError if the dataset does not exist, ValueError if it can't be parsed.
+
+    Notes
+    -----
+    Loading never waits for a writer: partitions are replaced atomically by
+    `_update_and_save`, so each of them is read either before or after an
+    update, never half-written.
+
+    With the "sqlite" storage (see `_config.get_storage`), the dataset is
+    read from the database of the project, where datasets stored as files
+    are imported on first load.
+
+    Frames are cached in memory until the files of the dataset change (see
+    `_load_cache`). A copy is returned, that callers can modify.
+    """
+    storage = get_storage()
+    cache = _load_cache.get_load_cache()
+    key = (os.path.abspath(filename), storage,
+           None if columns is None else tuple(columns))
+    # Taken before reading: a dataset updated meanwhile is read again next
+    # time.
+    signature = _load_cache.signature(_dataset_files(filename, storage))
+    raw = cache.get(key, signature)
+    if raw is not None:
+        return raw
+    if storage == "sqlite":
+        _migrate_to_sqlite(filename)
+        raw = _sqlite.load(filename, columns=columns)
+    else:
+        raw = _load_files(filename, columns=columns)
+    cache.set(key, signature, raw)
+    return raw
+
+
+def _load_stored(filename, raw, columns=None):
+    """
+    Read the stored versions of records, e.g. before they are upserted.
+
+    Only the partitions the records may be stored in are read, as by
+    `_update_and_save`: the one of their creation date, and the one of the
+    records without a date.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, see `_load`.
+
+    raw : pd.DataFrame
+        The records, with their key, and their creation date.
+
+    columns : list of strings | None, optional, default: None
+        The columns to read. If None, all the columns are read.
+
+    Returns
+    -------
+    stored : pd.DataFrame
+
+    Raises
+    ------
+    IOError if the dataset does not exist, ValueError if it can't be parsed.
+    """
+    key_column = _key_column(raw)
+    keys = set(str(key) for key in raw[key_column])
+    read = None
+    if columns is not None:
+        read = list(columns) + ([] if key_column in columns
+                                else [key_column])
+    path = _partition_dir(filename)
+    if get_storage() == "sqlite":
+        _migrate_to_sqlite(filename)
+        stored = _sqlite.load_keys(filename, keys, columns=read)
+    elif not os.path.isdir(path):
+        # Missing, or stored in a single file by an older version
+        stored = _load(filename, columns=read)
+    else:
+        names = sorted(set(_partition_names(raw)) | {UNDATED})
+        frames = [_read_existing_partition(path, name, columns=read)
+                  for name in names]
+        frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            return pd.DataFrame()
+        stored = pd.concat(frames, ignore_index=True, sort=False)
+    if key_column not in stored.columns:
+        return pd.DataFrame()
+    stored = stored[stored[key_column].map(str).isin(keys)]
+    if columns is not None:
+        stored = stored[[c for c in columns if c in stored.columns]]
+    return stored.reset_index(drop=True)
+
+
+def _dataset_files(filename, storage):
+    """
+    Return the files holding a dataset.
+    """
+    filenames = [filename, _parquet_filename(filename)]
+    if storage == "sqlite":
+        database = _sqlite._dataset(filename)[0]
+        filenames.extend([database, database + "-wal"])
+    else:
+        filenames.extend(_list_partitions(_partition_dir(filename)))
+    return filenames
+
+
+def _exists(filename):
+    """
+    Whether the dataset `filename` was stored, as files or in SQLite.
+    """
+    if os.path.isdir(_partition_dir(filename)) or any(
+            os.path.exists(f)
+            for f in (filename, _parquet_filename(filename))):
+        return True
+    return get_storage() == "sqlite" and _sqlite.has_dataset(filename)
+
+
+def _load_files(filename, columns=None):
+    """
+    Read a dataset stored as partitions.
+    """
+    path = _partition_dir(filename)
+    legacy = [f for f in (filename, _parquet_filename(filename))
+              if os.path.exists(f)]
+    if not os.path.isdir(path) and legacy:
+        with _locked(filename, blocking=False) as locked:
+            if locked:
+                _migrate(filename)
+            elif not os.path.isdir(path):
+                # Being migrated by another process
+                try:
+                    return _read_legacy(filename, columns=columns)
+                except FileNotFoundError:
+                    # ... which just completed.
+                    pass
+    if not os.path.isdir(path):
+        raise IOError("No dataset at %s" % path)
+    frames = []
+    for partition_filename in _list_partitions(path):
+        try:
+            frames.append(_read_partition(partition_filename,
+                                          columns=columns))
+        except FileNotFoundError:
+            # Removed by a concurrent writer
+            continue
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def _migrate(filename):
+    """
+    Move a dataset stored in a single file by an older version, json or
+    Parquet, to partitions. The caller must hold the lock of the dataset.
+
+    The partitions are written in a temporary folder, renamed once complete.
+    """
+    path = _partition_dir(filename)
+    if os.path.isdir(path):
+        return
+    try:
+        raw = _read_legacy(filename)
+    except IOError:
+        return
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path),
+                                prefix="." + os.path.basename(path) + ".")
+    try:
+        _write_partitions(tmp_path, raw)
+        os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    _remove_legacy(filename)
+
+
+def _migrate_to_sqlite(filename):
+    """
+    Import a dataset stored as files in its SQLite database.
+    """
+    if _sqlite.has_dataset(filename):
+        return
+    if not (os.path.isdir(_partition_dir(filename)) or
+            os.path.exists(filename) or
+            os.path.exists(_parquet_filename(filename))):
+        return
+    with _locked(filename):
+        if not _sqlite.has_dataset(filename):
+            _sqlite.replace(filename, _load_files(filename))
+
+
+def storage_info(filename):
+    """
+    Return the size on disk, compression ratio and load time of a dataset
+    stored as files.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, see `_load`.
+
+    Returns
+    -------
+    info : dict
+        with keys "files" (number of partitions), "records", "disk_bytes",
+        "raw_bytes" (size once decompressed), "compression_ratio"
+        (raw_bytes / disk_bytes) and "load_seconds".
+    """
+    filenames = _list_partitions(_partition_dir(filename))
+    disk_bytes = sum(os.path.getsize(f) for f in filenames)
+    raw_bytes = sum(_uncompressed_size(f) for f in filenames)
+    start = time.time()
+    try:
+        records = len(_load_files(filename))
+    except (ValueError, IOError):
+        records = 0
+    load_seconds = time.time() - start
+    return {"files": len(filenames), "records": records,
+            "disk_bytes": disk_bytes, "raw_bytes": raw_bytes,
+            "compression_ratio": (float(raw_bytes) / disk_bytes
+                                  if disk_bytes else 0.),
+            "load_seconds": load_seconds}
+
+
+def storage_report(filename):
+    """
+    Return a human readable summary of `storage_info`.
+    """
+    name = _partition_dir(filename)
+    if get_storage() == "sqlite":
+        return "%s: stored in SQLite" % name
+    info = storage_info(filename)
+    return ("%s: %d records in %d files, %.1f MB on disk, %.1f MB "
+            "decompressed (ratio %.1f), loaded in %.2fs" % (
+                name, info["records"], info["files"],
+                info["disk_bytes"] / 1e6, info["raw_bytes"] / 1e6,
+                info["compression_ratio"], info["load_seconds"]))
+
+
+def _uncompressed_size(filename):
+    if filename.endswith(".parquet"):
+        if pq is None:
+            return os.path.getsize(filename)
+        metadata = pq.ParquetFile(filename).metadata
+        return sum(metadata.row_group(i).column(j).total_uncompressed_size
+                   for i in range(metadata.num_row_groups)
+                   for j in range(metadata.num_columns))
+    size = 0
+    with _open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            size += len(chunk)
+    return size
+
+
+def _read_legacy(filename, columns=None):
+    """
+    Read a dataset stored in a single file by an older version.
+    """
+    parquet_filename = _parquet_filename(filename)
+    if pq is not None and os.path.exists(parquet_filename):
+        return _read_parquet(parquet_filename, columns=columns)
+    return _read_partition(filename, columns=columns)
+
+
+def _partitions(raw):
+    """
+    Split records in monthly partitions.
+
+    Yields
+    ------
+    name, partition : string, pd.DataFrame
+        The month ("2017-01"), or UNDATED, and the records created during
+        that month.
+    """
+    names = _partition_names(raw)
+    for name, partition in raw.groupby(names.values, sort=True):
+        yield name, partition
+
+
+def _partition_names(raw):
+    """
+    Return the partition of each record.
+    """
+    for column in PARTITION_COLUMNS:
+        if column in raw.columns:
+            dates = pd.to_datetime(raw[column], utc=True, errors="coerce")
+            return dates.dt.strftime("%Y-%m").fillna(UNDATED)
+    return pd.Series(UNDATED, index=raw.index)
+
+
+def _partition_dir(filename):
+    return os.path.splitext(filename)[0]
+
+
+def _partition_filename(path, name):
+    if pq is None:
+        extension = JSON_EXTENSIONS[get_compression()]
+    else:
+        extension = ".parquet"
+    return os.path.join(path, name + extension)
+
+
+def _partition_name(filename):
+    """
+    Return the name of a partition, e.g. "2017-01" for
+    ".../issues/2017-01.json.gz".
+    """
+    basename = os.path.basename(filename)
+    for extension in PARTITION_EXTENSIONS:
+        if basename.endswith(extension):
+            return basename[:-len(extension)]
+    return os.path.splitext(basename)[0]
+
+
+def _list_partitions(path):
+    try:
+        filenames = sorted(os.listdir(path))
+    except OSError:
+        return []
+    return [os.path.join(path, f) for f in filenames
+            if not f.startswith("_") and not f.startswith(".") and
+            f.endswith(PARTITION_EXTENSIONS)]
+
+
+def _write_partition(filename, raw):
+    if filename.endswith(".parquet"):
+        _replace_atomically(filename, lambda f: _write_parquet(f, raw))
+    else:
+        def write(tmp_filename):
+            f = _open(tmp_filename, "wb", compression=_compression(filename))
+            with io.TextIOWrapper(f, encoding="utf-8") as text:
+                raw.to_json(text, date_format="iso")
+        _replace_atomically(filename, write)
+    # A partition written with another format or compression
+    path, name = os.path.dirname(filename), _partition_name(filename)
+    for extension in PARTITION_EXTENSIONS:
+        other = os.path.join(path, name + extension)
+        if other != filename and os.path.exists(other):
+            os.remove(other)
+
+
+def _read_partition(filename, columns=None):
+    if filename.endswith(".parquet"):
+        if pq is None:
+            raise ValueError("pyarrow is needed to read %s" % filename)
+        return _read_parquet(filename, columns=columns)
+    # Decompressed as it is parsed
+    with io.TextIOWrapper(_open(filename, "rb"), encoding="utf-8") as f:
+        raw = pd.read_json(f)
+    if columns is not None:
+        raw = raw[[c for c in columns if c in raw.columns]]
+    return raw
+
+
+def _open(filename, mode, compression=None):
+    """
+    Open a json file as a stream, compressed according to its extension,
+    or to `compression` if given.
+    """
+    if compression is None:
+        compression = _compression(filename)
+    if compression == "gzip":
+        return gzip.open(filename, mode)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstandard is needed for %s" % filename)
+        f = open(filename, mode)
+        if "r" in mode:
+            return zstandard.ZstdDecompressor().stream_reader(
+                f, closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=True)
+    return open(filename, mode)
+
+
+def _compression(filename):
+    for compression, extension in JSON_EXTENSIONS.items():
+        if compression != "none" and filename.endswith(extension):
+            return compression
+    return "none"
+
+
+def _parquet_filename(filename):
+    return os.path.splitext(filename)[0] + ".parquet"
+
+
+def _replace_atomically(filename, write):
+    """
+    Write a file through a temporary file, renamed over `filename` once
+    complete, so that readers see either the old or the new content.
+
+    Parameters
+    ----------
+    filename : string
+        The file to write.
+
+    write : callable
+        Called with the name of the temporary file to write.
+    """
+    directory = os.path.dirname(filename)
+    try:
+        os.makedirs(directory)
     except OSError:
         pass
-    raw.to_json(filename, date_format="iso")
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=directory, prefix="." + os.path.basename(filename) + ".",
+        suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_filename)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+@contextlib.contextmanager
+def _locked(filename, blocking=True):
+    """
+    Hold the advisory lock of a dataset, "<dataset>.lock", e.g. "issues.lock"
+    next to the "issues" folder.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, see `_load`.
+
+    blocking : bool, optional, default: True
+        Whether to wait for the lock if another process holds it.
+
+    Yields
+    ------
+    locked : bool
+        Whether the lock was acquired. Always True if `blocking`.
+    """
+    lock_filename = _partition_dir(filename) + ".lock"
+    try:
+        os.makedirs(os.path.dirname(lock_filename))
+    except OSError:
+        pass
+    with open(lock_filename, "a") as f:
+        locked = _lock_file(f, blocking)
+        try:
+            yield locked
+        finally:
+            if locked:
+                _unlock_file(f)
+
+
+def _lock_file(f, blocking):
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            return False
+        return True
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(),
+                           msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            # LK_LOCK gives up after 10 seconds
+            if not blocking:
+                return False
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Metadata key listing the columns of nested objects stored as json strings
+_JSON_COLUMNS_KEY = b"watchtower.json_columns"
+
+
+def _is_date_column(column):
+    """
+    Whether `pd.read_json` would parse a column as dates.
+    """
+    column = str(column).lower()
+    return (column.endswith("_at") or column.endswith("_time") or
+            column.startswith("timestamp") or
+            column in ("modified", "date", "datetime"))
+
+
+def _write_parquet(filename, raw):
+    """
+    Write a DataFrame as Parquet.
+
+    GitHub's records hold nested objects (the user, labels, etc.) of varying
+    shapes, which don't fit a columnar schema: object columns that are not
+    all strings are stored as json strings, and decoded by `_read_parquet`.
+    Date columns are stored as UTC timestamps, as `pd.read_json` parses them.
+    """
+    raw = raw.copy()
+    json_columns = []
+    for column in raw.columns:
+        if _is_date_column(column):
+            try:
+                raw[column] = pd.to_datetime(raw[column], utc=True)
+                continue
+            except (ValueError, TypeError):
+                pass
+        if raw[column].dtype != object:
+            continue
+        values = raw[column].dropna()
+        if all(isinstance(v, str) for v in values):
+            continue
+        raw[column] = [None if _is_missing(v) else json.dumps(v, default=str)
+                       for v in raw[column]]
+        json_columns.append(str(column))
+    table = pa.Table.from_pandas(raw)
+    metadata = dict(table.schema.metadata or {})
+    metadata[_JSON_COLUMNS_KEY] = json.dumps(json_columns).encode("utf-8")
+    kwargs = {}
+    compression = get_parquet_compression()
+    if compression is not None:
+        kwargs["compression"] = None if compression == "none" else compression
+    pq.write_table(table.replace_schema_metadata(metadata), filename,
+                   **kwargs)
+
+
+def _read_parquet(filename, columns=None):
+    """
+    Read a DataFrame written by `_write_parquet`.
+    """
+    try:
+        schema = pq.read_schema(filename)
+        if columns is not None:
+            columns = [c for c in columns if c in schema.names]
+        table = pq.read_table(filename, columns=columns)
+    except pa.ArrowInvalid as e:
+        raise ValueError(str(e))
+    metadata = schema.metadata or {}
+    json_columns = json.loads(
+        metadata.get(_JSON_COLUMNS_KEY, b"[]").decode("utf-8"))
+    raw = table.to_pandas()
+    for column in json_columns:
+        if column in raw.columns:
+            raw[column] = [None if v is None else json.loads(v)
+                           for v in raw[column]]
+    return raw
+
+
+def _is_missing(value):
+    if isinstance(value, (dict, list)):
+        return False
+    try:
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
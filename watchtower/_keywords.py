@@ -0,0 +1,151 @@
+"""
+Matching of several keywords over columns of text, in one pass.
+
+The keywords are compiled in a single regular expression, shaped as the trie
+of the keywords (e.g. "doc", "docs" and "docstring" give
+"doc(?:s(?:tring)?)?"), so that the text is scanned once whatever the number
+of keywords, and keywords sharing a prefix are compared together. Texts are
+lowercased as a whole column rather than matched case insensitively, which
+is much slower.
+
+Telling which keywords are in each text is only done for the texts in which
+this first pass found one, usually a small part of them.
+"""
+
+import re
+import functools
+
+import numpy as np
+import pandas as pd
+
+
+class KeywordMatcher(object):
+    """
+    Find keywords in texts.
+
+    Parameters
+    ----------
+    queries : string | list of strings
+        The keywords, matched as substrings.
+
+    case : bool, optional, default: False
+        Whether the matching is case sensitive.
+    """
+
+    def __init__(self, queries, case=False):
+        if isinstance(queries, str):
+            queries = [queries]
+        queries = list(queries)
+        if not queries or not all(queries):
+            raise ValueError("Keywords must be non-empty strings")
+        self.queries = queries
+        self.case = case
+        keys = queries if case else [q.lower() for q in queries]
+        self._keys = keys
+        alternatives = _trie_pattern(sorted(set(keys)))
+        self._any = re.compile(alternatives)
+
+    def search(self, string):
+        """
+        Whether one of the keywords is in `string`.
+        """
+        if not self.case:
+            string = string.lower()
+        return self._any.search(string) is not None
+
+    def _texts(self, texts):
+        texts = pd.Series(texts)
+        strings = texts.fillna("").astype(str)
+        if not self.case:
+            strings = strings.str.lower()
+        return texts.index, strings.values
+
+    def _contains(self, strings):
+        search = self._any.search
+        return np.fromiter((search(s) is not None for s in strings),
+                           dtype=bool, count=len(strings))
+
+    def contains(self, texts):
+        """
+        Whether one of the keywords is in each text.
+
+        Parameters
+        ----------
+        texts : pd.Series of strings
+            Missing texts match nothing.
+
+        Returns
+        -------
+        mask : pd.Series of bools
+        """
+        index, strings = self._texts(texts)
+        return pd.Series(self._contains(strings), index=index)
+
+    def match(self, texts):
+        """
+        Which keywords are in each text.
+
+        Parameters
+        ----------
+        texts : pd.Series of strings
+            Missing texts match nothing.
+
+        Returns
+        -------
+        hits : pd.DataFrame of bools
+            One column per keyword, with the index of `texts`.
+        """
+        index, strings = self._texts(texts)
+        hits = np.zeros((len(strings), len(self.queries)), dtype=bool)
+        candidates = np.flatnonzero(self._contains(strings))
+        strings = strings[candidates]
+        for j, key in enumerate(self._keys):
+            hits[candidates, j] = np.fromiter(
+                (key in string for string in strings), dtype=bool,
+                count=len(strings))
+        return pd.DataFrame(hits, index=index, columns=self.queries)
+
+
+@functools.lru_cache(maxsize=64)
+def _get_matcher(queries, case):
+    return KeywordMatcher(queries, case=case)
+
+
+def get_matcher(queries, case=False):
+    """
+    Return a `KeywordMatcher`, compiled once for given keywords.
+    """
+    if isinstance(queries, str):
+        queries = [queries]
+    return _get_matcher(tuple(queries), case)
+
+
+def _trie_pattern(words):
+    """
+    Return a regular expression matching the longest of `words` at a
+    position.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    alternatives = [re.escape(char) + _node_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1:
+        pattern = alternatives[0]
+    else:
+        pattern = "(?:%s)" % "|".join(alternatives)
+    if "" in node:
+        # A word ends here: the longer ones are optional
+        if len(alternatives) == 1 and len(alternatives[0]) > 1:
+            pattern = "(?:%s)" % pattern
+        pattern += "?"
+    return pattern
@@ -0,0 +1,168 @@
+"""
+An in-memory cache of the datasets read by the `load_*` functions.
+
+Reports typically load the same datasets many times in a run. The frames
+read are kept in a least recently used cache, bounded by a memory budget.
+An entry is keyed on the path of the dataset and the columns read, and is
+only valid as long as the files of the dataset keep the same modification
+time and size: a dataset updated by `update_*`, in this process or another
+one, is read again.
+
+Frames are copied when returned, so that callers can modify them without
+corrupting the cache. The records nested in object columns (dicts, lists)
+are not copied, and should not be modified in place.
+"""
+
+import os
+import threading
+import collections
+
+# The default memory budget of the cache, in MB.
+DEFAULT_SIZE_MB = 256
+
+_CACHE = None
+
+
+class LoadCache(object):
+    """
+    A least recently used cache of DataFrames, bounded in memory.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The memory budget of the cache. Frames are evicted, least recently
+        used first, to keep their total size below it. A frame larger than
+        the budget is not cached. 0 disables the cache.
+
+    Attributes
+    ----------
+    hits : int
+        The number of loads answered from the cache.
+
+    misses : int
+        The number of loads that read the dataset from disk.
+
+    evictions : int
+        The number of frames evicted to stay within the budget.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, signature):
+        """
+        Return a copy of the frame cached for `key`, or None if there is
+        none or if the files of the dataset changed since (`signature`).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != signature:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            frame = entry[1]
+        return frame.copy()
+
+    def set(self, key, signature, frame):
+        """
+        Cache a copy of `frame`, read from files with `signature`.
+        """
+        nbytes = int(frame.memory_usage(deep=True, index=True).sum())
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (signature, frame.copy(), nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """
+        Change the memory budget, evicting frames if needed.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def info(self):
+        """
+        Return the counters of the cache.
+
+        Returns
+        -------
+        info : dict
+            with keys "hits", "misses", "hit_rate", "evictions", "entries",
+            "nbytes" and "max_bytes".
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            hit_rate = float(self.hits) / total if total else 0.
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": hit_rate, "evictions": self.evictions,
+                    "entries": len(self._entries), "nbytes": self.nbytes,
+                    "max_bytes": self.max_bytes}
+
+    def clear(self):
+        """
+        Remove all the cached frames and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def _evict(self):
+        while self._entries and self.nbytes > self.max_bytes:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+
+
+def get_load_cache():
+    """
+    Return the cache of the `load_*` functions.
+
+    Its memory budget is given in MB by the 'WATCHTOWER_LOAD_CACHE_MB'
+    environment variable, 256 if it is not set, and can be changed with
+    `LoadCache.resize`. 0 disables the cache.
+
+    Returns
+    -------
+    cache : LoadCache
+    """
+    global _CACHE
+    if _CACHE is None:
+        size = float(os.environ.get("WATCHTOWER_LOAD_CACHE_MB",
+                                    DEFAULT_SIZE_MB))
+        _CACHE = LoadCache(int(size * 2 ** 20))
+    return _CACHE
+
+
+def signature(filenames):
+    """
+    Return the modification times and sizes of files, None for the ones
+    that do not exist.
+    """
+    result = []
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            result.append((filename, None))
+            continue
+        result.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(result)
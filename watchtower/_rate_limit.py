@@ -0,0 +1,166 @@
+"""
+Rate limit aware scheduling of GitHub credentials.
+
+GitHub reports the state of the rate limit of a token with the
+`X-RateLimit-Limit`, `X-RateLimit-Remaining` and `X-RateLimit-Reset` headers
+of every response, and asks clients hitting the secondary rate limit to wait
+with a `Retry-After` header.
+
+The usage of the tokens is logged at the end of each `update_*` call, to the
+"watchtower" logger.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger("watchtower")
+
+
+class TokenPool(object):
+    """
+    A pool of GitHub credentials, used in turn depending on their budget.
+
+    Parameters
+    ----------
+    auths : list
+        The credentials of the pool, as accepted by `requests` (typically
+        `_github_api.Auth` tuples). None stands for anonymous requests.
+
+    sleep : callable, optional, default: time.sleep
+        Function used to wait for a rate limit to reset.
+
+    clock : callable, optional, default: time.time
+        Function returning the current epoch time.
+    """
+
+    def __init__(self, auths, sleep=time.sleep, clock=time.time):
+        if not len(auths):
+            raise ValueError("A TokenPool needs at least one credential")
+        self.auths = list(auths)
+        self.sleep = sleep
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = [
+            {"limit": None, "remaining": None, "reset": None,
+             "requests": 0, "waited": 0.}
+            for _ in self.auths]
+
+    def __len__(self):
+        return len(self.auths)
+
+    def _index(self, auth):
+        for i, other in enumerate(self.auths):
+            if other is auth:
+                return i
+        return self.auths.index(auth)
+
+    def acquire(self):
+        """
+        Return the credential with the largest remaining budget.
+
+        Credentials for which the budget is unknown are used first. If all
+        the credentials are exhausted, sleep until the first one resets:
+        other threads may use a credential that resets in the meantime.
+        """
+        with self._lock:
+            now = self.clock()
+            for state in self._state:
+                if (state["remaining"] == 0 and state["reset"] is not None and
+                        state["reset"] <= now):
+                    state["remaining"] = None
+
+            def budget(i):
+                remaining = self._state[i]["remaining"]
+                return float("inf") if remaining is None else remaining
+
+            best = max(range(len(self.auths)), key=budget)
+            if budget(best) > 0:
+                return self.auths[best]
+
+            # Everything is exhausted: wait for the earliest reset.
+            best = min(range(len(self.auths)),
+                       key=lambda i: self._state[i]["reset"] or now)
+            wait = max(0., (self._state[best]["reset"] or now) - now) + 1.
+            self._state[best]["waited"] += wait
+        self.sleep(wait)
+        with self._lock:
+            self._state[best]["remaining"] = None
+        return self.auths[best]
+
+    def update(self, auth, headers):
+        """
+        Record a request made with `auth`, and the rate limit it reported.
+        """
+        with self._lock:
+            state = self._state[self._index(auth)]
+            state["requests"] += 1
+            for key, header in (("limit", "X-RateLimit-Limit"),
+                                ("remaining", "X-RateLimit-Remaining"),
+                                ("reset", "X-RateLimit-Reset")):
+                value = headers.get(header)
+                if value is not None:
+                    state[key] = int(value)
+
+    def wait(self, auth, seconds):
+        """
+        Back off `seconds`, as requested by a `Retry-After` header.
+        """
+        with self._lock:
+            self._state[self._index(auth)]["waited"] += seconds
+        self.sleep(seconds)
+
+    def usage(self):
+        """
+        Return the per-credential usage of the pool.
+
+        Returns
+        -------
+        usage : list of dict
+            One dictionary per credential with keys "token", "requests",
+            "remaining", "limit", "reset" and "waited" (seconds slept).
+        """
+        with self._lock:
+            return [dict(state, token=_describe(auth))
+                    for auth, state in zip(self.auths, self._state)]
+
+    def report(self):
+        """
+        Return a human readable summary of `usage`.
+        """
+        lines = ["Token usage:"]
+        for usage in self.usage():
+            remaining = ("?" if usage["remaining"] is None
+                         else usage["remaining"])
+            limit = "?" if usage["limit"] is None else usage["limit"]
+            lines.append(
+                "    %s: %d requests, %s/%s remaining, waited %ds" % (
+                    usage["token"], usage["requests"], remaining, limit,
+                    usage["waited"]))
+        return "\n".join(lines)
+
+    def log_report(self, verbose=False):
+        """
+        Log the `report` of the pool, and print it if `verbose`.
+        """
+        report = self.report()
+        logger.info(report)
+        if verbose:
+            print(report)
+
+
+def _describe(auth):
+    """
+    Return a description of a credential that does not leak the secret.
+    """
+    if auth is None:
+        return "anonymous"
+    user = getattr(auth, "user", None)
+    if user is None and isinstance(auth, tuple):
+        user = auth[0]
+    if user is None:
+        user = str(auth)
+    if len(user) >= 32:
+        # A bare token, used as a user name
+        return user[:4] + "…"
+    return user
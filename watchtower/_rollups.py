@@ -0,0 +1,407 @@
+"""
+Counts of activity over time, precomputed for the datasets.
+
+Reports plot counts of commits, issues and pull requests per week, month or
+weekday, split in categories (all vs. documentation commits, open vs. closed
+issues, by label, by author). `rollup` computes such counts from records,
+with vectorized operations.
+
+Computing them from the records takes reading the whole history of a
+project. Instead, the daily counts of each category are kept next to the
+datasets, in "<dataset>.rollups.json" (e.g. "issues.rollups.json"), and
+updated by `update_*` with the records they download: the counts of the
+stored versions of the records are replaced by the ones of their new
+versions. `load_rollup` reads them, and sums them over larger bins.
+
+The categories of each resource are its "dimensions":
+
+- "all", with the single category "all";
+- "state", for issues ("open", "closed") and pulls ("open", "closed",
+  "merged");
+- "label", for issues and pulls, a record counting once for each of its
+  labels;
+- "author", the GitHub login of the author;
+- "doc", for commits ("doc", or "other"), see `commits_.is_doc`.
+
+Issues and pulls are counted on the day they were opened, commits on the
+day they were authored.
+"""
+
+import os
+import json
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+from ._config import get_data_home
+from ._keywords import get_matcher
+from ._sync import _to_utc
+from . import _commit_store
+from . import _io
+from . import _schema
+
+SUFFIX = ".rollups.json"
+
+# The key and date of the records of each resource, and the columns their
+# dimensions are computed from.
+RESOURCES = {
+    "issues": ("id", "created_at",
+               ["state", "label_names", "user_login", "labels", "user"]),
+    "pulls": ("id", "created_at",
+              ["state", "merged_at", "label_names", "user_login", "labels",
+               "user"]),
+    "commits": ("sha", "date", ["message", "author_login", "commit",
+                                "author"]),
+}
+
+# The bins of `freq` that repeat, and their values.
+CYCLIC_FREQS = {
+    "hour": range(24),
+    "weekday": range(7),
+    "month": range(1, 13),
+}
+
+
+def rollup(records, date_column, freq="W", by=None):
+    """
+    Count records by bins of time, and by category.
+
+    Parameters
+    ----------
+    records : pd.DataFrame
+        The records, e.g. as returned by `load_issues`.
+
+    date_column : string
+        The column of the dates to bin, e.g. "created_at".
+
+    freq : string, optional, default: "W"
+        The bins: a pandas period frequency (e.g. "D", "W", "M"), or "hour",
+        "weekday" (0 being Monday) or "month" to count across the periods,
+        e.g. to compare the activity of the days of the week.
+
+    by : string | pd.Series | pd.DataFrame | None, optional, default: None
+        The categories to count the records in, besides "all": a column of
+        `records` (e.g. "state"), whose lists are counted once for each
+        element (e.g. "label_names"), or columns of bools, aligned with
+        `records` (e.g. as returned by `commits_.find_words`), counting the
+        records for which they are True.
+
+    Returns
+    -------
+    counts : pd.DataFrame of ints
+        One row per bin, empty bins included, and one column per category,
+        the first one being "all".
+    """
+    dates = pd.to_datetime(records[date_column], utc=True)
+    bins = _bin(dates.reset_index(drop=True), freq).rename("bin")
+    counts = bins.value_counts().rename("all").to_frame()
+    if by is not None:
+        if isinstance(by, str):
+            by = records[by]
+        if isinstance(by, pd.Series) and by.dtype == bool:
+            by = by.to_frame()
+        if isinstance(by, pd.DataFrame):
+            by = by.astype(bool).reset_index(drop=True)
+            by_counts = by.groupby(bins).sum()
+        else:
+            frame = pd.DataFrame({"bin": bins, "value": list(by)})
+            frame = frame.explode("value").dropna()
+            by_counts = frame.groupby(["bin", "value"]).size().unstack(
+                fill_value=0)
+        counts = counts.join(by_counts)
+    counts = counts.reindex(_full_index(counts.index, freq))
+    counts.columns.name = None
+    return counts.fillna(0).astype(int).sort_index()
+
+
+def load_rollup(user, project, resource, freq="W", by=None, since=None,
+                until=None, branch="master", data_home=None):
+    """
+    Read the precomputed counts of activity of a project.
+
+    Only the daily counts are read, whatever the size of the history of the
+    project.
+
+    Parameters
+    ----------
+    user : string
+        user or organization name, e.g. "matplotlib"
+
+    project : string
+        project name, e.g, "matplotlib".
+
+    resource : "commits" | "issues" | "pulls"
+        The records to count.
+
+    freq : string, optional, default: "W"
+        The bins, see `rollup`.
+
+    by : string | None, optional, default: None
+        The dimension to split the counts by, besides "all": "state",
+        "label" or "author" for issues and pulls, "doc" or "author" for
+        commits.
+
+    since, until : string | datetime | None, optional, default: None
+        Only count the records dated in [since, until).
+
+    branch : string, optional, default: "master"
+        The branch of the commits.
+
+    data_home : string, optional, default: None
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    Returns
+    -------
+    counts : pd.DataFrame of ints | None
+        As returned by `rollup`. None if the dataset doesn't exist.
+    """
+    if resource not in RESOURCES:
+        raise ValueError("Unknown resource %r" % resource)
+    path = os.path.join(get_data_home(data_home), user, project)
+    if resource == "commits":
+        path = os.path.join(path, branch)
+    filename = os.path.join(path, resource + ".json")
+    table = _read(filename)
+    if table is None:
+        if not _io._exists(filename):
+            return None
+        # Computed once for the datasets written by older versions
+        table = rebuild(filename)
+
+    dimensions = ["all"] if by is None else ["all", by]
+    rows = [(dimension, value, day, count)
+            for dimension in dimensions
+            for value, days in table.get(dimension, {}).items()
+            for day, count in days.items()]
+    counts = pd.DataFrame(rows, columns=["dimension", "value", "day",
+                                         "count"])
+    days = pd.to_datetime(counts["day"], utc=True)
+    keep = np.ones(len(counts), dtype=bool)
+    if since is not None:
+        keep &= (days >= _to_utc(since)).values
+    if until is not None:
+        keep &= (days < _to_utc(until)).values
+    counts = counts[keep].reset_index(drop=True)
+    counts["bin"] = _bin(days[keep].reset_index(drop=True), freq)
+    counts = counts.groupby(["bin", "value"])["count"].sum().unstack(
+        fill_value=0)
+    columns = ["all"] + sorted(c for c in counts.columns if c != "all")
+    counts = counts.reindex(columns=columns, fill_value=0)
+    counts = counts.reindex(_full_index(counts.index, freq))
+    counts.columns.name = None
+    return counts.fillna(0).astype(int).sort_index()
+
+
+@contextlib.contextmanager
+def updating(filename, raw, resource):
+    """
+    Update the counts of a dataset with the records written in the block.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset.
+
+    raw : pd.DataFrame
+        The records written: their stored versions are read before and
+        after the block, from the partitions they are stored in only, and
+        their counts updated.
+
+    resource : "issues" | "pulls"
+    """
+    key, _, _ = RESOURCES[resource]
+    if not len(raw) or key not in raw.columns:
+        yield
+        return
+    before = _stored(filename, resource, raw)
+    yield
+    if before is None or _read(filename) is None:
+        rebuild(filename, resource)
+        return
+    after = _stored(filename, resource, raw)
+    delta = _counts(after, resource)
+    delta = delta.sub(_counts(before, resource), fill_value=0)
+    _add(filename, delta)
+
+
+def add(filename, records, resource, complete=False):
+    """
+    Add the counts of new records to the ones of a dataset.
+
+    If the dataset has no counts yet, they are computed from its records,
+    or from `records` if they are all the records of the dataset
+    (`complete`).
+    """
+    if _read(filename) is None:
+        rebuild(filename, resource, records=records if complete else None)
+    else:
+        _add(filename, _counts(records, resource))
+
+
+def rebuild(filename, resource=None, records=None):
+    """
+    Compute the counts of a dataset from its records.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset.
+
+    resource : string | None, optional, default: None
+        Defaults to the name of the dataset.
+
+    records : pd.DataFrame | None, optional, default: None
+        The records of the dataset. Read if None.
+
+    Returns
+    -------
+    table : dict
+        The counts, by dimension, category and day.
+    """
+    if resource is None:
+        resource = os.path.splitext(os.path.basename(filename))[0]
+    if records is None:
+        records = _load_records(filename, resource)
+    table = _table(_counts(records, resource))
+    with _io._locked(_rollups_filename(filename)):
+        _write(filename, table)
+    return table
+
+
+def _rollups_filename(filename):
+    return os.path.splitext(filename)[0] + SUFFIX
+
+
+def _load_records(filename, resource):
+    key, date, columns = RESOURCES[resource]
+    if resource == "commits":
+        # The dataset of a branch lists the commits of the commit store
+        return _commit_store.load_branch(filename,
+                                         columns=[key, date] + columns)
+    return _io._load(filename, columns=[key, date] + columns)
+
+
+def _stored(filename, resource, raw):
+    """
+    Return the stored versions of the records `raw`, or None if the dataset
+    doesn't exist.
+    """
+    key, date, columns = RESOURCES[resource]
+    try:
+        return _io._load_stored(filename, raw, columns=[key, date] + columns)
+    except (ValueError, IOError):
+        return None
+
+
+def _dimensions(records, resource):
+    """
+    Return the category of each record in each dimension.
+    """
+    if resource in ("issues", "pulls"):
+        _schema.flatten(records, resource, overwrite=False)
+    dimensions = {"all": pd.Series("all", index=records.index)}
+    if resource == "commits":
+        if "message" not in records.columns:
+            _schema.flatten(records, "commits", overwrite=False)
+        if "message" in records.columns:
+            is_doc = get_matcher("doc").contains(records["message"])
+            dimensions["doc"] = pd.Series(
+                np.where(is_doc, "doc", "other"), index=records.index)
+        author = "author_login"
+    else:
+        state = records.get("state")
+        if resource == "pulls" and "merged_at" in records.columns:
+            state = state.where(records["merged_at"].isna(), "merged")
+        dimensions["state"] = state
+        dimensions["label"] = records.get("label_names")
+        author = "user_login"
+    dimensions["author"] = records.get(author)
+    return {dimension: values for dimension, values in dimensions.items()
+            if values is not None}
+
+
+def _counts(records, resource):
+    """
+    Return the number of records by dimension, category and day.
+    """
+    index = ["dimension", "value", "day"]
+    if records is None or not len(records):
+        return pd.Series(dtype=int, index=pd.MultiIndex.from_tuples(
+            [], names=index))
+    date = RESOURCES[resource][1]
+    records = records.copy()
+    days = pd.to_datetime(records[date], utc=True).dt.strftime("%Y-%m-%d")
+    counts = []
+    for dimension, values in _dimensions(records, resource).items():
+        frame = pd.DataFrame({"dimension": dimension,
+                              "value": values.values, "day": days.values})
+        frame = frame.explode("value").dropna()
+        counts.append(frame.groupby(index).size())
+    return pd.concat(counts)
+
+
+def _table(counts):
+    table = {}
+    for (dimension, value, day), count in counts.items():
+        if count:
+            table.setdefault(dimension, {}).setdefault(
+                str(value), {})[day] = int(count)
+    return table
+
+
+def _add(filename, delta):
+    """
+    Add counts to the ones of a dataset.
+    """
+    with _io._locked(_rollups_filename(filename)):
+        table = _read(filename) or {}
+        for (dimension, value, day), count in delta.items():
+            if not count:
+                continue
+            days = table.setdefault(dimension, {}).setdefault(str(value), {})
+            days[day] = int(days.get(day, 0) + count)
+            if not days[day]:
+                del days[day]
+            if not days:
+                del table[dimension][str(value)]
+        _write(filename, table)
+
+
+def _read(filename):
+    try:
+        with open(_rollups_filename(filename), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write(filename, table):
+    def write(tmp_filename):
+        with open(tmp_filename, "w") as f:
+            json.dump(table, f, sort_keys=True)
+
+    _io._replace_atomically(_rollups_filename(filename), write)
+
+
+def _bin(dates, freq):
+    """
+    Return the bin of each date.
+    """
+    if freq in CYCLIC_FREQS:
+        return getattr(dates.dt, freq)
+    naive = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+    return naive.dt.to_period(freq).dt.start_time.dt.tz_localize("UTC")
+
+
+def _full_index(index, freq):
+    """
+    Return the bins from the first to the last of `index`.
+    """
+    if freq in CYCLIC_FREQS:
+        return pd.Index(CYCLIC_FREQS[freq])
+    if not len(index):
+        return index
+    periods = pd.period_range(index.min().tz_localize(None),
+                              index.max().tz_localize(None), freq=freq)
+    return periods.start_time.tz_localize("UTC")
@@ -0,0 +1,207 @@
+"""
+The fields of the GitHub records that are kept in the datasets.
+
+GitHub responses embed large nested objects (the full repository payload in
+each pull request's `head` and `base`, API URLs of every related resource,
+etc.) that no analysis uses. Records are projected on a per-resource schema
+as pages arrive, before they are stored.
+
+A schema is a list of dotted paths into the records: "user.login" keeps the
+`login` of the `user` object, and nothing else of it; "pull_request" keeps
+the whole `pull_request` object. Paths go through lists: "labels.name" keeps
+the name of each label.
+
+The most used nested fields are also flattened into typed columns of their
+own when datasets are written (see `flatten`), so that analyses can use
+vectorized operations on them instead of looping over the nested objects.
+"""
+
+import pandas as pd
+
+FIELDS = {
+    "commits": [
+        "sha", "url", "html_url",
+        "commit.message", "commit.author", "commit.committer",
+        "author.login", "committer.login",
+        "parents.sha",
+    ],
+    "issues": [
+        "id", "number", "title", "body", "state", "locked", "url",
+        "html_url", "user.login", "labels.name", "labels.color",
+        "assignee.login", "assignees.login", "milestone.title", "comments",
+        "created_at", "updated_at", "closed_at", "author_association",
+        "pull_request",
+    ],
+    "pulls": [
+        "id", "number", "title", "body", "state", "locked", "url",
+        "html_url", "user.login", "labels.name", "labels.color",
+        "assignee.login", "assignees.login", "requested_reviewers.login",
+        "milestone.title", "created_at", "updated_at", "closed_at",
+        "merged_at", "merge_commit_sha", "author_association",
+        "base.ref", "base.sha", "head.ref", "head.sha", "_links.self",
+        "detailed_pulls",
+    ],
+    "detailed_pulls": [
+        "number", "state", "merged", "merged_at", "merged_by.login",
+        "mergeable", "comments", "review_comments", "commits", "additions",
+        "deletions", "changed_files",
+    ],
+    "comments": [
+        "id", "body", "html_url", "issue_url", "user.login",
+        "created_at", "updated_at", "author_association",
+    ],
+    "reviews": [
+        "id", "body", "state", "html_url", "pull_request_url", "commit_id",
+        "user.login", "submitted_at", "author_association",
+    ],
+}
+
+
+# The flattened columns of each resource, and the dotted paths they are taken
+# from. Columns ending with "_at" hold UTC timestamps, "label_names" lists of
+# strings, and the other ones strings.
+FLAT_COLUMNS = {
+    "commits": {
+        "message": "commit.message",
+        "author_login": "author.login",
+        "authored_at": "commit.author.date",
+        "committer_login": "committer.login",
+        "committed_at": "commit.committer.date",
+    },
+    "issues": {
+        "user_login": "user.login",
+        "label_names": "labels.name",
+    },
+    "pulls": {
+        "user_login": "user.login",
+        "label_names": "labels.name",
+        "merged_at": "merged_at",
+    },
+    "comments": {
+        "user_login": "user.login",
+    },
+    "reviews": {
+        "user_login": "user.login",
+    },
+}
+
+
+def get_fields(resource, fields=None):
+    """
+    Return the compiled projection to apply to the records of a resource.
+
+    Parameters
+    ----------
+    resource : string
+        The kind of records, one of the keys of `FIELDS`.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The dotted paths to keep. If None, `FIELDS[resource]` is used. If
+        "all", records are kept as is.
+
+    Returns
+    -------
+    projection : dict | None
+        The projection, to pass to `project_records`, or None to keep
+        everything.
+    """
+    if isinstance(fields, str) and fields == "all":
+        return None
+    if fields is None:
+        fields = FIELDS[resource]
+    tree = {}
+    for path in fields:
+        node = tree
+        keys = path.split(".")
+        for key in keys[:-1]:
+            child = node.setdefault(key, {})
+            if child is True:
+                # A parent path is already kept as a whole
+                break
+            node = child
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def project_records(records, projection):
+    """
+    Project a list of records.
+
+    Parameters
+    ----------
+    records : list of dicts
+        The records, as returned by GitHub.
+
+    projection : dict | None
+        As returned by `get_fields`. If None, records are returned as is.
+
+    Returns
+    -------
+    records : list of dicts
+    """
+    if projection is None:
+        return records
+    return [_project(record, projection) for record in records]
+
+
+def _project(value, projection):
+    if projection is True or value is None:
+        return value
+    if isinstance(value, list):
+        return [_project(v, projection) for v in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], sub)
+            for key, sub in projection.items() if key in value}
+
+
+def flatten(raw, resource, overwrite=True):
+    """
+    Add the flattened columns of a resource to a DataFrame.
+
+    Parameters
+    ----------
+    raw : pd.DataFrame
+        The records.
+
+    resource : string
+        The kind of records, one of the keys of `FLAT_COLUMNS`.
+
+    overwrite : bool, optional, default: True
+        Whether to recompute the columns already in `raw`. If False, only the
+        missing ones are added (e.g. to datasets written by older versions).
+
+    Returns
+    -------
+    raw : pd.DataFrame
+        `raw`, modified in place. Columns which nested object is not in the
+        records are not added.
+    """
+    for column, path in FLAT_COLUMNS[resource].items():
+        keys = path.split(".")
+        if keys[0] not in raw.columns:
+            continue
+        if column in raw.columns and not overwrite:
+            continue
+        values = raw[keys[0]]
+        if column == "label_names":
+            raw[column] = [
+                [label.get(keys[1]) for label in labels
+                 if isinstance(label, dict)]
+                if isinstance(labels, list) else []
+                for labels in values]
+            continue
+        for key in keys[1:]:
+            if values.dtype != object:
+                # No object at all, e.g. a column of NaN
+                values = pd.Series(None, index=raw.index, dtype=object)
+                break
+            # .str.get looks up keys of dicts, and gives NaN for anything
+            # else
+            values = values.str.get(key)
+        if column.endswith("_at"):
+            raw[column] = pd.to_datetime(values, utc=True, errors="coerce")
+        else:
+            raw[column] = values.where(values.notna(), None)
+    return raw
@@ -0,0 +1,399 @@
+"""
+An SQLite storage for the datasets, with indexed queries.
+
+The datasets of a project are stored in "<data_home>/<user>/<project>/
+watchtower.sqlite", one table per resource. Each record is stored as json,
+next to the columns most queries filter on (number, creation and update
+dates, state and author login), which are indexed. `query` pushes date
+range, state, author and label filters to SQLite, so that only the matching
+records are decoded.
+
+The database is in WAL mode: readers are not blocked by a sync writing to
+it.
+"""
+
+import os
+import json
+import sqlite3
+
+import pandas as pd
+
+from ._config import get_data_home, DATETIME_FORMAT
+from . import _io
+
+DATABASE = "watchtower.sqlite"
+
+RESOURCES = ("commits", "issues", "pulls", "comments", "reviews",
+             "commit_files", "commit_store")
+
+# The version of the tables and indexes, recorded in the `user_version` of
+# the databases: they are created when it is behind.
+SCHEMA_VERSION = 1
+
+# The number of keys selected by statement.
+MAX_PARAMETERS = 500
+
+# The indexed columns, and the fields of the records they are taken from, by
+# order of preference.
+COLUMNS = {
+    "number": ["number"],
+    "created_at": ["created_at", "submitted_at", "date"],
+    "updated_at": ["updated_at"],
+    "state": ["state"],
+    "author_login": ["user.login", "author.login"],
+}
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    branch TEXT NOT NULL,
+    key TEXT NOT NULL,
+    number INTEGER,
+    created_at TEXT,
+    updated_at TEXT,
+    state TEXT,
+    author_login TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (branch, key)
+)
+"""
+
+_CREATE_DATASETS = """
+CREATE TABLE IF NOT EXISTS datasets (
+    resource TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    PRIMARY KEY (resource, branch)
+)
+"""
+
+# A newer version of a record replaces the stored one.
+_UPSERT = """
+INSERT INTO {table} (branch, key, number, created_at, updated_at, state,
+                     author_login, record)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (branch, key) DO UPDATE SET
+    number = excluded.number,
+    created_at = excluded.created_at,
+    updated_at = excluded.updated_at,
+    state = excluded.state,
+    author_login = excluded.author_login,
+    record = excluded.record
+WHERE excluded.updated_at IS NULL OR {table}.updated_at IS NULL OR
+      excluded.updated_at >= {table}.updated_at
+"""
+
+
+def _dataset(filename):
+    """
+    Return the database, table and branch of a dataset.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset in the data home, e.g.
+        "<data_home>/matplotlib/matplotlib/issues.json" or
+        "<data_home>/matplotlib/matplotlib/master/commits.json".
+    """
+    resource = os.path.splitext(os.path.basename(filename))[0]
+    if resource not in RESOURCES:
+        raise ValueError("Unknown resource %r" % resource)
+    path = os.path.dirname(filename)
+    branch = ""
+    if resource == "commits":
+        path, branch = os.path.split(path)
+    return os.path.join(path, DATABASE), resource, branch
+
+
+def _connect(database):
+    try:
+        os.makedirs(os.path.dirname(database))
+    except OSError:
+        pass
+    connection = sqlite3.connect(database, timeout=60)
+    version, = connection.execute("PRAGMA user_version").fetchone()
+    if version < SCHEMA_VERSION:
+        _create_schema(connection)
+    return connection
+
+
+def _create_schema(connection):
+    """
+    Create the tables and indexes of a database, once.
+    """
+    # The journal mode is stored in the database
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(_CREATE_DATASETS)
+    for table in RESOURCES:
+        connection.execute(_CREATE_TABLE.format(table=table))
+        for column in COLUMNS:
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS {table}_{column} "
+                "ON {table} (branch, {column})".format(
+                    table=table, column=column))
+    connection.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    connection.commit()
+
+
+def has_dataset(filename):
+    """
+    Whether the dataset `filename` was written to its database.
+    """
+    database, table, branch = _dataset(filename)
+    if not os.path.exists(database):
+        return False
+    connection = _connect(database)
+    try:
+        row = connection.execute(
+            "SELECT 1 FROM datasets WHERE resource = ? AND branch = ?",
+            (table, branch)).fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+
+def upsert(filename, raw):
+    """
+    Upsert records in the database, keyed on "id" (or "sha" for commits).
+
+    A record replaces the stored version unless that one was updated more
+    recently, according to "updated_at".
+    """
+    database, table, branch = _dataset(filename)
+    connection = _connect(database)
+    try:
+        with connection:
+            _register(connection, table, branch)
+            connection.executemany(_UPSERT.format(table=table),
+                                   _rows(raw, branch))
+    finally:
+        connection.close()
+
+
+def replace(filename, raw):
+    """
+    Replace all the records of a dataset.
+    """
+    database, table, branch = _dataset(filename)
+    connection = _connect(database)
+    try:
+        with connection:
+            _register(connection, table, branch)
+            connection.execute(
+                "DELETE FROM {table} WHERE branch = ?".format(table=table),
+                (branch,))
+            connection.executemany(_UPSERT.format(table=table),
+                                   _rows(raw, branch))
+    finally:
+        connection.close()
+
+
+def load(filename, columns=None):
+    """
+    Read a dataset, see `_io._load`.
+    """
+    if not has_dataset(filename):
+        raise IOError("No dataset %s in the database" % filename)
+    database, table, branch = _dataset(filename)
+    return _select(database, table, "branch = ?", [branch], columns=columns)
+
+
+def load_keys(filename, keys, columns=None):
+    """
+    Read the records of keys `keys` of a dataset.
+    """
+    if not has_dataset(filename):
+        raise IOError("No dataset %s in the database" % filename)
+    database, table, branch = _dataset(filename)
+    keys = list(keys)
+    frames = []
+    # SQLite bounds the number of parameters of a statement
+    for start in range(0, len(keys), MAX_PARAMETERS):
+        chunk = keys[start:start + MAX_PARAMETERS]
+        where = "branch = ? AND key IN (%s)" % ", ".join(["?"] * len(chunk))
+        frames.append(_select(database, table, where, [branch] + chunk,
+                              columns=columns))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def count(filename):
+    """
+    Return the number of records of a dataset.
+    """
+    database, table, branch = _dataset(filename)
+    if not os.path.exists(database):
+        return 0
+    connection = _connect(database)
+    try:
+        row = connection.execute(
+            "SELECT COUNT(*) FROM {table} WHERE branch = ?".format(
+                table=table), (branch,)).fetchone()
+    finally:
+        connection.close()
+    return row[0]
+
+
+def query(user, project, resource, since=None, until=None,
+          date_field="created_at", state=None, author=None, label=None,
+          columns=None, branch="master", data_home=None):
+    """
+    Query the records of a project stored in SQLite.
+
+    Parameters
+    ----------
+    user : string
+        user or organization name, e.g. "matplotlib"
+
+    project : string
+        project name, e.g, "matplotlib".
+
+    resource : "commits" | "issues" | "pulls" | "comments" | "reviews"
+        The records to query.
+
+    since, until : string | datetime | None, optional, default: None
+        Only return the records whose `date_field` is in [since, until).
+
+    date_field : "created_at" | "updated_at", optional, default: "created_at"
+        The date the range applies to. For reviews, "created_at" is the date
+        of submission, and for commits the date of authoring.
+
+    state : string | None, optional, default: None
+        Only return records in this state, e.g. "open".
+
+    author : string | None, optional, default: None
+        Only return records from this GitHub login.
+
+    label : string | None, optional, default: None
+        Only return issues and pulls bearing this label.
+
+    columns : list of strings | None, optional, default: None
+        The columns to return. If None, all the columns are returned.
+
+    branch : string, optional, default: "master"
+        The branch of the commits, which are read from the commit store of
+        the project (see `_commit_store`).
+
+    data_home : string, optional, default: None
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    Returns
+    -------
+    records : pd.DataFrame
+        The matching records, by creation date.
+
+    Examples
+    --------
+    Issues opened in the last 30 days with the "Documentation" label:
+
+    >>> since = pd.Timestamp.utcnow() - pd.Timedelta(days=30)
+    >>> query("matplotlib", "matplotlib", "issues", since=since,
+    ...       label="Documentation")
+    """
+    if date_field not in ("created_at", "updated_at"):
+        raise ValueError("Unknown date field %r" % date_field)
+    if resource not in RESOURCES:
+        raise ValueError("Unknown resource %r" % resource)
+    path = os.path.join(get_data_home(data_home), user, project)
+    database = os.path.join(path, DATABASE)
+    conditions = ["branch = ?"]
+    parameters = [branch if resource == "commits" else ""]
+    if resource == "commits" and has_dataset(
+            os.path.join(path, "commit_store.json")):
+        # The table of commits only lists the commits of each branch
+        resource = "commit_store"
+        conditions = ["branch = ''",
+                      "key IN (SELECT key FROM commits WHERE branch = ?)"]
+    if since is not None:
+        conditions.append("%s >= ?" % date_field)
+        parameters.append(_timestamp(since))
+    if until is not None:
+        conditions.append("%s < ?" % date_field)
+        parameters.append(_timestamp(until))
+    if state is not None:
+        conditions.append("state = ?")
+        parameters.append(state)
+    if author is not None:
+        conditions.append("author_login = ?")
+        parameters.append(author)
+    if label is not None:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM json_each(record, '$.labels') "
+            "WHERE json_extract(value, '$.name') = ?)")
+        parameters.append(label)
+    if not os.path.exists(database):
+        return pd.DataFrame()
+    return _select(database, resource, " AND ".join(conditions), parameters,
+                   columns=columns)
+
+
+def _select(database, table, where, parameters, columns=None):
+    connection = _connect(database)
+    try:
+        rows = connection.execute(
+            "SELECT record FROM {table} WHERE {where} "
+            "ORDER BY created_at, rowid".format(table=table, where=where),
+            parameters).fetchall()
+    finally:
+        connection.close()
+    raw = pd.DataFrame([json.loads(row[0]) for row in rows])
+    if columns is not None:
+        raw = raw[[c for c in columns if c in raw.columns]]
+    # Dates are parsed as when reading files
+    for column in raw.columns:
+        if _io._is_date_column(column):
+            try:
+                raw[column] = pd.to_datetime(raw[column], utc=True)
+            except (ValueError, TypeError):
+                pass
+    return raw
+
+
+def _register(connection, table, branch):
+    connection.execute(
+        "INSERT OR IGNORE INTO datasets (resource, branch) VALUES (?, ?)",
+        (table, branch))
+
+
+def _rows(raw, branch):
+    """
+    Yield the rows of the records of a DataFrame.
+    """
+    if not len(raw):
+        return
+    key_column = _io._key_column(raw)
+    records = json.loads(raw.to_json(orient="records", date_format="iso"))
+    for record in records:
+        row = [branch, str(record[key_column])]
+        for column, fields in COLUMNS.items():
+            value = None
+            for field in fields:
+                value = _get(record, field)
+                if value is not None:
+                    break
+            if column in ("created_at", "updated_at"):
+                value = _timestamp(value)
+            row.append(value)
+        row.append(json.dumps(record))
+        yield row
+
+
+def _get(record, field):
+    for key in field.split("."):
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def _timestamp(date):
+    """
+    Return a date in UTC, formatted to be compared as a string.
+    """
+    if date is None:
+        return None
+    date = pd.Timestamp(date)
+    if pd.isna(date):
+        return None
+    if date.tzinfo is None:
+        date = date.tz_localize("UTC")
+    return date.tz_convert("UTC").strftime(DATETIME_FORMAT)
@@ -0,0 +1,272 @@
+"""
+Sync watermarks, so that datasets are updated incrementally.
+
+After each sync of a dataset, its sync state is written next to it, in
+"<dataset>.sync.json" (e.g. "issues.sync.json"): the `since` of the run, the
+last page fetched, the ETag of the first page, the date of the run, and the
+watermark, i.e. the most recent update date of the records downloaded. The
+next `update_*` call only asks GitHub for the records updated since the
+watermark.
+
+The watermark only moves forward when a run read its listing to the end,
+starting from the previous watermark: a run stopped by `max_pages` or by an
+error, or started from a later `since`, may have left out older records.
+It is also tied to the parameters of the listing (e.g. the state of the
+issues downloaded), and ignored when they change.
+"""
+
+import os
+import json
+
+import pandas as pd
+
+from ._config import DATETIME_FORMAT
+from . import _io
+from . import _catalog
+
+SUFFIX = ".sync.json"
+
+
+def _sync_filename(filename):
+    return os.path.splitext(filename)[0] + SUFFIX
+
+
+def _stream(filename, stream):
+    if stream is None:
+        stream = os.path.splitext(os.path.basename(filename))[0]
+    return stream
+
+
+def _params(params):
+    if not params:
+        return {}
+    return {str(k): str(v) for k, v in params.items() if v is not None}
+
+
+def _read(filename):
+    try:
+        with open(_sync_filename(filename), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def get_state(filename, stream=None):
+    """
+    Return the sync state of a dataset.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset, e.g.
+        "<data_home>/matplotlib/matplotlib/issues.json".
+
+    stream : string | None, optional, default: None
+        The name of the sync, when several of them update the dataset (e.g.
+        "detailed_pulls"). Defaults to the name of the dataset.
+
+    Returns
+    -------
+    state : dict | None
+        With keys "since", "watermark", "last_page", "etag", "complete",
+        "run_at" and "params", or None if the dataset was never synced.
+    """
+    return _read(filename).get(_stream(filename, stream))
+
+
+def get_since(filename, since=None, incremental=True, params=None,
+              stream=None, verbose=False):
+    """
+    Return the date from which to download the records of a dataset.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset.
+
+    since : string | None, optional, default: None
+        The date asked for by the user, which always takes precedence.
+
+    incremental : bool, optional, default: True
+        Whether to resume from the watermark of the last sync. If False,
+        or if the dataset or its watermark is missing, None is returned and
+        the whole listing is downloaded.
+
+    params : dict | None, optional, default: None
+        The parameters of the listing, which must be the ones of the last
+        sync for its watermark to apply.
+
+    stream : string | None, optional, default: None
+        See `get_state`.
+
+    Returns
+    -------
+    since : string | None
+    """
+    if since is not None or not incremental:
+        return since
+    if not _io._exists(filename):
+        return None
+    state = get_state(filename, stream=stream)
+    if state is None or state.get("params", {}) != _params(params):
+        return None
+    since = state.get("watermark")
+    if since is not None and verbose:
+        print("Resuming the sync of %s from %s" % (
+            _stream(filename, stream), since))
+    return since
+
+
+def record_sync(filename, dates, since=None, info=None, params=None,
+                stream=None, data_home=None):
+    """
+    Record a sync of a dataset, once the records are stored.
+
+    Parameters
+    ----------
+    filename : string
+        The path of the dataset.
+
+    dates : sequence of dates | None
+        The update dates of the records downloaded.
+
+    since : string | None, optional, default: None
+        The `since` of the run.
+
+    info : dict | None, optional, default: None
+        The pagination info of the listing, as filled by
+        `_github_api.get_entries`. If None, the listing is considered
+        complete.
+
+    params : dict | None, optional, default: None
+        The parameters of the listing.
+
+    stream : string | None, optional, default: None
+        See `get_state`.
+
+    data_home : string | None, optional, default: None
+        The data home of the dataset. If given, the date of the sync is
+        recorded in its catalog (see `_catalog`).
+
+    Returns
+    -------
+    state : dict
+        The new sync state.
+    """
+    info = {} if info is None else info
+    params = _params(params)
+    states = _read(filename)
+    stream = _stream(filename, stream)
+    previous = states.get(stream) or {}
+    watermark = None
+    if previous.get("params", {}) == params:
+        watermark = previous.get("watermark")
+
+    covered = since is None or (
+        watermark is not None and _to_utc(since) <= _to_utc(watermark))
+    if info.get("complete", True) and covered:
+        newest = _newest(dates)
+        if newest is not None and (watermark is None or
+                                   newest > _to_utc(watermark)):
+            watermark = newest.strftime(DATETIME_FORMAT)
+
+    state = {
+        "since": None if since is None else str(since),
+        "watermark": watermark,
+        "last_page": info.get("last_page"),
+        "etag": info.get("etag"),
+        "complete": info.get("complete", True),
+        "run_at": pd.Timestamp.utcnow().strftime(DATETIME_FORMAT),
+        "params": params,
+    }
+    states[stream] = state
+
+    def write(tmp_filename):
+        with open(tmp_filename, "w") as f:
+            json.dump(states, f, indent=1, sort_keys=True)
+
+    _io._replace_atomically(_sync_filename(filename), write)
+    if data_home is not None:
+        _catalog.record_sync(data_home, filename, state["run_at"])
+    return state
+
+
+def take_since(batches, since, date_column="updated_at", info=None):
+    """
+    Yield the batches of records updated since a date, from a listing
+    sorted by decreasing update date, and stop at the first older record.
+
+    Used for listings without a `since` filter, like the pulls.
+
+    Parameters
+    ----------
+    batches : iterator of lists of dicts
+        The records, e.g. as yielded by `_github_api.iter_records`.
+
+    since : string | None
+        If None, all the batches are yielded.
+
+    info : dict | None, optional, default: None
+        The pagination info of the listing, marked complete when the listing
+        is stopped at `since`.
+    """
+    try:
+        for batch in batches:
+            newer = _newer(batch, since, date_column)
+            if newer:
+                yield newer
+            if len(newer) < len(batch):
+                if info is not None:
+                    info["complete"] = True
+                return
+    finally:
+        # Stops the downloads in flight
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+
+
+async def atake_since(batches, since, date_column="updated_at", info=None):
+    """
+    Asynchronous version of `take_since`.
+    """
+    try:
+        async for batch in batches:
+            newer = _newer(batch, since, date_column)
+            if newer:
+                yield newer
+            if len(newer) < len(batch):
+                if info is not None:
+                    info["complete"] = True
+                return
+    finally:
+        await batches.aclose()
+
+
+def _newer(batch, since, date_column):
+    if since is None:
+        return batch
+    since = _to_utc(since)
+    newer = []
+    for record in batch:
+        if _to_utc(record[date_column]) < since:
+            break
+        newer.append(record)
+    return newer
+
+
+def _newest(dates):
+    if dates is None or not len(dates):
+        return None
+    dates = pd.to_datetime(pd.Series(list(dates)), utc=True,
+                           errors="coerce").dropna()
+    if not len(dates):
+        return None
+    return dates.max()
+
+
+def _to_utc(date):
+    date = pd.Timestamp(date)
+    if date.tzinfo is None:
+        return date.tz_localize("UTC")
+    return date.tz_convert("UTC")
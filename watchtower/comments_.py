@@ -1,19 +1,25 @@
 import os
 from os.path import join
+import asyncio
 
 import pandas as pd
 from datetime import datetime
 from datetime import timedelta
 
 from . import _github_api
-from ._config import get_data_home, get_API_token
-from ._io import _update_and_save
+from . import _http_cache
+from . import _schema
+from . import _sync
+from ._config import get_data_home
+from ._io import _update_and_save, _frame_from_batches, BATCH_SIZE
+from ._io import _load
 
 
 def update_comments(user, project, auth=None, state="all", since=None,
                     data_home=None, verbose=False,
                     direction="desc",
-                    max_pages=100, per_page=100):
+                    max_pages=100, per_page=100, session=None,
+                    use_cache=True, fields=None, incremental=True):
     """
     Updates the comments information for a user / project.
 
@@ -26,9 +32,10 @@ def update_comments(user, project, auth=None, state="all", since=None,
         project name, e.g, "matplotlib". If None, project will be set to
         user.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     state : 'all' | 'open' | 'closed'
         Whether to include only a subset, or all comments.
@@ -45,21 +52,47 @@ def update_comments(user, project, auth=None, state="all", since=None,
     verbose : bool
         Controls progress bar display.
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "user.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["comments"]`, is used. If "all", records are
+        stored as returned by GitHub.
+
+    incremental : bool, optional, default: True
+        Whether to only download the comments updated since the last sync,
+        as recorded next to the dataset (see `_sync`). Ignored if `since` is
+        given.
+
     Returns
     -------
     raw : json
         The json string containing all the issue information
     """
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    auth = _github_api.get_auth(auth)
     url = 'https://api.github.com/repos/{}/{}/issues/comments'.format(
         user, project)
 
     path = get_data_home(data_home=data_home)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    if project is None:
+        project = user
+    filename = os.path.join(path, user, project, "comments.json")
+    since = first_since = _sync.get_since(
+        filename, since, incremental=incremental, params={"state": state})
 
     max_num_comments = max_pages * per_page
     current_num_comments = 0
-    raw = None
+    frames, seen = [], set()
+    info = {}
 
     # Transform since into something that the github API understands
     if since is not None:
@@ -68,63 +101,170 @@ def update_comments(user, project, auth=None, state="all", since=None,
 
     while current_num_comments < max_num_comments:
         # We need to be a bit smart to get all of the data here
-        current_raw = _github_api.get_frames(
+        batches = _github_api.iter_records(
             auth, url, state=state, since=since,
             max_pages=max_pages, per_page=per_page,
+            batch_size=BATCH_SIZE,
             direction=direction,
             sort="created",
-            verbose=verbose)
+            projection=_schema.get_fields("comments", fields),
+            verbose=verbose,
+            session=session,
+            cache=cache,
+            info=info)
 
-        current_raw = pd.DataFrame(current_raw)
+        current_raw = _frame_from_batches(batches)
         if not len(current_raw):
             break
-        if direction == "asc":
-            latest = max(pd.DatetimeIndex(current_raw["created_at"]))
-            since = (latest - timedelta(days=1)).isoformat()
-        else:
-            latest = min(
-                pd.DatetimeIndex(current_raw["created_at"]))
-            since = (latest + timedelta(days=1)).isoformat()
-
-        # Tweak a bit since so that there's a day of overlap
-        current_raw = pd.DataFrame(current_raw)
-
-        if raw is not None:
-            raw = pd.concat([current_raw, raw], ignore_index=True)
-            raw = raw.drop_duplicates(subset=['id'])
-            if current_num_comments == len(raw):
-                # We're done, for one reason or another.
-                if verbose:
-                    print("Downloaded", len(raw) - current_num_comments,
-                          "extra comments")
-                break
-        else:
-            raw = current_raw
-        current_num_comments = len(raw)
+        since, done = _accumulate(frames, seen, current_raw, direction,
+                                  verbose=verbose)
+        if done:
+            break
+        current_num_comments = len(seen)
+    else:
+        # Stopped by max_pages
+        info["complete"] = False
 
-        if verbose:
-            print("Downloaded up to", latest, "Starting again at", since)
+    auth.log_report(verbose)
+    raw = pd.concat(frames, ignore_index=True) if frames else None
+    return _store_comments(raw, user, project, filename, data_home=data_home,
+                           since=first_since, info=info, state=state)
 
+
+async def update_comments_async(user, project, auth=None, state="all",
+                                since=None, data_home=None, verbose=False,
+                                direction="desc", max_pages=100,
+                                per_page=100, session=None, use_cache=True,
+                                limiter=None, fields=None,
+                                incremental=True):
+    """
+    Asynchronous version of `update_comments`.
+
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once. Share one
+        semaphore between calls to bound the concurrency of all the syncs
+        running on a loop.
+
+    All other parameters are the ones of `update_comments`.
+    """
+    auth = _github_api.get_auth(auth)
+    url = 'https://api.github.com/repos/{}/{}/issues/comments'.format(
+        user, project)
+
+    path = get_data_home(data_home=data_home)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
     if project is None:
         project = user
     filename = os.path.join(path, user, project, "comments.json")
+    since = first_since = _sync.get_since(
+        filename, since, incremental=incremental, params={"state": state})
 
-    # Update pre-existing data
-    old_raw = load_comments(user, project, data_home=data_home)
-    _update_and_save(filename, raw, old_raw)
-    if old_raw is not None:
-        raw = pd.concat([raw, old_raw], ignore_index=True)
-        raw = raw.drop_duplicates(subset=['id'])
-    try:
-        os.makedirs(os.path.dirname(filename))
-    except OSError:
-        pass
-    raw.to_json(filename, date_format="iso")
+    max_num_comments = max_pages * per_page
+    current_num_comments = 0
+    frames, seen = [], set()
+    info = {}
+
+    while current_num_comments < max_num_comments:
+        batches = _github_api.aiter_records(
+            auth, url, state=state, since=since,
+            max_pages=max_pages, per_page=per_page,
+            batch_size=BATCH_SIZE,
+            direction=direction,
+            sort="created",
+            projection=_schema.get_fields("comments", fields),
+            verbose=verbose,
+            session=session,
+            cache=cache,
+            limiter=limiter,
+            info=info)
+
+        current_raw = _frame_from_batches([pd.DataFrame(batch)
+                                           async for batch in batches])
+        if not len(current_raw):
+            break
+        since, done = _accumulate(frames, seen, current_raw, direction,
+                                  verbose=verbose)
+        if done:
+            break
+        current_num_comments = len(seen)
+    else:
+        # Stopped by max_pages
+        info["complete"] = False
+
+    auth.log_report(verbose)
+    raw = pd.concat(frames, ignore_index=True) if frames else None
+    return await asyncio.to_thread(
+        _store_comments, raw, user, project, filename, data_home=data_home,
+        since=first_since, info=info, state=state)
+
+
+def _accumulate(frames, seen, current_raw, direction, verbose=False):
+    """
+    Add a batch of comments to the ones downloaded so far.
+
+    Parameters
+    ----------
+    frames : list of pd.DataFrame
+        The batches downloaded so far, to which `current_raw` is appended.
+        Comments downloaded twice are deduplicated when they are stored.
+
+    seen : set
+        The ids of the comments downloaded so far, updated in place.
+
+    Returns
+    -------
+    since : string
+        The date from which to start the next download.
+
+    done : bool
+        Whether the batch did not bring any new comment.
+    """
+    # Tweak a bit since so that there's a day of overlap
+    if direction == "asc":
+        latest = max(pd.DatetimeIndex(current_raw["created_at"]))
+        since = (latest - timedelta(days=1)).isoformat()
+    else:
+        latest = min(
+            pd.DatetimeIndex(current_raw["created_at"]))
+        since = (latest + timedelta(days=1)).isoformat()
+
+    current_num_comments = len(seen)
+    frames.append(current_raw)
+    seen.update(current_raw["id"])
+    if current_num_comments == len(seen):
+        # We're done, for one reason or another.
+        if verbose:
+            print("Downloaded", len(seen) - current_num_comments,
+                  "extra comments")
+        return since, True
+    if verbose:
+        print("Downloaded up to", latest, "Starting again at", since)
+    return since, False
+
+
+def _store_comments(raw, user, project, filename, data_home=None,
+                    since=None, info=None, state="all", record=True):
+    """
+    Merge freshly downloaded comments into the dataset `filename`, and
+    record the sync (see `_sync.record_sync`) unless `record` is False.
+    """
+    if raw is not None:
+        # Update pre-existing data
+        _schema.flatten(raw, "comments")
+        _update_and_save(filename, raw,
+                         data_home=get_data_home(data_home))
+    if record:
+        dates = None if raw is None else raw.get("updated_at")
+        _sync.record_sync(filename, dates, since=since, info=info,
+                          params={"state": state},
+                          data_home=get_data_home(data_home))
     return load_comments(user, project, data_home=data_home)
 
 
 def load_comments(user, project, data_home=None,
-                  state="all"):
+                  state="all", columns=None):
     """
     Reads the comments json files from the data folder.
 
@@ -139,6 +279,10 @@ def load_comments(user, project, data_home=None,
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
 
+    columns : list of strings | None, optional, default: None
+        The columns to load, e.g. ["user", "created_at"]. Only these are read
+        from disk. If None, all the columns are loaded.
+
     Returns
     -------
     comments : json | Projectcomments
@@ -152,9 +296,12 @@ def load_comments(user, project, data_home=None,
     data_home = get_data_home(data_home)
     filepath = join(data_home, user, project, "comments.json")
     try:
-        comments = pd.read_json(filepath)
+        comments = _load(filepath, columns=columns)
         if len(comments) == 0:
             return None
-    except ValueError:
+    except (ValueError, IOError):
         return None
+    if columns is None:
+        # Datasets written by older versions lack the flattened columns
+        _schema.flatten(comments, "comments", overwrite=False)
     return comments
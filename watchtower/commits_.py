@@ -1,18 +1,36 @@
 import os
 from os.path import join
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 
-from ._config import get_data_home, get_API_token
+from ._config import get_data_home
+from . import _commit_store
+from . import _git
 from . import _github_api
-from ._io import _update_and_save
+from . import _http_cache
+from . import _schema
+from . import _sync
+from ._keywords import get_matcher
+from ._io import _update_and_save, _frame_from_batches, BATCH_SIZE
+from ._io import _load
+from ._checkpoint import clear_checkpoint
+
+# The paths of documentation files, lowercased: in a "doc" folder, or with a
+# documentation extension.
+DOC_PATHS = r"(?:^|/)(?:docs?|documentation)/|\.(?:rst|md)$"
 
 
 def load_commits(user, project=None, data_home=None,
-                 branch="master"):
+                 branch="master", columns=None):
     """
     Reads the commits json files from the data folder.
 
+    The commits of all the branches are stored once, in the commit store of
+    the project (see `_commit_store`).
+
     Parameters
     ----------
     user : string
@@ -27,6 +45,10 @@ def load_commits(user, project=None, data_home=None,
     branch : string, optinola, default: "master"
         The branch fo the project to load.
 
+    columns : list of strings | None, optional, default: None
+        The columns to load, e.g. ["sha", "commit"]. Only these are read
+        from disk. If None, all the columns are loaded.
+
     Returns
     -------
     commits : json
@@ -38,13 +60,16 @@ def load_commits(user, project=None, data_home=None,
     filepath = join(data_home, user, project,
                     branch, 'commits.json')
     try:
-        commits = pd.read_json(filepath)
-    except ValueError:
+        commits = _commit_store.load_branch(filepath, columns=columns)
+    except (ValueError, IOError):
         return None
 
     if len(commits) == 0:
         raise ValueError('No commits for this project')
 
+    if columns is None:
+        # Datasets written by older versions lack the flattened columns
+        _schema.flatten(commits, "commits", overwrite=False)
     return commits
 
 
@@ -52,7 +77,9 @@ def update_commits(user, project=None, auth=None, since=None,
                    max_pages=100, per_page=100,
                    data_home=None, branch="master",
                    direction="asc",
-                   verbose=False, **params):
+                   verbose=False, session=None, use_cache=True,
+                   resume=True, fields=None, incremental=True,
+                   backend="rest", clone=None, **params):
     """Update the commit data for a repository.
 
     Parameters
@@ -64,9 +91,10 @@ def update_commits(user, project=None, auth=None, since=None,
         project name, e.g, "matplotlib". If None, user
         information will be loaded.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     since : string
         Search for activity since this date
@@ -81,7 +109,9 @@ def update_commits(user, project=None, auth=None, since=None,
         The path to the watchtower data. Defaults to ~/watchtower_data.
 
     branch : string, optional, default: "master"
-        The branch fo the project to load.
+        The branch fo the project to load. Its commits are listed from the
+        most recent, until a page of commits already stored for any branch
+        of the project (see `_commit_store`).
 
     direction : ["asc", "desc"]
         Whether to download oldest or newest commits first.
@@ -89,6 +119,43 @@ def update_commits(user, project=None, auth=None, since=None,
     verbose : bool
         Controls progress bar display.
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "user.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["commits"]`, is used. If "all", records are
+        stored as returned by GitHub.
+
+    resume : bool, optional, default: True
+        Whether to checkpoint the pages fetched next to the dataset, so that
+        a download interrupted by an error resumes where it stopped on the
+        next call.
+
+    incremental : bool, optional, default: True
+        Whether to only download the commits made since the last sync, as
+        recorded next to the dataset (see `_sync`). Ignored if `since` is
+        given.
+
+    backend : "rest" | "git", optional, default: "rest"
+        With "git", the commits are read from a local clone of the project,
+        `clone`, along with the files they changed, which are stored in the
+        commit files dataset (see `load_commit_files`). This takes no
+        request, and reads the whole history of the branch whatever its
+        size. The "origin" remote's branch is read if the clone has no local
+        `branch`. Only `since`, `data_home`, `branch`, `incremental` and
+        `verbose` apply. The commits are not attributed to GitHub users.
+
+    clone : string | None, optional, default: None
+        The path of the clone, with the "git" backend.
+
     params : dict-like
         Will be passed to `get_frames`.
 
@@ -98,40 +165,332 @@ def update_commits(user, project=None, auth=None, since=None,
         The raw json returned by the github API.
     """
     path = get_data_home(data_home=data_home)
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    filename = os.path.join(path, user,
+                            project, branch, "commits.json")
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params=params, verbose=verbose)
+    if backend == "git":
+        if clone is None:
+            raise ValueError("The git backend needs the path of a clone")
+        return _update_commits_git(user, project, clone, filename,
+                                   branch=branch, since=since,
+                                   data_home=data_home, verbose=verbose)
+    elif backend != "rest":
+        raise ValueError("Unknown backend %r" % backend)
+    auth = _github_api.get_auth(auth)
+    api_root = 'https://api.github.com/'
+    url = api_root + 'repos/{}/{}/commits'.format(
+        user, project)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    _commit_store.migrate_branch(filename, data_home=path)
+    known = _commit_store.known_shas(filename)
+    info = {}
+    # Pull latest activity info
+    batches = _github_api.iter_records(
+        auth, url, since=since,
+        max_pages=max_pages,
+        per_page=per_page,
+        # One batch per page, to stop at the first known page
+        batch_size=min(per_page, 100),
+        verbose=verbose,
+        direction=direction,
+        session=session,
+        cache=cache,
+        checkpoint=filename if resume else None,
+        projection=_schema.get_fields("commits", fields),
+        info=info,
+        **_listing_params(branch, params))
+    raw = _frame_from_batches(
+        _commit_store.stop_at_known(batches, known, info=info))
+    auth.log_report(verbose)
+    return _store_commits(raw, user, project, filename, branch=branch,
+                          data_home=data_home, since=since, info=info,
+                          params=params)
+
+
+async def update_commits_async(user, project=None, auth=None, since=None,
+                               max_pages=100, per_page=100,
+                               data_home=None, branch="master",
+                               direction="asc",
+                               verbose=False, session=None, use_cache=True,
+                               resume=True, limiter=None, fields=None,
+                               incremental=True, **params):
+    """Asynchronous version of `update_commits`.
+
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once. Share one
+        semaphore between calls to bound the concurrency of all the syncs
+        running on a loop.
+
+    All other parameters are the ones of `update_commits`.
+    """
+    path = get_data_home(data_home=data_home)
+    auth = _github_api.get_auth(auth)
     api_root = 'https://api.github.com/'
     url = api_root + 'repos/{}/{}/commits'.format(
         user, project)
     filename = os.path.join(path, user,
                             project, branch, "commits.json")
-    # Pull latest activity info
-    raw = _github_api.get_frames(auth, url, since=since,
-                                 max_pages=max_pages,
-                                 per_page=per_page,
-                                 verbose=verbose,
-                                 direction=direction,
-                                 **params)
-    raw = pd.DataFrame(raw)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params=params, verbose=verbose)
+    await asyncio.to_thread(_commit_store.migrate_branch, filename,
+                            data_home=path)
+    known = await asyncio.to_thread(_commit_store.known_shas, filename)
+    info = {}
+    batches = _github_api.aiter_records(
+        auth, url, since=since,
+        max_pages=max_pages,
+        per_page=per_page,
+        batch_size=min(per_page, 100),
+        verbose=verbose,
+        direction=direction,
+        session=session,
+        cache=cache,
+        checkpoint=filename if resume else None,
+        projection=_schema.get_fields("commits", fields),
+        limiter=limiter,
+        info=info,
+        **_listing_params(branch, params))
+    batches = _commit_store.astop_at_known(batches, known, info=info)
+    raw = _frame_from_batches([pd.DataFrame(batch)
+                               async for batch in batches])
+    auth.log_report(verbose)
+    return await asyncio.to_thread(
+        _store_commits, raw, user, project, filename, branch=branch,
+        data_home=data_home, since=since, info=info, params=params)
+
+
+def _listing_params(branch, params):
+    """
+    Return the parameters of the listing of the commits of a branch.
+    """
+    params = dict(params)
+    params.setdefault("sha", branch)
+    return params
+
 
+def _update_commits_git(user, project, clone, filename, branch="master",
+                        since=None, data_home=None, verbose=False):
+    """
+    Read the commits of a clone, and the files they changed, and store them
+    in the commits and commit files datasets, batch by batch.
+    """
+    path = get_data_home(data_home=data_home)
+    files_filename = os.path.join(path, user, project, "commit_files.json")
+    ref = _git.resolve_ref(clone, branch)
+    if verbose:
+        print("Reading the commits of %s in %s" % (ref, clone))
+    _commit_store.migrate_branch(filename, data_home=path)
+    commits = _git.iter_commits(clone, ref, user, project, since=since)
+    batches = iter(lambda: list(itertools.islice(commits, BATCH_SIZE)), [])
+    # The branch index is read once, and updated with each batch stored
+    index = _commit_store.load_index(filename)
+    batches = _commit_store.stop_at_known(batches, set(index["known"]))
+    n_commits = 0
+    committed_at = []
+    try:
+        for batch in batches:
+            raw = pd.DataFrame([commit for commit, _ in batch])
+            _schema.flatten(raw, "commits")
+            raw['date'] = raw['authored_at']
+            files = pd.DataFrame([
+                _commit_files(commit["sha"], date, detail)
+                for (commit, detail), date in zip(batch, raw["date"])])
+            # The files first: a commit stored has its files
+            _update_and_save(files_filename, files, data_home=path)
+            _commit_store.add_commits(filename, raw, data_home=path,
+                                      index=index)
+            committed_at.append(raw["committed_at"].max())
+            n_commits += len(raw)
+    finally:
+        # Stops git if the history was not read to its end
+        commits.close()
+    if verbose:
+        print("%d commits read" % n_commits)
+    if not n_commits:
+        print('No activity found')
+    _sync.record_sync(filename, committed_at, since=since, data_home=path)
+    return load_commits(user, project, data_home=data_home, branch=branch)
+
+
+def _store_commits(raw, user, project, filename, branch="master",
+                   data_home=None, since=None, info=None, params=None):
+    """
+    Merge freshly downloaded commits into the dataset `filename`, and record
+    the sync (see `_sync.record_sync`).
+    """
     if len(raw) == 0:
         print('No activity found')
+        clear_checkpoint(filename)
+        _sync.record_sync(filename, None, since=since, info=info,
+                          params=params, data_home=get_data_home(data_home))
         return None
 
     if project is None:
         raw = raw.rename(columns={'created_at': 'date'})
+        # Update pre-existing data
+        _update_and_save(filename, raw,
+                         data_home=get_data_home(data_home))
     else:
-        dates = [ii['author']['date'] for ii in raw['commit'].values]
-        raw['date'] = dates
-
-    # Update pre-existing data
-    old_raw = load_commits(user, project, branch=branch,
-                           data_home=data_home)
-    _update_and_save(filename, raw, old_raw)
+        _schema.flatten(raw, "commits")
+        raw['date'] = raw['authored_at']
+        _commit_store.add_commits(filename, raw,
+                                  data_home=get_data_home(data_home))
+    clear_checkpoint(filename)
+    # GitHub filters commits on their commit date
+    _sync.record_sync(filename, raw.get("committed_at"), since=since,
+                      info=info, params=params,
+                      data_home=get_data_home(data_home))
     return load_commits(user, project, data_home=data_home, branch=branch)
 
 
-def is_doc(commits, use_message=True, use_files=False):
+def update_commit_files(user, project, auth=None, data_home=None,
+                        branch="master", n_jobs=4, max_download=None,
+                        verbose=False, session=None):
+    """
+    Download the files changed by the commits of a branch.
+
+    The commit listing doesn't tell which files a commit changed: this takes
+    fetching each commit. Only the commits whose files were never downloaded
+    are fetched, `n_jobs` at a time, and only the paths and the line counts
+    of the changed files are stored, in the "commit_files" dataset of the
+    project, keyed by sha. A commit is never fetched again, whatever the
+    branch it is on.
+
+    Parameters
+    ----------
+    user : string
+        user or organization name, e.g. "matplotlib"
+
+    project : string
+        project name, e.g, "matplotlib".
+
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
+
+    data_home : string
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    branch : string, optional, default: "master"
+        The branch whose commits, as downloaded by `update_commits`, to
+        fetch.
+
+    n_jobs : int, optional, default: 4
+        The number of commits fetched concurrently.
+
+    max_download : integer, optional, default: None
+        The maximum number of commits to fetch.
+
+    verbose : bool
+        Controls progress display.
+
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    Returns
+    -------
+    files : pd.DataFrame | None
+        The files of the commits of the project, see `load_commit_files`.
+    """
+    auth = _github_api.get_auth(auth)
+    path = get_data_home(data_home=data_home)
+    commits = load_commits(user, project, data_home=data_home,
+                           branch=branch, columns=["sha", "date"])
+    if commits is None:
+        return None
+    filename = os.path.join(path, user, project, "commit_files.json")
+    known = load_commit_files(user, project, data_home=data_home,
+                              columns=["sha"])
+    if known is not None:
+        commits = commits[~commits["sha"].isin(known["sha"])]
+    commits = commits.drop_duplicates("sha")
+    if max_download is not None:
+        commits = commits.iloc[:max_download]
+    if verbose:
+        print("Downloading the files of %d commits" % len(commits))
+
+    url = 'https://api.github.com/repos/{}/{}/commits/{}'
+
+    def fetch(sha):
+        # Commits never change: their validators are not worth caching
+        return _github_api.get_detailed_page(
+            auth, url.format(user, project, sha), session=session)
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        # Stored batch by batch, so that an interrupted download is not lost
+        for start in range(0, len(commits), BATCH_SIZE):
+            batch = commits.iloc[start:start + BATCH_SIZE]
+            details = executor.map(fetch, batch["sha"])
+            records = [_commit_files(sha, date, detail)
+                       for sha, date, detail in zip(batch["sha"],
+                                                    batch["date"], details)
+                       # Failed requests are retried on the next call
+                       if detail is not None]
+            _update_and_save(filename, pd.DataFrame(records),
+                             data_home=path)
+    auth.log_report(verbose)
+    return load_commit_files(user, project, data_home=data_home)
+
+
+def _commit_files(sha, date, detail):
+    """
+    Return the record of the files changed by a commit, from its details.
+    """
+    files = detail.get("files") or []
+    stats = detail.get("stats") or {}
+    return {"sha": sha, "date": date,
+            "files": [f["filename"] for f in files],
+            "file_additions": [f.get("additions", 0) for f in files],
+            "file_deletions": [f.get("deletions", 0) for f in files],
+            "additions": stats.get("additions", 0),
+            "deletions": stats.get("deletions", 0)}
+
+
+def load_commit_files(user, project, data_home=None, columns=None):
+    """
+    Reads the files changed by the commits of a project.
+
+    Parameters
+    ----------
+    user : string
+        user or organization name, e.g. "matplotlib"
+
+    project : string
+        project name, e.g, "matplotlib".
+
+    data_home : string
+        The path to the watchtower data. Defaults to ~/watchtower_data.
+
+    columns : list of strings | None, optional, default: None
+        The columns to load. If None, all the columns are loaded.
+
+    Returns
+    -------
+    files : pd.DataFrame | None
+        One row per commit, with its "sha", "date", the paths of the
+        changed "files", their "file_additions" and "file_deletions", and
+        the total "additions" and "deletions" of the commit. None if the
+        files of no commit were downloaded.
+    """
+    data_home = get_data_home(data_home)
+    filepath = join(data_home, user, project, "commit_files.json")
+    try:
+        files = _load(filepath, columns=columns)
+    except (ValueError, IOError):
+        return None
+    if len(files) == 0:
+        return None
+    return files
+
+
+def is_doc(commits, use_message=True, use_files=False, queries=None,
+           files=None):
     """
     Find commits that are documentation related.
 
@@ -141,46 +500,98 @@ def is_doc(commits, use_message=True, use_files=False):
         pandas dataframe containing the commits information.
 
     use_message : bool, optional, default: True
+        Whether commits whose message holds one of the `queries` are
+        documentation related.
 
     use_files: bool, optional, default: False
-
+        Whether commits changing documentation files (in a "doc" folder, or
+        with a ".rst" or ".md" extension) are documentation related.
+
+    queries : string | list of strings | None, optional, default: None
+        The words marking documentation commits, searched for in the
+        messages regardless of case. Defaults to "doc".
+
+    files : pd.DataFrame | None, optional, default: None
+        The files of the commits, as returned by `load_commit_files`. Used
+        if `use_files` is True, and defaults to the "files" column of
+        `commits`. Commits whose files are unknown are classified on their
+        message only.
     """
-    is_doc_message = commits.commit.apply(
-        lambda x: "doc" in x["message"].lower())
+    is_doc = pd.Series(False, index=commits.index)
+    if use_message:
+        if "message" not in commits.columns:
+            commits = _schema.flatten(commits.copy(), "commits")
+        queries = 'doc' if queries is None else queries
+        is_doc |= get_matcher(queries).contains(commits["message"])
     if use_files:
-        # We somehow lost the file information in the battle. No clue why...
-        raise NotImplementedError
-        # is_doc_files = commits.added.apply(
-        #         lambda x: "doc" in " ".join(x).lower())
-    is_doc = is_doc_message
+        if files is None:
+            if "files" not in commits.columns:
+                raise ValueError(
+                    "The files of the commits are needed: download them "
+                    "with update_commit_files.")
+            files = commits[["sha", "files"]]
+        is_doc |= commits["sha"].map(
+            _is_doc_files(files)).fillna(False).astype(bool)
     is_doc.rename("is_doc", inplace=True)
     return is_doc
 
 
+def _is_doc_files(files):
+    """
+    Return whether each commit changed documentation files, by sha.
+    """
+    paths = files.set_index("sha")["files"].dropna().explode().dropna()
+    is_doc_path = paths.astype(str).str.lower().str.contains(DOC_PATHS)
+    return is_doc_path.groupby(level=0).any()
+
+
 def find_word_in_string(string, queries=None):
     """Find one of a collection of query words in a string.
 
     Parameters
     ----------
-    string : string
-        The string in which we will search for words
+    string : string | pd.Series of strings
+        The string in which we will search for words, or a column of them,
+        e.g. the messages of commits or the bodies of issues or comments.
     queries : string | list of strings | None
-        The words to search for in string
+        The words to search for in string, regardless of case. Defaults to
+        "doc".
 
     Returns
     -------
-    in_strong : bool
+    in_strong : bool | pd.Series of bools
         Whether or not one of the queries was found.
+
+    See also
+    --------
+    find_words : which of the queries are in a column of strings.
+    """
+    queries = 'doc' if queries is None else queries
+    matcher = get_matcher(queries)
+    if isinstance(string, str):
+        return matcher.search(string)
+    return matcher.contains(string)
+
+
+def find_words(strings, queries=None):
+    """Find which query words are in each of a column of strings.
+
+    The strings are scanned once, whatever the number of queries.
+
+    Parameters
+    ----------
+    strings : pd.Series of strings
+        e.g. the messages of commits, or the bodies of issues or comments.
+    queries : string | list of strings | None
+        The words to search for, regardless of case. Defaults to "doc".
+
+    Returns
+    -------
+    hits : pd.DataFrame of bools
+        One column per query, with the index of `strings`.
     """
     queries = 'doc' if queries is None else queries
-    if isinstance(queries, str):
-        queries = [queries]
-    in_string = 0
-    for word in queries:
-        if word.lower() in string.lower():
-            in_string += 1
-    in_string = in_string > 0
-    return in_string
+    return get_matcher(queries).match(strings)
 
 
 def extract_commit_hash(commits):
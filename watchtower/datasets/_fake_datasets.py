@@ -1,7 +1,13 @@
+import atexit
 import json
 import os
+import shutil
+import tempfile
 import pandas as pd
 
+# The copy of the mock datasets, made on first use.
+_MOCK_DATA_HOME = None
+
 
 def get_fake_issues(format="dataframe"):
     filename = os.path.join(
@@ -15,7 +21,19 @@ def get_fake_issues(format="dataframe"):
 
 
 def get_mock_directory_path():
-    filepath = os.path.abspath(os.path.join(
-        os.path.dirname(__file__),
-        "data/mockdata"))
-    return filepath
+    """
+    Return a data home holding the mock datasets.
+
+    The datasets are copied once to a temporary folder, removed on exit, as
+    loading them migrates them to the current storage format.
+    """
+    global _MOCK_DATA_HOME
+    if _MOCK_DATA_HOME is None:
+        filepath = os.path.abspath(os.path.join(
+            os.path.dirname(__file__),
+            "data/mockdata"))
+        tempdir = tempfile.mkdtemp(prefix="watchtower_mockdata_")
+        atexit.register(shutil.rmtree, tempdir, ignore_errors=True)
+        _MOCK_DATA_HOME = os.path.join(tempdir, "mockdata")
+        shutil.copytree(filepath, _MOCK_DATA_HOME)
+    return _MOCK_DATA_HOME
@@ -1,18 +1,27 @@
 import os
 from os.path import join
+import asyncio
 import warnings
 
 import pandas as pd
 import numpy as np
 
 from . import _github_api
-from ._config import get_data_home, get_API_token
-from ._io import _update_and_save
+from . import _http_cache
+from . import _rollups
+from . import _schema
+from . import _sync
+from ._config import get_data_home
+from ._io import _update_and_save, _frame_from_batches, BATCH_SIZE
+from ._io import _load, storage_report
+from ._checkpoint import clear_checkpoint
 
 
 def update_issues(user, project, auth=None, state="all", since=None,
                   data_home=None, verbose=False, max_pages=100,
-                  per_page=100, direction="asc"):
+                  per_page=100, direction="asc", session=None,
+                  use_cache=True, resume=True, fields=None,
+                  incremental=True):
     """
     Updates the issues information for a user / project.
 
@@ -25,9 +34,10 @@ def update_issues(user, project, auth=None, state="all", since=None,
         project name, e.g, "matplotlib". If None, project will be set to
         user.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     state : 'all' | 'open' | 'closed'
         Whether to include only a subset, or all issues.
@@ -44,38 +54,141 @@ def update_issues(user, project, auth=None, state="all", since=None,
     direction : string
         "asc" or "desc"
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "user.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["issues"]`, is used. If "all", records are
+        stored as returned by GitHub.
+
+    resume : bool, optional, default: True
+        Whether to checkpoint the pages fetched next to the dataset, so that
+        a download interrupted by an error resumes where it stopped on the
+        next call.
+
+    incremental : bool, optional, default: True
+        Whether to only download the issues updated since the last sync, as
+        recorded next to the dataset (see `_sync`). Ignored if `since` is
+        given.
+
     Returns
     -------
     raw : json
         The json string containing all the issue information
     """
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    auth = _github_api.get_auth(auth)
+    if project is None:
+        project = user
     url = 'https://api.github.com/repos/{}/{}/issues'.format(user, project)
-    raw = _github_api.get_frames(auth, url, state=state, since=since,
-                                 max_pages=max_pages, per_page=per_page,
-                                 direction=direction,
-                                 verbose=verbose)
     path = get_data_home(data_home=data_home)
-    raw = pd.DataFrame(raw)
+    filename = os.path.join(path, user, project, "issues.json")
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params={"state": state}, verbose=verbose)
+    info = {}
+    batches = _github_api.iter_records(
+        auth, url, state=state, since=since,
+        max_pages=max_pages, per_page=per_page,
+        batch_size=BATCH_SIZE,
+        direction=direction,
+        verbose=verbose,
+        session=session,
+        cache=cache,
+        projection=_schema.get_fields("issues", fields),
+        checkpoint=filename if resume else None,
+        info=info)
+    raw = _frame_from_batches(batches)
+    auth.log_report(verbose)
+    return _store_issues(raw, user, project, filename, data_home=data_home,
+                         verbose=verbose, since=since, info=info,
+                         state=state)
+
+
+async def update_issues_async(user, project, auth=None, state="all",
+                              since=None, data_home=None, verbose=False,
+                              max_pages=100, per_page=100, direction="asc",
+                              session=None, use_cache=True, resume=True,
+                              limiter=None, fields=None, incremental=True):
+    """
+    Asynchronous version of `update_issues`.
+
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once. Share one
+        semaphore between calls to bound the concurrency of all the syncs
+        running on a loop.
+
+    All other parameters are the ones of `update_issues`.
+    """
+    auth = _github_api.get_auth(auth)
+    if project is None:
+        project = user
+    url = 'https://api.github.com/repos/{}/{}/issues'.format(user, project)
+    path = get_data_home(data_home=data_home)
+    filename = os.path.join(path, user, project, "issues.json")
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params={"state": state}, verbose=verbose)
+    info = {}
+    batches = _github_api.aiter_records(
+        auth, url, state=state, since=since,
+        max_pages=max_pages, per_page=per_page,
+        batch_size=BATCH_SIZE,
+        direction=direction,
+        verbose=verbose,
+        session=session,
+        cache=cache,
+        projection=_schema.get_fields("issues", fields),
+        checkpoint=filename if resume else None,
+        limiter=limiter,
+        info=info)
+    raw = _frame_from_batches([pd.DataFrame(batch)
+                               async for batch in batches])
+    auth.log_report(verbose)
+    return await asyncio.to_thread(
+        _store_issues, raw, user, project, filename, data_home=data_home,
+        verbose=verbose, since=since, info=info, state=state)
+
+
+def _store_issues(raw, user, project, filename, data_home=None,
+                  verbose=False, since=None, info=None, state="all"):
+    """
+    Merge freshly downloaded issues into the dataset `filename`, and record
+    the sync (see `_sync.record_sync`).
+    """
     if verbose:
         ticket_ids = extract_ticket_number(raw)
         print("Downloaded tickets from %d to %d" % (
             min(ticket_ids),
             max(ticket_ids)))
 
-    if project is None:
-        project = user
-    filename = os.path.join(path, user, project, "issues.json")
-
     # Update pre-existing data
-    old_raw = load_issues(user, project, data_home=data_home)
-    _update_and_save(filename, raw, old_raw)
+    _schema.flatten(raw, "issues")
+    # The counts of activity are updated with the new versions of the
+    # records
+    with _rollups.updating(filename, raw, "issues"):
+        _update_and_save(filename, raw,
+                         data_home=get_data_home(data_home))
+    clear_checkpoint(filename)
+    _sync.record_sync(filename, raw.get("updated_at"), since=since,
+                      info=info, params={"state": state},
+                      data_home=get_data_home(data_home))
+    if verbose:
+        print(storage_report(filename))
     return load_issues(user, project, data_home=data_home)
 
 
 def load_issues(user, project, data_home=None,
-                state="all"):
+                state="all", columns=None):
     """
     Reads the commits json files from the data folder.
 
@@ -90,6 +203,10 @@ def load_issues(user, project, data_home=None,
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
 
+    columns : list of strings | None, optional, default: None
+        The columns to load, e.g. ["number", "created_at"]. Only these are read
+        from disk. If None, all the columns are loaded.
+
     Returns
     -------
     issues : json | ProjectIssues
@@ -103,11 +220,14 @@ def load_issues(user, project, data_home=None,
     data_home = get_data_home(data_home)
     filepath = join(data_home, user, project, "issues.json")
     try:
-        issues = pd.read_json(filepath)
+        issues = _load(filepath, columns=columns)
         if len(issues) == 0:
             return None
-    except ValueError:
+    except (ValueError, IOError):
         return None
+    if columns is None:
+        # Datasets written by older versions lack the flattened columns
+        _schema.flatten(issues, "issues", overwrite=False)
     return issues
 
 
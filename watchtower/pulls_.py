@@ -1,19 +1,31 @@
 import os
 from os.path import join
+import asyncio
 
 import pandas as pd
 import numpy as np
 
 from . import _github_api
-from ._config import get_data_home, get_API_token
-from ._io import _update_and_save, _save
+from . import _graphql
+from . import _http_cache
+from . import _rollups
+from . import _schema
+from . import _sync
+from ._config import get_data_home
+from ._io import _update_and_save, _frame_from_batches, BATCH_SIZE
+from ._io import _load, storage_report
+from ._checkpoint import clear_checkpoint
 
 from .issues_ import extract_ticket_number
+from . import comments_
+from . import reviews_
 
 
 def update_pulls(user, project, auth=None, state="all", since=None,
                  data_home=None, verbose=False, max_pages=100,
-                 per_page=100, direction="asc"):
+                 per_page=100, direction="asc", session=None,
+                 use_cache=True, resume=True, backend="rest", fields=None,
+                 incremental=True):
     """
     Updates the pulls information for a user / project.
 
@@ -26,15 +38,18 @@ def update_pulls(user, project, auth=None, state="all", since=None,
         project name, e.g, "matplotlib". If None, project will be set to
         user.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     state : 'all' | 'open' | 'closed'
         Whether to include only a subset, or all pulls.
 
     since : string
-        Search for activity since this date
+        Search for activity since this date. As the REST listing of pulls
+        can't be filtered by date, pulls are then listed from the most
+        recently updated, until one older than `since`.
 
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
@@ -45,43 +60,211 @@ def update_pulls(user, project, auth=None, state="all", since=None,
     direction : string
         "asc" or "desc"
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "user.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["pulls"]`, is used. If "all", records are
+        stored as returned by GitHub.
+
+    resume : bool, optional, default: True
+        Whether to checkpoint the pages fetched next to the dataset, so that
+        a download interrupted by an error resumes where it stopped on the
+        next call.
+
+    backend : "rest" | "graphql", optional, default: "rest"
+        With "graphql", pulls are downloaded through the GraphQL API, along
+        with their details, reviews and comments, which are stored in the
+        reviews and comments datasets. This takes an order of magnitude
+        less requests than `update_pulls`, `update_detailed_pulls` and
+        `update_reviews` together. `use_cache` and `resume` do not apply.
+
+    incremental : bool, optional, default: True
+        Whether to only download the pulls updated since the last sync, as
+        recorded next to the dataset (see `_sync`). Ignored if `since` is
+        given.
+
     Returns
     -------
     raw : json
         The json string containing all the issue information
     """
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    auth = _github_api.get_auth(auth)
+    if project is None:
+        project = user
     url = 'https://api.github.com/repos/{}/{}/pulls'.format(user, project)
-    raw = _github_api.get_frames(auth, url, state=state, since=since,
-                                 max_pages=max_pages, per_page=per_page,
-                                 direction=direction,
-                                 verbose=verbose)
     path = get_data_home(data_home=data_home)
-    raw = pd.DataFrame(raw)
+    filename = os.path.join(path, user, project, "pulls.json")
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params={"state": state}, verbose=verbose)
+    if backend == "graphql":
+        return _update_pulls_graphql(
+            auth, user, project, filename, state=state, since=since,
+            data_home=data_home, verbose=verbose, max_pages=max_pages,
+            per_page=per_page, direction=direction, session=session,
+            fields=fields)
+    elif backend != "rest":
+        raise ValueError("Unknown backend %r" % backend)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    info = {}
+    batches = _github_api.iter_records(
+        auth, url, state=state,
+        max_pages=max_pages, per_page=per_page,
+        batch_size=BATCH_SIZE,
+        verbose=verbose,
+        session=session,
+        cache=cache,
+        projection=_schema.get_fields("pulls", fields),
+        checkpoint=filename if resume else None,
+        info=info,
+        **_listing_order(since, direction))
+    raw = _frame_from_batches(_sync.take_since(batches, since, info=info))
+    auth.log_report(verbose)
+    return _store_pulls(raw, user, project, filename, data_home=data_home,
+                        verbose=verbose, since=since, info=info,
+                        state=state)
+
+
+async def update_pulls_async(user, project, auth=None, state="all",
+                             since=None, data_home=None, verbose=False,
+                             max_pages=100, per_page=100, direction="asc",
+                             session=None, use_cache=True, resume=True,
+                             limiter=None, fields=None, incremental=True):
+    """
+    Asynchronous version of `update_pulls`.
 
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once. Share one
+        semaphore between calls to bound the concurrency of all the syncs
+        running on a loop.
+
+    All other parameters are the ones of `update_pulls`.
+    """
+    auth = _github_api.get_auth(auth)
+    if project is None:
+        project = user
+    url = 'https://api.github.com/repos/{}/{}/pulls'.format(user, project)
+    path = get_data_home(data_home=data_home)
+    filename = os.path.join(path, user, project, "pulls.json")
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            params={"state": state}, verbose=verbose)
+    info = {}
+    batches = _github_api.aiter_records(
+        auth, url, state=state,
+        max_pages=max_pages, per_page=per_page,
+        batch_size=BATCH_SIZE,
+        verbose=verbose,
+        session=session,
+        cache=cache,
+        projection=_schema.get_fields("pulls", fields),
+        checkpoint=filename if resume else None,
+        limiter=limiter,
+        info=info,
+        **_listing_order(since, direction))
+    batches = _sync.atake_since(batches, since, info=info)
+    raw = _frame_from_batches([pd.DataFrame(batch)
+                               async for batch in batches])
+    auth.log_report(verbose)
+    return await asyncio.to_thread(
+        _store_pulls, raw, user, project, filename, data_home=data_home,
+        verbose=verbose, since=since, info=info, state=state)
+
+
+def _listing_order(since, direction):
+    """
+    Return the order of the REST listing of pulls: without a `since`
+    filter, pulls updated since a date are the first ones by decreasing
+    update date.
+    """
+    if since is None:
+        return {"direction": direction}
+    return {"sort": "updated", "direction": "desc"}
+
+
+def _update_pulls_graphql(auth, user, project, filename, state="all",
+                          since=None, data_home=None, verbose=False,
+                          max_pages=100, per_page=100, direction="asc",
+                          session=None, fields=None):
+    """
+    Download pulls, reviews and comments with the GraphQL API, and store them
+    in the pulls, reviews and comments datasets.
+    """
+    pulls, reviews, comments = _graphql.get_pulls(
+        auth, user, project, state=state, since=since, direction=direction,
+        max_pages=max_pages, per_page=per_page, session=session,
+        verbose=verbose)
+    # The listing was cut by max_pages if all the batches were downloaded
+    info = {"complete": len(pulls) < max_pages * min(per_page, 100)}
+    auth.log_report(verbose)
+    # `fields` applies to the pulls; reviews and comments get their default
+    # schema, unless everything is kept.
+    nested = "all" if isinstance(fields, str) and fields == "all" else None
+    pulls = _schema.project_records(
+        pulls, _schema.get_fields("pulls", fields))
+    reviews = _schema.project_records(
+        reviews, _schema.get_fields("reviews", nested))
+    comments = _schema.project_records(
+        comments, _schema.get_fields("comments", nested))
+    if reviews:
+        reviews_._store_reviews(pd.DataFrame(reviews), user, project,
+                                data_home=data_home, record=False)
+    if comments:
+        comments_._store_comments(
+            pd.DataFrame(comments), user, project,
+            os.path.join(os.path.dirname(filename), "comments.json"),
+            data_home=data_home, record=False)
+    return _store_pulls(pd.DataFrame(pulls), user, project, filename,
+                        data_home=data_home, verbose=verbose, since=since,
+                        info=info, state=state)
+
+
+def _store_pulls(raw, user, project, filename, data_home=None,
+                 verbose=False, since=None, info=None, state="all"):
+    """
+    Merge freshly downloaded pulls into the dataset `filename`, and record
+    the sync (see `_sync.record_sync`).
+    """
     # Add a column called 'detailed_pulls' for when we add the extra
     # information.
-    raw["detailed_pulls"] = None
+    if "detailed_pulls" not in raw.columns:
+        raw["detailed_pulls"] = None
     if verbose:
         ticket_ids = extract_ticket_number(raw)
         print("Downloaded pulls from %d to %d" % (
             min(ticket_ids),
             max(ticket_ids)))
 
-    if project is None:
-        project = user
-    filename = os.path.join(path, user, project, "pulls.json")
-
     # Update pre-existing data
-    old_raw = load_pulls(user, project, data_home=data_home)
-    _update_and_save(filename, raw, old_raw)
+    _schema.flatten(raw, "pulls")
+    # The counts of activity are updated with the new versions of the
+    # records
+    with _rollups.updating(filename, raw, "pulls"):
+        _update_and_save(filename, raw,
+                         data_home=get_data_home(data_home))
+    clear_checkpoint(filename)
+    _sync.record_sync(filename, raw.get("updated_at"), since=since,
+                      info=info, params={"state": state},
+                      data_home=get_data_home(data_home))
+    if verbose:
+        print(storage_report(filename))
     return load_pulls(user, project, data_home=data_home)
 
 
 def update_detailed_pulls(user, project, auth=None, data_home=None,
                           verbose=False, max_download=None, redownload=True,
-                          since=0):
+                          since=0, session=None, use_cache=True,
+                          fields=None, incremental=True):
     """
     Download detailed information on pulls
 
@@ -94,59 +277,98 @@ def update_detailed_pulls(user, project, auth=None, data_home=None,
         project name, e.g, "matplotlib". If None, project will be set to
         user.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     max_download : integer, optional, default: None
         The maximum number of item to download.
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "merged_by.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["detailed_pulls"]`, is used. If "all",
+        records are stored as returned by GitHub.
+
+    incremental : bool, optional, default: True
+        Whether to only download again the details of the pulls updated
+        since the last call (see `_sync`). Details that were never
+        downloaded are always downloaded.
+
     Returns
     -------
 
     """
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    auth = _github_api.get_auth(auth)
     path = get_data_home(data_home=data_home)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    projection = _schema.get_fields("detailed_pulls", fields)
 
     if project is None:
         project = user
 
+    filename = os.path.join(path, user, project, "pulls.json")
     pulls = load_pulls(user, project, data_home=data_home)
-    if max_download is None:
-        max_download = len(pulls)
-
-    current_download = 0
-
     if pulls is None:
         return None
+    updated_since = _sync.get_since(filename, incremental=incremental,
+                                    stream="detailed_pulls", verbose=verbose)
+    if updated_since is not None:
+        updated_since = _sync._to_utc(updated_since)
+
+    current_download = 0
+    downloaded = []
+    truncated = since > 0
 
     for i, pull in pulls.iterrows():
         if i < since:
             continue
-        if (pull["detailed_pulls"] is None or pd.isna(pull["detailed_pulls"])
-            or redownload):
+        # The details of the pulls updated at the watermark were downloaded
+        # by the last sync
+        outdated = redownload and (updated_since is None or
+                                   pull["updated_at"] > updated_since)
+        if (pull["detailed_pulls"] is None or
+                pd.isna(pull["detailed_pulls"]) or outdated):
+            if max_download is not None and current_download >= max_download:
+                # Pulls are left: the next sync resumes from the same date
+                truncated = True
+                break
 
             if verbose:
                 print("Downloading detailed data from PR %d" % i)
 
             detailed_pull_url = pull["_links"]["self"]["href"]
             raw = _github_api.get_detailed_page(
-                auth, detailed_pull_url)
+                auth, detailed_pull_url, session=session, cache=cache)
+            raw, = _schema.project_records([raw], projection)
             pulls.at[i, "detailed_pulls"] = raw
+            downloaded.append(i)
 
             current_download += 1
-            if current_download == max_download:
-                break
 
-    filename = os.path.join(path, user, project, "pulls.json")
+    auth.log_report(verbose)
 
-    _save(filename, pulls)
+    # Only the partitions of the updated pulls are rewritten
+    _update_and_save(filename, pulls.loc[downloaded],
+                     data_home=path)
+    _sync.record_sync(filename, pulls.loc[downloaded, "updated_at"],
+                      info={"complete": not truncated},
+                      stream="detailed_pulls", data_home=path)
     return load_pulls(user, project, data_home=data_home)
 
 
 def load_pulls(user, project, data_home=None,
-               state="all"):
+               state="all", columns=None):
     """
     Reads the commits json files from the data folder.
 
@@ -161,6 +383,10 @@ def load_pulls(user, project, data_home=None,
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
 
+    columns : list of strings | None, optional, default: None
+        The columns to load, e.g. ["number", "merged_at"]. Only these are read
+        from disk. If None, all the columns are loaded.
+
     Returns
     -------
     pulls : json | Projectpulls
@@ -174,9 +400,12 @@ def load_pulls(user, project, data_home=None,
     data_home = get_data_home(data_home)
     filepath = join(data_home, user, project, "pulls.json")
     try:
-        pulls = pd.read_json(filepath)
+        pulls = _load(filepath, columns=columns)
         if len(pulls) == 0:
             return None
-    except ValueError:
+    except (ValueError, IOError):
         return None
+    if columns is None:
+        # Datasets written by older versions lack the flattened columns
+        _schema.flatten(pulls, "pulls", overwrite=False)
     return pulls
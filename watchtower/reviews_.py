@@ -1,16 +1,24 @@
 import os
 from os.path import join
+import asyncio
 
 import pandas as pd
 from collections.abc import Iterable
 
 from . import _github_api
-from ._config import get_data_home, get_API_token
+from . import _http_cache
+from . import _schema
+from . import _sync
+from ._config import get_data_home
+from ._io import _update_and_save, _frame_from_batches, BATCH_SIZE
+from ._io import _load
 
 
-def update_reviews(user, project, pull_request_ids, auth=None, since=None,
-                   data_home=None, verbose=False, direction="desc",
-                   max_pages=100, per_page=500):
+def update_reviews(user, project, pull_request_ids=None, auth=None,
+                   since=None, data_home=None, verbose=False,
+                   direction="desc", max_pages=100, per_page=500,
+                   session=None, use_cache=True, fields=None,
+                   incremental=True):
     """
     Updates the reviews information for a user / project.
 
@@ -23,18 +31,21 @@ def update_reviews(user, project, pull_request_ids, auth=None, since=None,
         project name, e.g, "matplotlib". If None, project will be set to
         user.
 
-    pull_request_ids : int or list of ints
-        ID of pull request
+    pull_request_ids : int or list of ints | None, optional, default: None
+        ID of pull request. If None, the reviews of the pulls of the pulls
+        dataset updated since `since` are downloaded.
 
-    auth : string (user:api_key)
-        The username / API key for github, separated by a colon. If
-        None, the key `GITHUB_API` will be searched for in `environ`.
+    auth : string (user:api_key) | list of strings | TokenPool
+        The username / API key for github, separated by a colon, or several
+        of those to spread the requests over. If None, the keys `GITHUB_API`,
+        `GITHUB_API2`, ... will be searched for in `environ`.
 
     direction : ["asc", "desc"]
         Whether to download oldest or newes comments first.
 
     since : string
-        Search for activity since this date
+        Search for activity since this date. Only used to select the pulls
+        when `pull_request_ids` is None.
 
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
@@ -42,67 +53,236 @@ def update_reviews(user, project, pull_request_ids, auth=None, since=None,
     verbose : bool
         Controls progress bar display.
 
+    session : requests.Session | None, optional, default: None
+        The HTTP session to use. Defaults to the shared session of
+        `_github_api`.
+
+    use_cache : bool, optional, default: True
+        Whether to make requests conditional on the ETag / Last-Modified
+        validators cached in the data home. Unchanged pages are then not
+        downloaded again, nor counted against the rate limit.
+
+    fields : list of strings | "all" | None, optional, default: None
+        The fields of the records to store, as dotted paths into the GitHub
+        records (e.g. "user.login"). If None, the default schema of the
+        resource, `_schema.FIELDS["reviews"]`, is used. If "all", records are
+        stored as returned by GitHub.
+
+    incremental : bool, optional, default: True
+        When `pull_request_ids` and `since` are None, whether to only
+        download the reviews of the pulls updated since the last sync, as
+        recorded next to the dataset (see `_sync`).
+
     Returns
     -------
     raw : json
         The json string containing all the issue information
     """
-    auth = get_API_token() if auth is None else auth
-    auth = _github_api.colon_seperated_pair(auth)
+    auth = _github_api.get_auth(auth)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    projection = _schema.get_fields("reviews", fields)
+    pulls = None
+    if pull_request_ids is None:
+        pulls, since = _updated_pulls(
+            user, project, since=since, incremental=incremental,
+            data_home=data_home, verbose=verbose)
+        pull_request_ids = list(pulls["number"])
+    failed = []
     if isinstance(pull_request_ids, Iterable):
         raw = []
         for pr_id in pull_request_ids:
+            info = {}
             raw.append(_update_review_single(
                 user, project, pr_id, auth=auth,
                 verbose=verbose, max_pages=max_pages,
                 direction=direction,
                 sort="created",
-                per_page=per_page))
-        raw = pd.concat(raw)
+                per_page=per_page,
+                session=session,
+                cache=cache,
+                projection=projection,
+                info=info))
+            if not info.get("complete"):
+                failed.append(pr_id)
+        raw = pd.concat(raw) if raw else pd.DataFrame()
     else:
         raw = _update_review_single(
                 user, project, pull_request_ids, auth=auth,
                 verbose=verbose, max_pages=max_pages,
                 direction=direction,
                 sort="created",
-                per_page=per_page)
-    path = get_data_home(data_home=data_home)
+                per_page=per_page,
+                session=session,
+                cache=cache,
+                projection=projection)
+    auth.log_report(verbose)
+    return _store_reviews(raw, user, project, data_home=data_home,
+                          pulls=pulls, since=since, failed=failed)
+
+
+async def update_reviews_async(user, project, pull_request_ids=None,
+                               auth=None, since=None, data_home=None,
+                               verbose=False, direction="desc", max_pages=100,
+                               per_page=500, session=None, use_cache=True,
+                               limiter=None, fields=None, incremental=True):
+    """
+    Asynchronous version of `update_reviews`.
+
+    The reviews of all the pull requests are downloaded concurrently.
 
+    Parameters
+    ----------
+    limiter : asyncio.Semaphore | None, optional, default: None
+        Bounds the number of listings fetching a page at once. Share one
+        semaphore between calls to bound the concurrency of all the syncs
+        running on a loop.
+
+    All other parameters are the ones of `update_reviews`.
+    """
+    auth = _github_api.get_auth(auth)
+    cache = _http_cache.get_cache(data_home) if use_cache else None
+    limiter = asyncio.Semaphore(4) if limiter is None else limiter
+    pulls = None
+    if pull_request_ids is None:
+        pulls, since = await asyncio.to_thread(
+            _updated_pulls, user, project, since=since,
+            incremental=incremental, data_home=data_home, verbose=verbose)
+        pull_request_ids = list(pulls["number"])
+    if not isinstance(pull_request_ids, Iterable):
+        pull_request_ids = [pull_request_ids]
+    pull_request_ids = list(pull_request_ids)
+    infos = [{} for _ in pull_request_ids]
+    raw = await asyncio.gather(*[
+        _update_review_single_async(
+            user, project, pr_id, auth=auth,
+            verbose=verbose, max_pages=max_pages,
+            direction=direction,
+            sort="created",
+            per_page=per_page,
+            session=session,
+            cache=cache,
+            limiter=limiter,
+            projection=_schema.get_fields("reviews", fields),
+            info=info)
+        for pr_id, info in zip(pull_request_ids, infos)])
+    raw = pd.concat(raw) if raw else pd.DataFrame()
+    failed = [pr_id for pr_id, info in zip(pull_request_ids, infos)
+              if not info.get("complete")]
+    auth.log_report(verbose)
+    return await asyncio.to_thread(
+        _store_reviews, raw, user, project, data_home=data_home,
+        pulls=pulls, since=since, failed=failed)
+
+
+def _reviews_filename(user, project, data_home=None):
+    path = get_data_home(data_home=data_home)
     if project is None:
         project = user
-    filename = os.path.join(path, user, project, "reviews.json")
+    return os.path.join(path, user, project, "reviews.json")
 
-    # Update pre-existing data
-    old_raw = load_reviews(user, project, data_home=data_home)
-    if old_raw is not None:
-        raw = pd.concat([raw, old_raw], ignore_index=True)
-        raw = raw.drop_duplicates(subset=['id'])
+
+def _updated_pulls(user, project, since=None, incremental=True,
+                   data_home=None, verbose=False):
+    """
+    Return the number and update date of the pulls of the pulls dataset
+    updated since `since`, or since the last sync of the reviews, and the
+    date they were selected from.
+    """
+    filename = _reviews_filename(user, project, data_home=data_home)
+    since = _sync.get_since(filename, since, incremental=incremental,
+                            verbose=verbose)
     try:
-        os.makedirs(os.path.dirname(filename))
-    except OSError:
-        pass
-    raw.set_index("id", inplace=True)
-    raw["id"] = raw.index
-    raw.to_json(filename, date_format="iso")
+        pulls = _load(os.path.join(os.path.dirname(filename), "pulls.json"),
+                      columns=["number", "updated_at"])
+    except (ValueError, IOError):
+        pulls = pd.DataFrame()
+    if not len(pulls):
+        return pd.DataFrame(columns=["number", "updated_at"]), since
+    if since is not None:
+        pulls = pulls[pulls["updated_at"] >= _sync._to_utc(since)]
+    return pulls, since
+
+
+def _store_reviews(raw, user, project, data_home=None, pulls=None,
+                   since=None, record=True, failed=()):
+    """
+    Merge freshly downloaded reviews into the dataset of the project, and
+    record the sync (see `_sync.record_sync`) unless `record` is False.
+
+    The watermark of the reviews is the update date of the pulls `pulls`
+    they were downloaded for. If None, the reviews were downloaded for a
+    given list of pulls, and the watermark stays as is. If the reviews of
+    some of the pulls, of numbers `failed`, could not be downloaded, the
+    watermark moves up to the oldest update date of those only, so that
+    they are downloaded again by the next sync.
+    """
+    filename = _reviews_filename(user, project, data_home=data_home)
+
+    # Update pre-existing data
+    if len(raw):
+        _schema.flatten(raw, "reviews")
+        _update_and_save(filename, raw,
+                         data_home=get_data_home(data_home))
+    if record:
+        dates = None if pulls is None else pulls["updated_at"]
+        if pulls is not None and len(failed):
+            dates = [dates[pulls["number"].isin(failed)].min()]
+        _sync.record_sync(
+            filename, dates, since=since,
+            info={"complete": pulls is not None},
+            data_home=get_data_home(data_home))
     return load_reviews(user, project, data_home=data_home)
 
 
 def _update_review_single(user, project, pull_request_id, auth=None,
-                          verbose=False, max_pages=100, per_page=500):
+                          verbose=False, max_pages=100, per_page=500,
+                          session=None, cache=None, projection=None,
+                          info=None, **params):
     """
     Fetches the data for a single PR.
+
+    If provided, `info` is filled with the pagination info of the listing
+    (see `_github_api.get_entries`).
     """
     url = 'https://api.github.com/repos/{}/{}/pulls/{}/reviews'.format(
             user, project, pull_request_id)
-    raw = _github_api.get_frames(auth, url,
-                                 max_pages=max_pages, per_page=per_page,
-                                 verbose=verbose)
-    raw = pd.DataFrame(raw)
+    batches = _github_api.iter_records(auth, url,
+                                       max_pages=max_pages,
+                                       per_page=per_page,
+                                       batch_size=BATCH_SIZE,
+                                       verbose=verbose, session=session,
+                                       cache=cache, projection=projection,
+                                       info=info, **params)
+    raw = _frame_from_batches(batches)
+    return raw
+
+
+async def _update_review_single_async(user, project, pull_request_id,
+                                      auth=None, verbose=False,
+                                      max_pages=100, per_page=500,
+                                      session=None, cache=None,
+                                      limiter=None, projection=None,
+                                      info=None, **params):
+    """
+    Fetches the data for a single PR, asynchronously.
+    """
+    url = 'https://api.github.com/repos/{}/{}/pulls/{}/reviews'.format(
+            user, project, pull_request_id)
+    batches = _github_api.aiter_records(auth, url,
+                                        max_pages=max_pages,
+                                        per_page=per_page,
+                                        batch_size=BATCH_SIZE,
+                                        verbose=verbose, session=session,
+                                        cache=cache, limiter=limiter,
+                                        projection=projection, info=info,
+                                        **params)
+    raw = _frame_from_batches([pd.DataFrame(batch)
+                               async for batch in batches])
     return raw
 
 
 def load_reviews(user, project, data_home=None,
-                 state="all"):
+                 state="all", columns=None):
     """
     Reads the reviews json files from the data folder.
 
@@ -117,6 +297,10 @@ def load_reviews(user, project, data_home=None,
     data_home : string
         The path to the watchtower data. Defaults to ~/watchtower_data.
 
+    columns : list of strings | None, optional, default: None
+        The columns to load, e.g. ["state", "submitted_at"]. Only these are
+        read from disk. If None, all the columns are loaded.
+
     Returns
     -------
     reviews : json | Projectreviews
@@ -130,9 +314,12 @@ def load_reviews(user, project, data_home=None,
     data_home = get_data_home(data_home)
     filepath = join(data_home, user, project, "reviews.json")
     try:
-        reviews = pd.read_json(filepath)
+        reviews = _load(filepath, columns=columns)
         if len(reviews) == 0:
             return None
-    except ValueError:
+    except (ValueError, IOError):
         return None
+    if columns is None:
+        # Datasets written by older versions lack the flattened columns
+        _schema.flatten(reviews, "reviews", overwrite=False)
     return reviews
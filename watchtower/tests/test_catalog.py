@@ -0,0 +1,61 @@
+import os
+
+import pandas as pd
+from watchtower import list_datasets
+from watchtower._config import set_storage
+from watchtower._io import _update_and_save, _save
+from watchtower._sync import record_sync
+from watchtower.datasets import _fake_datasets
+from watchtower.utils.testing import assert_equal
+
+
+def test_list_datasets(tmp_path):
+    data_home = str(tmp_path)
+    assert_equal(len(list_datasets(data_home=data_home)), 0)
+
+    issues = _fake_datasets.get_fake_issues()
+    filename = os.path.join(data_home, "matplotlib", "matplotlib",
+                            "issues.json")
+    _update_and_save(filename, issues, data_home=data_home)
+    commits = pd.DataFrame([{"sha": "a", "date": "2018-01-02T00:00:00Z"},
+                            {"sha": "b", "date": "2018-03-02T00:00:00Z"}])
+    commits_filename = os.path.join(data_home, "numpy", "numpy", "main",
+                                    "commits.json")
+    _save(commits_filename, commits, data_home=data_home)
+    # Datasets outside of the data home layout are not listed
+    _update_and_save(os.path.join(data_home, "issues.json"), issues,
+                     data_home=data_home)
+
+    datasets = list_datasets(data_home=data_home)
+    assert_equal(list(datasets["resource"]), ["issues", "commits"])
+    issues_entry = datasets.iloc[0]
+    assert_equal(issues_entry["records"], len(issues))
+    assert issues_entry["bytes"] > 0
+    created = pd.to_datetime(issues["created_at"], utc=True)
+    assert_equal(issues_entry["min_date"], created.min())
+    assert_equal(issues_entry["max_date"], created.max())
+    assert pd.isna(issues_entry["synced_at"])
+    commits_entry = datasets.iloc[1]
+    assert_equal(commits_entry["branch"], "main")
+    assert_equal(commits_entry["max_date"],
+                 pd.Timestamp("2018-03-02T00:00:00Z"))
+
+    # Updates and syncs are recorded
+    newer = issues.iloc[:1].assign(id=-1, created_at=pd.Timestamp(
+        "2019-05-01T00:00:00Z"))
+    _update_and_save(filename, newer, data_home=data_home)
+    record_sync(filename, newer["created_at"], data_home=data_home)
+    entry = list_datasets(data_home=data_home, resource="issues").iloc[0]
+    assert_equal(entry["records"], len(issues) + 1)
+    assert_equal(entry["max_date"], pd.Timestamp("2019-05-01T00:00:00Z"))
+    assert not pd.isna(entry["synced_at"])
+    assert_equal(len(list_datasets(data_home=data_home, user="scipy")), 0)
+
+    # The same with the sqlite storage
+    set_storage("sqlite")
+    try:
+        _update_and_save(filename, newer.assign(id=-2), data_home=data_home)
+        entry = list_datasets(data_home=data_home, project="matplotlib")
+        assert_equal(entry["records"].iloc[0], len(issues) + 2)
+    finally:
+        set_storage(None)
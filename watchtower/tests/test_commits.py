@@ -1,21 +1,25 @@
 import os
 from os.path import dirname
+import subprocess
 import tempfile
 
 import pandas as pd
-from watchtower.commits_ import is_doc
+from watchtower.commits_ import is_doc, find_word_in_string, find_words
 from watchtower._config import clear_data_home
 from watchtower.commits_ import load_commits
+from watchtower.commits_ import update_commit_files, load_commit_files
+from watchtower.commits_ import update_commits
+from watchtower._io import _update_and_save, _load
+from watchtower import _commit_store, load_rollup
 from watchtower.datasets import _fake_datasets
 from watchtower.utils.testing import assert_true, assert_equal
 from watchtower.utils.testing import assert_false
+from watchtower.utils.testing import fake_session
 
 DATA_HOME = tempfile.mkdtemp(prefix="watchtower_data_home_test_")
 
 
 def test_is_doc():
-    # FIXME
-    return
     # First, create scratch commit as panda's dataframe.
     commit = pd.DataFrame({"message": "DOC improved documentation",
                            "added": ["doc/module.rst"]})
@@ -28,6 +32,195 @@ def test_is_doc():
     assert_false(is_doc_.any())
 
 
+def test_update_commit_files(tmp_path):
+    data_home = str(tmp_path)
+    commits = pd.DataFrame({
+        "sha": ["a", "b", "c"],
+        "date": pd.to_datetime(["2018-01-02", "2018-02-03", "2018-03-04"],
+                               utc=True),
+        "message": ["Fix typo", "ENH new feature", "MAINT"]})
+    filename = os.path.join(data_home, "matplotlib", "matplotlib", "master",
+                            "commits.json")
+    _update_and_save(filename, commits)
+
+    detail = {"sha": "a", "stats": {"additions": 3, "deletions": 1},
+              "files": [{"filename": "doc/users/index.RST", "additions": 3,
+                         "deletions": 1}]}
+    session, adapter = fake_session({1: detail})
+    files = update_commit_files("matplotlib", "matplotlib", auth="user:key",
+                                data_home=data_home, max_download=2,
+                                session=session)
+    assert_equal(len(adapter.requests), 2)
+    assert_equal(sorted(files["sha"]), ["a", "b"])
+    assert_equal(list(files["files"].iloc[0]), ["doc/users/index.RST"])
+    assert_equal(files["additions"].iloc[0], 3)
+
+    # Only the commits never fetched are fetched
+    session, adapter = fake_session({1: detail})
+    files = update_commit_files("matplotlib", "matplotlib", auth="user:key",
+                                data_home=data_home, session=session)
+    assert_equal(len(adapter.requests), 1)
+    assert_equal(len(load_commit_files("matplotlib", "matplotlib",
+                                       data_home=data_home)), 3)
+
+    files = files.assign(files=[["doc/index.rst"], ["lib/core.py"], []])
+    files = files.set_index("sha").loc[["a", "b", "c"]].reset_index()
+    assert_equal(list(is_doc(commits, use_files=True, files=files)),
+                 [True, False, False])
+    assert_equal(list(is_doc(commits, use_message=False, use_files=True,
+                             files=files.iloc[:1])),
+                 [True, False, False])
+
+
+def _fake_commit(sha, date, parents=()):
+    return {"sha": sha, "parents": [{"sha": p} for p in parents],
+            "commit": {"message": "Commit %s" % sha,
+                       "author": {"date": date},
+                       "committer": {"date": date}}}
+
+
+def test_update_commits_branches(tmp_path):
+    data_home = str(tmp_path)
+    c0 = _fake_commit("c0", "2017-12-01T00:00:00Z")
+    c1 = _fake_commit("c1", "2018-01-01T00:00:00Z", ["c0"])
+    c2 = _fake_commit("c2", "2018-02-01T00:00:00Z", ["c1"])
+    c3 = _fake_commit("c3", "2018-03-01T00:00:00Z", ["c2"])
+    m1 = _fake_commit("m1", "2018-03-02T00:00:00Z", ["c2"])
+    stale = _fake_commit("z", "2017-01-01T00:00:00Z")
+
+    session, adapter = fake_session({1: [c3, c2], 2: [c1, c0]})
+    update_commits("matplotlib", "matplotlib", auth="user:key",
+                   data_home=data_home, per_page=2, session=session,
+                   use_cache=False)
+    assert "sha=master" in adapter.requests[0].url
+
+    # The listing of the branch stops at the first page of known commits
+    session, adapter = fake_session({1: [m1, c2], 2: [c1, c0],
+                                     3: [stale]})
+    commits = update_commits("matplotlib", "matplotlib", auth="user:key",
+                             data_home=data_home, branch="maint",
+                             per_page=2, session=session, use_cache=False)
+    assert_equal(sorted(commits["sha"]), ["c0", "c1", "c2", "m1"])
+    store = os.path.join(data_home, "matplotlib", "matplotlib",
+                         "commit_store.json")
+    assert_equal(sorted(_load(store)["sha"]), ["c0", "c1", "c2", "c3", "m1"])
+    master = load_commits("matplotlib", "matplotlib", data_home=data_home,
+                          columns=["sha", "message"])
+    assert_equal(sorted(master["sha"]), ["c0", "c1", "c2", "c3"])
+    assert_equal(list(master.columns), ["sha", "message"])
+
+    # Branches written by older versions are moved to the store
+    legacy = os.path.join(data_home, "matplotlib", "matplotlib", "v1",
+                          "commits.json")
+    old = pd.DataFrame([_fake_commit("v1", "2016-01-01T00:00:00Z")])
+    _update_and_save(legacy, old.assign(date=pd.Timestamp(
+        "2016-01-01T00:00:00Z")))
+    session, _ = fake_session({})
+    commits = update_commits("matplotlib", "matplotlib", auth="user:key",
+                             data_home=data_home, branch="v1",
+                             session=session, use_cache=False)
+    assert_equal(list(_load(legacy).columns), ["sha", "date"])
+    assert_equal(list(load_commits("matplotlib", "matplotlib",
+                                   data_home=data_home, branch="v1")["sha"]),
+                 ["v1"])
+
+
+def test_add_commits_batches(tmp_path, monkeypatch):
+    filename = str(tmp_path / "matplotlib" / "master" / "commits.json")
+    commits = pd.DataFrame({
+        "sha": ["c%d" % i for i in range(6)][::-1],
+        "date": pd.date_range("2018-01-01", periods=6, tz="UTC")[::-1],
+        "parents": [[{"sha": "c%d" % (i - 1)}] if i else []
+                    for i in range(6)][::-1],
+        "message": "ENH"})
+    index = _commit_store.load_index(filename)
+
+    # Batches stored from the most recent: the store is never read
+    loaded = []
+
+    def load(filename, **kwargs):
+        loaded.append(filename)
+        return _load(filename, **kwargs)
+
+    monkeypatch.setattr(_commit_store, "_load", load)
+    for start in range(0, 6, 2):
+        _commit_store.add_commits(filename, commits.iloc[start:start + 2],
+                                  index=index)
+    assert_equal(loaded, [])
+    assert_equal(sorted(_load(filename)["sha"]), sorted(commits["sha"]))
+    assert_equal(load_rollup("matplotlib", "", "commits", freq="Y",
+                             data_home=str(tmp_path))["all"].sum(), 6)
+
+
+def _git(clone, *args, date="2018-01-02T10:00:00+02:00"):
+    env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date,
+               GIT_AUTHOR_NAME="Jane", GIT_AUTHOR_EMAIL="jane@example.com",
+               GIT_COMMITTER_NAME="Jane",
+               GIT_COMMITTER_EMAIL="jane@example.com")
+    subprocess.run(["git", "-C", clone] + list(args), env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_update_commits_git(tmp_path):
+    clone = str(tmp_path / "clone")
+    os.makedirs(clone)
+    _git(clone, "init", "-b", "main")
+    os.makedirs(os.path.join(clone, "doc"))
+    with open(os.path.join(clone, "doc", "index.rst"), "w") as f:
+        f.write("Title\n=====\n")
+    _git(clone, "add", "-A")
+    _git(clone, "commit", "-m", "DOC first\n\nA longer\nmessage")
+    with open(os.path.join(clone, "setup.py"), "w") as f:
+        f.write("import setuptools\n")
+    _git(clone, "add", "-A")
+    _git(clone, "commit", "-m", "ENH setup", date="2018-03-04T10:00:00Z")
+
+    data_home = str(tmp_path / "data_home")
+    commits = update_commits("matplotlib", "matplotlib", data_home=data_home,
+                             branch="main", backend="git", clone=clone)
+    commits = commits.sort_values("authored_at").reset_index(drop=True)
+    assert_equal(list(commits["message"]),
+                 ["DOC first\n\nA longer\nmessage", "ENH setup"])
+    assert_equal(commits["authored_at"].iloc[0],
+                 pd.Timestamp("2018-01-02T08:00:00Z"))
+    assert_equal(commits["parents"].iloc[1], [{"sha": commits["sha"][0]}])
+    files = load_commit_files("matplotlib", "matplotlib", data_home=data_home)
+    assert_equal(list(is_doc(commits, use_message=False, use_files=True,
+                             files=files)), [True, False])
+    files = files.set_index("sha").loc[commits["sha"]]
+    assert_equal(list(files["additions"]), [2, 1])
+
+    # Only the new commits are read on the next sync
+    with open(os.path.join(clone, "README.md"), "w") as f:
+        f.write("watchtower\n")
+    _git(clone, "add", "-A")
+    _git(clone, "commit", "-m", "DOC readme", date="2018-05-06T10:00:00Z")
+    commits = update_commits("matplotlib", "matplotlib", data_home=data_home,
+                             branch="main", backend="git", clone=clone)
+    assert_equal(len(commits), 3)
+
+
+def test_find_words():
+    messages = pd.Series(["DOC fix docstring", "ENH new feature", None,
+                          "MAINT docs: fixed typo", "abc"],
+                         index=list("vwxyz"))
+    queries = ["doc", "docstring", "FIX", "ab", "bc"]
+    hits = find_words(messages, queries)
+    assert_equal(list(hits.columns), queries)
+    assert_equal(list(hits.index), list("vwxyz"))
+    assert_equal(hits.values.tolist(), [
+        [True, True, True, False, False],
+        [False, False, False, False, False],
+        [False, False, False, False, False],
+        [True, False, True, False, False],
+        [False, False, False, True, True]])
+
+    assert_equal(list(find_word_in_string(messages, ["typo", "feat"])),
+                 [False, True, False, True, False])
+    assert_true(find_word_in_string("Improve the DOCS"))
+    assert_false(find_word_in_string("Improve the DOCS", ["api"]))
+
+
 def test_load_commits():
     commits = load_commits("matplotlib", "matplotlib", data_home=DATA_HOME)
     clear_data_home(data_home=DATA_HOME)
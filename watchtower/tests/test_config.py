@@ -3,6 +3,7 @@ from os import environ
 import tempfile
 
 from watchtower._config import get_data_home, clear_data_home, get_API_token
+from watchtower._config import get_API_tokens
 
 from watchtower.utils.testing import assert_true, assert_false
 from watchtower.utils.testing import assert_equal
@@ -37,3 +38,19 @@ def test_get_API_token():
     # No API token:
     api_token = get_API_token(token_key="LBDPCBAZLZBE")
     assert api_token is None
+
+
+def test_get_API_tokens():
+    environ["WATCHTOWER_TEST_TOKEN"] = "alice:a"
+    environ["WATCHTOWER_TEST_TOKEN2"] = "bob:b"
+    environ["WATCHTOWER_TEST_TOKEN10"] = "carol:c"
+    environ["WATCHTOWER_TEST_TOKEN_USER"] = "not a token"
+    try:
+        # Sorted by number, not by name
+        tokens = get_API_tokens(token_key="WATCHTOWER_TEST_TOKEN")
+        assert_equal(tokens, ["alice:a", "bob:b", "carol:c"])
+    finally:
+        del environ["WATCHTOWER_TEST_TOKEN"]
+        del environ["WATCHTOWER_TEST_TOKEN2"]
+        del environ["WATCHTOWER_TEST_TOKEN10"]
+        del environ["WATCHTOWER_TEST_TOKEN_USER"]
@@ -1,4 +1,20 @@
-from watchtower._github_api import get_frames
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from watchtower._github_api import get_frames, get_entries, iter_records
+from watchtower._github_api import get_detailed_page, PaginationError
+from watchtower._github_api import aget_entries
+from watchtower import _github_api
+from watchtower._github_api import make_session, get_session, set_session
+from watchtower._http_cache import get_cache
+from watchtower._checkpoint import PaginationCheckpoint
+from watchtower._cassette import CassetteAdapter, CassetteMiss
+from watchtower.issues_ import update_issues
+from watchtower.datasets import _fake_datasets
+from watchtower.utils.testing import assert_equal, assert_true
+from watchtower.utils.testing import fake_session as _fake_session
+from watchtower.utils.testing import FakeAdapter
 import pytest
 
 
@@ -8,3 +24,261 @@ def test_get_frames():
     url = "https://api.github.com/repos/matplotlib/matplotlib/commits"
     with pytest.warns(UserWarning):
         get_frames(auth, url)
+
+
+def test_session():
+    session = make_session(pool_maxsize=4, headers={"X-Test": "1"})
+    assert_equal(session.headers["X-Test"], "1")
+    assert_true("User-Agent" in session.headers)
+
+    # The shared session is created once and reused
+    set_session(None)
+    assert_true(get_session() is get_session())
+    assert_true(get_session(session) is session)
+    set_session(session)
+    assert_true(get_session() is session)
+    set_session(None)
+
+
+def test_get_entries_session():
+    session, adapter = _fake_session({1: [{"id": 1}], 2: [{"id": 2}]})
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+    entries = list(get_entries(None, url, session=session))
+    assert_equal(entries, [[{"id": 1}], [{"id": 2}]])
+    assert_true(all(r.headers["User-Agent"] == "watchtower"
+                    for r in adapter.requests))
+
+    page = get_detailed_page(None, url, session=session)
+    assert_equal(page, [{"id": 1}])
+
+
+def test_get_entries_cache(tmp_path):
+    data_home = str(tmp_path)
+    cache = get_cache(data_home)
+    assert_true(get_cache(data_home) is cache)
+
+    pages = {1: [{"id": 1}], 2: [{"id": 2}]}
+    session, adapter = _fake_session(pages)
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+    entries = list(get_entries(None, url, session=session, cache=cache))
+    assert_equal(cache.info()["hits"], 0)
+    assert_equal(cache.info()["misses"], 2)
+
+    # Nothing changed: the bodies are read from the cache
+    cached_entries = list(get_entries(None, url, session=session,
+                                      cache=cache))
+    assert_equal(cached_entries, entries)
+    assert_equal(cache.info()["hits"], 2)
+    assert_equal(cache.info()["hit_rate"], 0.5)
+
+    # A page changed: it is downloaded again
+    pages[2] = [{"id": 2}, {"id": 3}]
+    entries = list(get_entries(None, url, session=session, cache=cache))
+    assert_equal(entries[-1], [{"id": 2}, {"id": 3}])
+    assert_equal(cache.info()["misses"], 3)
+    cache.clear()
+
+    # The counters are shared by the threads fetching pages
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: cache.count(hit=i % 2), range(2000)))
+    assert_equal(cache.info()["hits"], 1000)
+    assert_equal(cache.info()["misses"], 1000)
+    cache.clear()
+
+
+def test_get_entries_pagination():
+    pages = {i: [{"id": i}] for i in range(1, 11)}
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+
+    # Pages are fetched concurrently, but returned in order, and no request
+    # is wasted on an empty page.
+    session, adapter = _fake_session(pages)
+    entries = list(get_entries(None, url, session=session, n_jobs=4))
+    assert_equal(entries, [pages[i] for i in range(1, 11)])
+    assert_equal(len(adapter.requests), 10)
+
+    session, adapter = _fake_session(pages)
+    entries = list(get_entries(None, url, session=session, max_pages=3))
+    assert_equal(entries, [pages[i] for i in range(1, 4)])
+    assert_equal(len(adapter.requests), 3)
+
+    # Only the pages in flight are requested when the listing is stopped
+    session, adapter = _fake_session(pages)
+    entries = get_entries(None, url, session=session, n_jobs=2)
+    assert_equal([next(entries) for _ in range(3)],
+                 [pages[i] for i in range(1, 4)])
+    entries.close()
+    assert_true(len(adapter.requests) <= 5)
+
+    # Without a Link header, there is a single page
+    session, adapter = _fake_session(pages, links=False)
+    entries = list(get_entries(None, url, session=session))
+    assert_equal(entries, [pages[1]])
+
+
+def test_get_entries_retry_and_resume(monkeypatch, tmp_path):
+    monkeypatch.setattr(_github_api, "BACKOFF_FACTOR", 0.)
+    pages = {i: [{"id": i}] for i in range(1, 6)}
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+
+    # Transient errors are retried
+    session, adapter = _fake_session(pages)
+    adapter.failures[3] = 2
+    entries = list(get_entries(None, url, session=session))
+    assert_equal(len(entries), 5)
+
+    # Persistent errors interrupt the download, which then resumes from the
+    # checkpoint
+    filename = str(tmp_path / "issues.json")
+    session, adapter = _fake_session(pages)
+    adapter.failures[4] = _github_api.MAX_RETRIES + 1
+    with pytest.raises(PaginationError):
+        list(get_entries(None, url, session=session, n_jobs=1,
+                         checkpoint=filename))
+
+    session, adapter = _fake_session(pages)
+    entries = list(get_entries(None, url, session=session,
+                               checkpoint=filename))
+    assert_equal(entries, [pages[i] for i in range(1, 6)])
+    assert_equal(len(adapter.requests), 2)
+
+
+def test_checkpoint_corrupted(tmp_path):
+    filename = str(tmp_path / "issues.json")
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+    checkpoint = PaginationCheckpoint(filename, url, {})
+    checkpoint.commit(1, [{"id": 1}])
+    checkpoint.commit(2, [{"id": 2}])
+    # Interrupted while appending the third page
+    with open(checkpoint.pages_filename, "a") as f:
+        f.write('[{"id": 3')
+
+    checkpoint = PaginationCheckpoint(filename, url, {})
+    assert_equal(checkpoint.page, 2)
+    assert_equal(list(checkpoint.pages()), [[{"id": 1}], [{"id": 2}]])
+    checkpoint.commit(3, [{"id": 3}])
+    checkpoint = PaginationCheckpoint(filename, url, {})
+    assert_equal(list(checkpoint.pages()),
+                 [[{"id": 1}], [{"id": 2}], [{"id": 3}]])
+
+    # The spool lost a recorded page: the listing is downloaded again
+    with open(checkpoint.pages_filename, "r+b") as f:
+        f.truncate(5)
+    checkpoint = PaginationCheckpoint(filename, url, {})
+    assert_equal(checkpoint.page, 0)
+    assert_equal(list(checkpoint.pages()), [])
+
+
+def test_iter_records():
+    pages = {i: [{"id": 3 * i + j} for j in range(3)] for i in range(4)}
+    pages = {i + 1: page for i, page in pages.items()}
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+    session, _ = _fake_session(pages)
+    records = list(iter_records(None, url, session=session))
+    assert_equal([r["id"] for r in records], list(range(12)))
+
+    session, _ = _fake_session(pages)
+    batches = list(iter_records(None, url, session=session, batch_size=5))
+    assert_equal([len(b) for b in batches], [5, 5, 2])
+
+    session, _ = _fake_session(pages)
+    assert_equal(get_frames(None, url, session=session), records)
+
+
+def test_aget_entries():
+    pages = {i: [{"id": i}] for i in range(1, 8)}
+    url = "https://api.github.com/repos/matplotlib/matplotlib/issues"
+    session, adapter = _fake_session(pages)
+
+    info = {}
+
+    async def fetch():
+        limiter = asyncio.Semaphore(2)
+        return [entry async for entry in aget_entries(
+            None, url, session=session, limiter=limiter, info=info)]
+
+    entries = asyncio.run(fetch())
+    assert_equal(entries, [pages[i] for i in range(1, 8)])
+    assert_equal(len(adapter.requests), 7)
+    assert_equal((info["last_page"], info["complete"]), (7, True))
+
+    # Stopping the listing stops its downloads
+    session, adapter = _fake_session(pages)
+
+    async def fetch_first():
+        entries = aget_entries(None, url, session=session, n_jobs=2)
+        first = await entries.__anext__()
+        await entries.aclose()
+        return first
+
+    assert_equal(asyncio.run(fetch_first()), pages[1])
+    assert_true(len(adapter.requests) <= 3)
+
+
+def test_cassette(monkeypatch, tmp_path):
+    monkeypatch.setattr(_github_api, "BACKOFF_FACTOR", 0.)
+    fake_issues = _fake_datasets.get_fake_issues(format="json")
+    pages = {1: fake_issues[:5], 2: fake_issues[5:]}
+    cassette = str(tmp_path / "cassette")
+    data_home = str(tmp_path / "data_home")
+
+    # Record a sync served by the fake GitHub
+    fake = FakeAdapter(pages)
+    fake.failures[2] = 1
+    session = make_session()
+    session.mount("https://", CassetteAdapter(cassette, mode="record",
+                                              adapter=fake))
+    recorded = update_issues("matplotlib", "matplotlib", auth="user:secret",
+                             data_home=data_home, session=session,
+                             use_cache=False)
+    adapter = session.get_adapter("https://")
+    assert_equal(adapter.recorded, len(fake.requests))
+    for root, _, filenames in os.walk(cassette):
+        for filename in filenames:
+            with open(os.path.join(root, filename)) as f:
+                assert_true("secret" not in f.read())
+
+    # Replay it offline, with the failed request retried as when recorded
+    # (the same requests are sent, as in a full sync)
+    sleeps = []
+    session = _github_api.make_cassette_session(cassette, latency=0.1)
+    session.get_adapter("https://").sleep = sleeps.append
+    replayed = update_issues("matplotlib", "matplotlib", auth="user:secret",
+                             data_home=data_home, session=session,
+                             use_cache=False, resume=False,
+                             incremental=False)
+    adapter = session.get_adapter("https://")
+    assert_equal(adapter.replayed, len(fake.requests))
+    assert_equal(sleeps, [0.1] * len(fake.requests))
+    assert_equal(sorted(replayed["id"]), sorted(recorded["id"]))
+
+    with pytest.raises(CassetteMiss):
+        session.get("https://api.github.com/repos/numpy/numpy/issues")
+
+
+def test_cassette_validators(tmp_path):
+    fake_issues = _fake_datasets.get_fake_issues(format="json")
+    pages = {1: fake_issues[:5], 2: fake_issues[5:]}
+    cassette = str(tmp_path / "cassette")
+    warm = str(tmp_path / "warm")
+    cold = str(tmp_path / "cold")
+    kwargs = dict(auth="user:key", resume=False, incremental=False)
+
+    # Record a sync with a warm cache, sending conditional requests
+    session, _ = _fake_session(pages)
+    update_issues("matplotlib", "matplotlib", data_home=warm,
+                  session=session, **kwargs)
+    session = make_session()
+    session.mount("https://", CassetteAdapter(cassette, mode="record",
+                                              adapter=FakeAdapter(pages)))
+    recorded = update_issues("matplotlib", "matplotlib", data_home=warm,
+                             session=session, **kwargs)
+
+    # Replay it with a cold cache, and with a warm one
+    for data_home in (cold, warm):
+        session = _github_api.make_cassette_session(cassette)
+        replayed = update_issues("matplotlib", "matplotlib",
+                                 data_home=data_home, session=session,
+                                 **kwargs)
+        assert_equal(sorted(replayed["id"]), sorted(recorded["id"]))
+    assert_equal(get_cache(warm).info()["hits"], 2)
@@ -1,9 +1,14 @@
 import os
+import shutil
 import tempfile
+import threading
 
 import numpy as np
 import pandas as pd
-from watchtower._io import _update_and_save
+from watchtower._io import _update_and_save, _frame_from_batches, _load
+from watchtower._io import _save, _locked, storage_info
+from watchtower import _io
+from watchtower import _load_cache
 from watchtower.datasets._fake_datasets import get_fake_issues
 
 
@@ -13,10 +18,236 @@ def test_date_iso():
         filename = os.path.join(tempdir, "issues.json")
         _update_and_save(filename, issues)
 
-        old_issues = pd.read_json(filename)
+        old_issues = _load(filename)
         old_date = pd.datetime(1980, 1, 1)
         assert np.all(old_issues["created_at"] > old_date)
 
-        _update_and_save(filename, issues, old_issues)
-        issues = pd.read_json(filename)
+        _update_and_save(filename, issues)
+        issues = _load(filename)
         assert np.all(issues["created_at"] > old_date)
+
+
+def test_frame_from_batches():
+    batches = ([{"id": i, "title": str(i)} for i in range(j, j + 10)]
+               for j in range(0, 30, 10))
+    frame = _frame_from_batches(batches)
+    assert len(frame) == 30
+    assert list(frame["id"]) == list(range(30))
+
+    assert len(_frame_from_batches([])) == 0
+
+
+def test_load_columns_and_migration():
+    issues = get_fake_issues()
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+        # A dataset stored as json by an older version
+        issues.to_json(filename, date_format="iso")
+        old_issues = pd.read_json(filename)
+
+        loaded = _load(filename)
+        assert not os.path.exists(filename)
+        assert os.path.isdir(os.path.join(tempdir, "issues"))
+        assert list(loaded.columns) == list(old_issues.columns)
+        assert list(loaded["id"]) == list(old_issues["id"])
+        assert list(loaded["user"]) == list(old_issues["user"])
+        assert list(loaded["labels"]) == list(old_issues["labels"])
+        assert list(loaded["created_at"]) == list(old_issues["created_at"])
+
+        loaded = _load(filename, columns=["number", "user", "unknown"])
+        assert list(loaded.columns) == ["number", "user"]
+        assert list(loaded["user"]) == list(old_issues["user"])
+
+        _save(filename, loaded.iloc[:1])
+        assert len(_load(filename)) == 1
+
+
+def test_update_touches_changed_partitions():
+    records = [{"id": i, "title": str(i),
+                "created_at": "2017-%02d-01T00:00:00Z" % (1 + i % 3)}
+               for i in range(9)]
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+        _update_and_save(filename, pd.DataFrame(records))
+        path = os.path.join(tempdir, "issues")
+        partitions = sorted(p for p in os.listdir(path)
+                            if not p.startswith("_"))
+        assert [os.path.splitext(p)[0] for p in partitions] == [
+            "2017-01", "2017-02", "2017-03"]
+        mtimes = {p: os.stat(os.path.join(path, p)).st_mtime_ns
+                  for p in partitions}
+
+        # One changed record, and one new record without a date
+        update = [dict(records[1], title="changed"), {"id": 9, "title": "9"}]
+        _update_and_save(filename, pd.DataFrame(update))
+        for partition in partitions:
+            changed = os.stat(os.path.join(path, partition)).st_mtime_ns != \
+                mtimes[partition]
+            assert changed == partition.startswith("2017-02")
+
+        issues = _load(filename)
+        assert sorted(issues["id"]) == list(range(10))
+        assert issues.set_index("id").loc[1, "title"] == "changed"
+        assert len(os.listdir(path)) == 5
+
+
+def test_upsert_newest():
+    records = [{"id": i, "title": "v1", "created_at": "2017-01-01T00:00:00Z",
+                "updated_at": "2017-02-01T00:00:00Z"} for i in range(4)]
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+        _update_and_save(filename, pd.DataFrame(records))
+        assert os.path.exists(os.path.join(tempdir, "issues", "_keys",
+                                           "2017-01.json"))
+
+        update = [
+            # A stale version, discarded
+            dict(records[0], title="v0", updated_at="2017-01-15T00:00:00Z"),
+            # Two versions of the same record in the batch
+            dict(records[1], title="v2", updated_at="2017-03-01T00:00:00Z"),
+            dict(records[1], title="v3", updated_at="2017-04-01T00:00:00Z"),
+            # A record which creation date was unknown
+            {"id": 4, "title": "v1", "updated_at": "2017-02-01T00:00:00Z"}]
+        _update_and_save(filename, pd.DataFrame(update))
+        _update_and_save(filename, pd.DataFrame([dict(update[3],
+                         created_at="2017-02-01T00:00:00Z")]))
+
+        issues = _load(filename).set_index("id")
+        assert sorted(issues.index) == list(range(5))
+        assert list(issues["title"].sort_index()) == [
+            "v1", "v3", "v1", "v1", "v1"]
+        partitions = sorted(os.listdir(os.path.join(tempdir, "issues")))
+        assert [os.path.splitext(p)[0] for p in partitions] == [
+            "2017-01", "2017-02", "_keys"]
+
+        # The index is rebuilt if it is lost
+        shutil.rmtree(os.path.join(tempdir, "issues", "_keys"))
+        _update_and_save(filename, pd.DataFrame(update[:1]))
+        assert _load(filename).set_index("id").loc[0, "title"] == "v1"
+
+
+def test_upsert_key_shards():
+    commits = [{"sha": "s%d" % i, "message": "v1",
+                "date": "2017-%02d-01T00:00:00Z" % (1 + i % 2)}
+               for i in range(4)]
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "commits.json")
+        _update_and_save(filename, pd.DataFrame(commits))
+        shards = os.path.join(tempdir, "commits", "_keys")
+        assert sorted(os.listdir(shards)) == ["2017-01.json", "2017-02.json"]
+        mtime = os.stat(os.path.join(shards, "2017-02.json")).st_mtime_ns
+
+        # Only the shard of the updated record is rewritten, and commits
+        # are replaced as the other records
+        _update_and_save(filename, pd.DataFrame([dict(commits[0],
+                                                      message="v2")]))
+        assert os.stat(os.path.join(shards, "2017-02.json")).st_mtime_ns \
+            == mtime
+        commits = _load(filename).set_index("sha")
+        assert len(commits) == 4
+        assert commits.loc["s0", "message"] == "v2"
+
+
+def test_concurrent_updates():
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+
+        def update(start):
+            for i in range(start, start + 20, 4):
+                _update_and_save(filename, pd.DataFrame([
+                    {"id": j, "created_at": "2017-01-01T00:00:00Z"}
+                    for j in range(i, i + 4)]))
+
+        threads = [threading.Thread(target=update, args=(start,))
+                   for start in (0, 20, 40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(_load(filename)["id"]) == list(range(60))
+        # No temporary file is left behind
+        assert not [f for f in os.listdir(os.path.join(tempdir, "issues"))
+                    if f.endswith(".tmp")]
+
+        # Readers don't wait for writers
+        with _locked(filename):
+            assert len(_load(filename)) == 60
+
+
+def test_compression(monkeypatch):
+    issues = get_fake_issues()
+    issues = pd.concat([issues] * 50, ignore_index=True)
+    issues["id"] = range(len(issues))
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+        path = os.path.join(tempdir, "issues")
+
+        if _io.pq is not None:
+            # Parquet files are compressed by pyarrow, with its default codec
+            # unless one is set
+            monkeypatch.delenv("WATCHTOWER_COMPRESSION", raising=False)
+            _update_and_save(filename, issues)
+            metadata = _io.pq.ParquetFile(
+                os.path.join(path, "2019-02.parquet")).metadata
+            assert metadata.row_group(0).column(0).compression == "SNAPPY"
+            _save(filename, issues.iloc[:0])
+
+            monkeypatch.setenv("WATCHTOWER_COMPRESSION", "zstd")
+            _update_and_save(filename, issues)
+            metadata = _io.pq.ParquetFile(
+                os.path.join(path, "2019-02.parquet")).metadata
+            assert metadata.row_group(0).column(0).compression == "ZSTD"
+            assert storage_info(filename)["records"] == len(issues)
+            _save(filename, issues.iloc[:0])
+
+        # json partitions, compressed as a whole
+        monkeypatch.setattr(_io, "pq", None)
+        monkeypatch.setenv("WATCHTOWER_COMPRESSION", "gzip")
+        _update_and_save(filename, issues)
+        assert sorted(os.listdir(path)) == ["2019-02.json.gz", "_keys"]
+        info = storage_info(filename)
+        assert info["records"] == len(issues)
+        assert info["compression_ratio"] > 5
+        assert info["load_seconds"] >= 0
+
+        monkeypatch.setenv("WATCHTOWER_COMPRESSION", "none")
+        _save(filename, _load(filename))
+        assert sorted(os.listdir(path)) == ["2019-02.json"]
+        assert storage_info(filename)["compression_ratio"] == 1.
+        assert list(_load(filename)["id"]) == list(issues["id"])
+
+
+def test_load_cache():
+    cache = _load_cache.LoadCache(2 ** 20)
+    records = [{"id": i, "title": "v1", "created_at": "2017-01-01T00:00:00Z",
+                "updated_at": "2017-02-01T00:00:00Z"} for i in range(4)]
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "issues.json")
+        _update_and_save(filename, pd.DataFrame(records))
+        original = _io._load_cache._CACHE
+        _io._load_cache._CACHE = cache
+        try:
+            issues = _load(filename)
+            # Callers can't corrupt the cached frame
+            issues["title"] = "modified"
+            assert list(_load(filename)["title"]) == ["v1"] * 4
+            assert cache.info()["hits"] == 1
+            assert cache.info()["misses"] == 1
+
+            # The cache is invalidated when the dataset changes
+            _update_and_save(filename, pd.DataFrame([dict(
+                records[0], title="v2", updated_at="2017-03-01T00:00:00Z")]))
+            assert sorted(_load(filename)["title"]) == ["v1"] * 3 + ["v2"]
+            assert cache.info()["misses"] == 2
+
+            # Frames are evicted to stay within the budget
+            _load(filename, columns=["id"])
+            assert cache.info()["entries"] == 2
+            cache.resize(cache.info()["nbytes"] - 1)
+            assert cache.info()["entries"] == 1
+            assert cache.info()["evictions"] == 1
+            cache.resize(0)
+            _load(filename)
+            assert cache.info()["entries"] == 0
+        finally:
+            _io._load_cache._CACHE = original
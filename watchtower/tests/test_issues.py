@@ -1,9 +1,17 @@
+import asyncio
+import os
 import tempfile
+
+import pandas as pd
+
+from watchtower import _sync
 from watchtower._config import clear_data_home
 from watchtower.issues_ import load_issues, extract_ticket_number
 from watchtower.issues_ import estimate_date_since_last_update
+from watchtower.issues_ import update_issues, update_issues_async
 from watchtower.utils.testing import assert_true, assert_equal
 from watchtower.datasets import _fake_datasets
+from watchtower.utils.testing import fake_session
 
 DATA_HOME = tempfile.mkdtemp(prefix="watchtower_data_home_test_")
 
@@ -33,3 +41,67 @@ def test_estimate_date_since_last_update():
     data_home = _fake_datasets.get_mock_directory_path()
     issues = load_issues("matplotlib", "matplotlib", data_home=data_home)
     assert estimate_date_since_last_update(issues) is None
+
+
+def test_update_issues_async(tmp_path):
+    fake_issues = _fake_datasets.get_fake_issues(format="json")
+    pages = {1: fake_issues[:5], 2: fake_issues[5:]}
+    data_home = str(tmp_path)
+
+    session, _ = fake_session(pages)
+    issues = asyncio.run(update_issues_async(
+        "matplotlib", "matplotlib", auth="user:key", data_home=data_home,
+        session=session, use_cache=False))
+    assert_equal(len(issues), len(fake_issues))
+
+    # The synchronous version stores the same dataset
+    session, _ = fake_session(pages)
+    issues_sync = update_issues(
+        "matplotlib", "matplotlib", auth="user:key", data_home=data_home,
+        session=session, use_cache=False)
+    assert_equal(sorted(issues_sync["id"]), sorted(issues["id"]))
+
+
+def test_update_issues_incremental(tmp_path):
+    fake_issues = _fake_datasets.get_fake_issues(format="json")
+    pages = {1: fake_issues[:1], 2: fake_issues[1:]}
+    data_home = str(tmp_path)
+    filename = os.path.join(data_home, "matplotlib", "matplotlib",
+                            "issues.json")
+
+    # A run stopped by max_pages does not set the watermark
+    session, adapter = fake_session(pages)
+    update_issues("matplotlib", "matplotlib", auth="user:key",
+                  data_home=data_home, session=session, use_cache=False,
+                  max_pages=1)
+    state = _sync.get_state(filename)
+    assert_equal(state["last_page"], 1)
+    assert_equal(state["complete"], False)
+    assert_equal(state["watermark"], None)
+
+    session, adapter = fake_session(pages)
+    update_issues("matplotlib", "matplotlib", auth="user:key",
+                  data_home=data_home, session=session, use_cache=False)
+    state = _sync.get_state(filename)
+    assert_true(state["complete"])
+    assert_equal(state["last_page"], 2)
+    assert_true(state["etag"] is not None)
+    newest = max(pd.to_datetime([i["updated_at"] for i in fake_issues],
+                                utc=True))
+    assert_equal(state["watermark"], newest.strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    # The next run resumes from the watermark
+    session, adapter = fake_session({1: fake_issues[:1]})
+    issues = update_issues("matplotlib", "matplotlib", auth="user:key",
+                           data_home=data_home, session=session,
+                           use_cache=False)
+    assert_true("since=" + state["watermark"].replace(":", "%3A") in
+                adapter.requests[0].url)
+    assert_equal(len(issues), len(fake_issues))
+
+    # ... unless the listing changes
+    session, adapter = fake_session(pages)
+    update_issues("matplotlib", "matplotlib", auth="user:key",
+                  data_home=data_home, session=session, use_cache=False,
+                  state="open")
+    assert_true("since=" not in adapter.requests[0].url)
@@ -0,0 +1,196 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from watchtower import _github_api, _sync
+from watchtower._github_api import make_session
+from watchtower._io import _update_and_save
+from watchtower.pulls_ import update_pulls, load_pulls
+from watchtower.pulls_ import update_detailed_pulls
+from watchtower.reviews_ import load_reviews, update_reviews
+from watchtower.comments_ import load_comments
+from watchtower.utils.testing import assert_equal, assert_true
+from watchtower.utils.testing import fake_session
+
+
+def _node(number):
+    return {
+        "databaseId": 1000 + number, "number": number,
+        "title": "PR %d" % number, "state": "MERGED", "locked": False,
+        "url": "https://github.com/docathon/watchtower/pull/%d" % number,
+        "body": "", "createdAt": "2018-06-0%dT00:00:00Z" % number,
+        "updatedAt": "2018-06-0%dT00:00:00Z" % number,
+        "closedAt": None, "mergedAt": "2018-06-0%dT00:00:00Z" % number,
+        "merged": True, "author": {"login": "alice"},
+        "baseRefName": "master", "headRefName": "fix-%d" % number,
+        "additions": 1, "deletions": 2, "changedFiles": 1,
+        "commits": {"totalCount": 1},
+        "labels": {"nodes": [{"name": "Documentation", "color": "fff"}]},
+        "reviews": {
+            "pageInfo": {"hasNextPage": number == 1, "endCursor": "r1"},
+            "nodes": [{"databaseId": 2000 + number, "state": "APPROVED",
+                       "body": "", "submittedAt": "2018-06-01T00:00:00Z",
+                       "url": "", "author": {"login": "bob"}}]},
+        "comments": {
+            "pageInfo": {"hasNextPage": False, "endCursor": None},
+            "nodes": [{"databaseId": 3000 + number, "body": "thanks",
+                       "createdAt": "2018-06-01T00:00:00Z",
+                       "updatedAt": "2018-06-01T00:00:00Z", "url": "",
+                       "author": None}]},
+    }
+
+
+class FakeGraphQLAdapter(BaseAdapter):
+    """Answers the pull requests GraphQL queries with two batches."""
+
+    def __init__(self):
+        super(FakeGraphQLAdapter, self).__init__()
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        payload = json.loads(request.body)
+        variables = payload["variables"]
+        if "number" in variables:
+            data = {"pullRequest": {"reviews": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [{"databaseId": 2100, "state": "COMMENTED",
+                           "body": "", "submittedAt": None, "url": "",
+                           "author": {"login": "carol"}}]}}}
+        elif variables["cursor"] is None:
+            data = {"pullRequests": {
+                "pageInfo": {"hasNextPage": True, "endCursor": "p1"},
+                "nodes": [_node(1), _node(2)]}}
+        else:
+            data = {"pullRequests": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [_node(3)]}}
+        response = requests.Response()
+        response.request = request
+        response.status_code = 200
+        response._content = json.dumps(
+            {"data": {"repository": data}}).encode("utf-8")
+        return response
+
+    def close(self):
+        pass
+
+
+def test_update_pulls_graphql(tmp_path):
+    data_home = str(tmp_path)
+    session = make_session()
+    adapter = FakeGraphQLAdapter()
+    session.mount("https://", adapter)
+
+    pulls = update_pulls("docathon", "watchtower", auth="user:key",
+                         data_home=data_home, session=session,
+                         backend="graphql")
+    # Two batches of pulls, and one extra page of reviews
+    assert_equal(len(adapter.requests), 3)
+    assert_equal(sorted(pulls["number"]), [1, 2, 3])
+    assert_true(all(pulls["state"] == "closed"))
+    assert_equal(pulls["detailed_pulls"][0]["changed_files"], 1)
+    assert_equal(pulls["_links"][0]["self"]["href"].split("/")[-1],
+                 str(pulls["number"][0]))
+
+    reviews = load_reviews("docathon", "watchtower", data_home=data_home)
+    assert_equal(len(reviews), 4)
+    comments = load_comments("docathon", "watchtower", data_home=data_home)
+    assert_equal(len(comments), 3)
+    assert_equal(len(load_pulls("docathon", "watchtower",
+                                data_home=data_home)), 3)
+
+
+class FakeReviewsAdapter(BaseAdapter):
+    """Serves one review per pull, and errors for the pulls `failing`."""
+
+    def __init__(self, failing=()):
+        super(FakeReviewsAdapter, self).__init__()
+        self.failing = set(failing)
+        self.pulls = []
+
+    def send(self, request, **kwargs):
+        path = requests.utils.urlparse(request.url).path
+        number = int(path.split("/")[-2])
+        self.pulls.append(number)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if number in self.failing:
+            response.status_code = 500
+            response._content = b""
+            return response
+        response.status_code = 200
+        response._content = json.dumps([{
+            "id": 100 + number, "state": "APPROVED",
+            "submitted_at": "2018-06-0%dT00:00:00Z" % number,
+            "user": {"login": "bob"}}]).encode("utf-8")
+        return response
+
+    def close(self):
+        pass
+
+
+def test_update_reviews_failed_pull(tmp_path, monkeypatch):
+    monkeypatch.setattr(_github_api, "BACKOFF_FACTOR", 0.)
+    data_home = str(tmp_path)
+    pulls = pd.DataFrame({
+        "id": [1, 2, 3], "number": [1, 2, 3],
+        "created_at": ["2018-06-0%dT00:00:00Z" % i for i in (1, 2, 3)],
+        "updated_at": ["2018-07-0%dT00:00:00Z" % i for i in (1, 2, 3)]})
+    _update_and_save(os.path.join(data_home, "docathon", "watchtower",
+                                  "pulls.json"), pulls)
+    filename = os.path.join(data_home, "docathon", "watchtower",
+                            "reviews.json")
+
+    # The reviews of pull 2 can't be downloaded: the watermark stops there
+    session = make_session()
+    session.mount("https://", FakeReviewsAdapter(failing=[2]))
+    with pytest.warns(UserWarning):
+        update_reviews("docathon", "watchtower", auth="user:key",
+                       data_home=data_home, session=session,
+                       use_cache=False)
+    assert_equal(_sync.get_state(filename)["watermark"],
+                 "2018-07-02T00:00:00Z")
+
+    # ... so that they are downloaded by the next sync
+    adapter = FakeReviewsAdapter()
+    session.mount("https://", adapter)
+    reviews = update_reviews("docathon", "watchtower", auth="user:key",
+                             data_home=data_home, session=session,
+                             use_cache=False)
+    assert_equal(sorted(set(adapter.pulls)), [2, 3])
+    assert_equal(sorted(reviews["id"]), [101, 102, 103])
+    assert_equal(_sync.get_state(filename)["watermark"],
+                 "2018-07-03T00:00:00Z")
+
+
+def test_update_detailed_pulls(tmp_path):
+    data_home = str(tmp_path)
+    url = "https://api.github.com/repos/docathon/watchtower/pulls/%d"
+    pulls = pd.DataFrame({
+        "id": [1, 2], "number": [1, 2],
+        "created_at": ["2018-06-01T00:00:00Z", "2018-06-02T00:00:00Z"],
+        "updated_at": ["2018-07-01T00:00:00Z", "2018-07-02T00:00:00Z"],
+        "_links": [{"self": {"href": url % i}} for i in (1, 2)],
+        "detailed_pulls": [None, None]})
+    _update_and_save(os.path.join(data_home, "docathon", "watchtower",
+                                  "pulls.json"), pulls)
+
+    session, adapter = fake_session({1: {"changed_files": 1}})
+    pulls = update_detailed_pulls("docathon", "watchtower",
+                                  auth="user:key", data_home=data_home,
+                                  session=session, use_cache=False)
+    assert_equal(len(adapter.requests), 2)
+    assert_equal(pulls["detailed_pulls"][1]["changed_files"], 1)
+
+    # The details of the pulls not updated since are not downloaded again
+    session, adapter = fake_session({1: {"changed_files": 1}})
+    update_detailed_pulls("docathon", "watchtower", auth="user:key",
+                          data_home=data_home, session=session,
+                          use_cache=False)
+    assert_equal(len(adapter.requests), 0)
@@ -0,0 +1,72 @@
+from watchtower._github_api import Auth, get_auth
+from watchtower._rate_limit import TokenPool
+from watchtower.utils.testing import assert_equal, assert_true
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_pool_rotation():
+    clock = FakeClock()
+    alice, bob = Auth("alice", "a"), Auth("bob", "b")
+    pool = TokenPool([alice, bob], sleep=clock.sleep, clock=clock.time)
+
+    # Tokens with the largest budget are used first
+    pool.update(alice, {"X-RateLimit-Remaining": "10",
+                        "X-RateLimit-Reset": "2000"})
+    pool.update(bob, {"X-RateLimit-Remaining": "100",
+                      "X-RateLimit-Reset": "2000"})
+    assert_true(pool.acquire() is bob)
+
+    # Once bob is exhausted, alice takes over without waiting
+    pool.update(bob, {"X-RateLimit-Remaining": "0",
+                      "X-RateLimit-Reset": "1500"})
+    assert_true(pool.acquire() is alice)
+    assert_equal(clock.now, 1000.)
+
+    # Once everything is exhausted, wait for the first reset
+    pool.update(alice, {"X-RateLimit-Remaining": "0",
+                        "X-RateLimit-Reset": "2000"})
+    assert_true(pool.acquire() is bob)
+    assert_equal(clock.now, 1501.)
+
+    usage = {u["token"]: u for u in pool.usage()}
+    assert_equal(usage["alice"]["requests"], 2)
+    assert_equal(usage["bob"]["requests"], 2)
+    assert_equal(usage["bob"]["waited"], 501.)
+    assert_true("alice" in pool.report())
+
+
+def test_token_pool_wait_unlocked(caplog):
+    alice = Auth("alice", "a")
+    locked = []
+
+    def sleep(seconds):
+        locked.append(pool._lock.locked())
+
+    pool = TokenPool([alice], sleep=sleep, clock=lambda: 1000.)
+    pool.update(alice, {"X-RateLimit-Remaining": "0",
+                        "X-RateLimit-Reset": "1500"})
+    # Other threads can use the pool while one waits for a reset
+    assert_true(pool.acquire() is alice)
+    assert_equal(locked, [False])
+
+    # The usage is logged, even without verbose
+    with caplog.at_level("INFO", logger="watchtower"):
+        pool.log_report()
+    assert_true("alice: 1 requests" in caplog.text)
+
+
+def test_get_auth():
+    pool = get_auth(["alice:a", "bob:b"])
+    assert_equal(pool.auths, [Auth("alice", "a"), Auth("bob", "b")])
+    assert_true(get_auth(pool) is pool)
+    assert_equal(len(get_auth("alice:a")), 1)
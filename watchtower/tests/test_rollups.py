@@ -0,0 +1,118 @@
+import copy
+import os
+
+import pandas as pd
+from watchtower import rollup, load_rollup, _io, _rollups
+from watchtower.commits_ import update_commits
+from watchtower.issues_ import update_issues, load_issues
+from watchtower.datasets import _fake_datasets
+from watchtower.utils.testing import assert_equal, fake_session
+
+
+def test_rollup():
+    records = pd.DataFrame({
+        "created_at": ["2019-02-04T10:00:00Z", "2019-02-06T10:00:00Z",
+                       "2019-02-20T10:00:00Z"],
+        "state": ["open", "closed", "open"],
+        "label_names": [["bug"], ["bug", "doc"], []]})
+    counts = rollup(records, "created_at", freq="W", by="state")
+    assert_equal(list(counts.columns), ["all", "closed", "open"])
+    # Empty weeks are counted too
+    assert_equal(list(counts["all"]), [2, 0, 1])
+    assert_equal(list(counts["open"]), [1, 0, 1])
+
+    counts = rollup(records, "created_at", freq="weekday",
+                    by="label_names")
+    assert_equal(len(counts), 7)
+    assert_equal(list(counts.loc[0]), [1, 1, 0])
+    assert_equal(list(counts.loc[2]), [2, 1, 1])
+
+    is_bug = pd.DataFrame({"bug": [True, True, False]})
+    counts = rollup(records, "created_at", freq="M", by=is_bug)
+    assert_equal(list(counts.loc[pd.Timestamp("2019-02-01", tz="UTC")]),
+                 [3, 2])
+
+
+def test_load_rollup(tmp_path):
+    data_home = str(tmp_path)
+    fake_issues = _fake_datasets.get_fake_issues(format="json")
+    session, _ = fake_session({1: fake_issues})
+    update_issues("matplotlib", "matplotlib", auth="user:key",
+                  data_home=data_home, session=session, use_cache=False)
+    counts = load_rollup("matplotlib", "matplotlib", "issues", freq="M",
+                         by="state", data_home=data_home)
+    assert_equal(list(counts.columns), ["all", "open"])
+    assert_equal(counts["open"].sum(), len(fake_issues))
+
+    # Updated records replace their counts
+    closed = copy.deepcopy(fake_issues[0])
+    closed["state"] = "closed"
+    closed["updated_at"] = "2019-03-01T00:00:00Z"
+    session, _ = fake_session({1: [closed]})
+    update_issues("matplotlib", "matplotlib", auth="user:key",
+                  data_home=data_home, session=session, use_cache=False)
+    for by in ("state", "label", "author"):
+        counts = load_rollup("matplotlib", "matplotlib", "issues",
+                             freq="W", by=by, data_home=data_home)
+        issues = load_issues("matplotlib", "matplotlib",
+                             data_home=data_home)
+        column = {"state": "state", "label": "label_names",
+                  "author": "user_login"}[by]
+        expected = rollup(issues, "created_at", freq="W", by=column)
+        assert_equal(counts.to_dict(), expected.to_dict())
+    assert_equal(counts["all"].sum(), len(fake_issues))
+    assert_equal(load_rollup("matplotlib", "matplotlib", "pulls",
+                             data_home=data_home), None)
+
+    # The commits of a branch, by documentation commits
+    commits = [
+        {"sha": "b", "parents": [{"sha": "a"}],
+         "commit": {"message": "DOC fix typo",
+                    "author": {"date": "2018-01-09T00:00:00Z"},
+                    "committer": {"date": "2018-01-09T00:00:00Z"}}},
+        {"sha": "a", "parents": [],
+         "commit": {"message": "ENH first",
+                    "author": {"date": "2018-01-01T00:00:00Z"},
+                    "committer": {"date": "2018-01-01T00:00:00Z"}}}]
+    session, _ = fake_session({1: commits})
+    update_commits("matplotlib", "matplotlib", auth="user:key",
+                   data_home=data_home, session=session, use_cache=False)
+    counts = load_rollup("matplotlib", "matplotlib", "commits", freq="M",
+                         by="doc", data_home=data_home)
+    assert_equal(counts.to_dict("list"),
+                 {"all": [2], "doc": [1], "other": [1]})
+    counts = load_rollup("matplotlib", "matplotlib", "commits", freq="D",
+                         since="2018-01-05", data_home=data_home)
+    assert_equal(list(counts["all"]), [1])
+
+
+def test_rollup_partitions(tmp_path, monkeypatch):
+    data_home = str(tmp_path)
+    fake_issues = _fake_datasets.get_fake_issues(format="json")[:2]
+    fake_issues[0]["created_at"] = "2018-01-01T00:00:00Z"
+    fake_issues[1]["created_at"] = "2018-02-01T00:00:00Z"
+    session, _ = fake_session({1: fake_issues})
+    issues = update_issues("matplotlib", "matplotlib", auth="user:key",
+                           data_home=data_home, session=session,
+                           use_cache=False)
+    filename = os.path.join(data_home, "matplotlib", "matplotlib",
+                            "issues.json")
+
+    # Only the partition of the updated issue is read to update the counts
+    read = []
+    read_partition = _io._read_partition
+
+    def record_read(filename, **kwargs):
+        read.append(os.path.basename(filename).split(".")[0])
+        return read_partition(filename, **kwargs)
+
+    monkeypatch.setattr(_io, "_read_partition", record_read)
+    closed = issues[issues["created_at"] == "2018-02-01T00:00:00Z"].assign(
+        state="closed", updated_at=pd.Timestamp("2019-03-01", tz="UTC"))
+    with _rollups.updating(filename, closed, "issues"):
+        _io._update_and_save(filename, closed)
+    assert_equal(set(read), {"2018-02"})
+    counts = load_rollup("matplotlib", "matplotlib", "issues", freq="M",
+                         by="state", data_home=data_home)
+    assert_equal(counts.to_dict("list"),
+                 {"all": [1, 1], "closed": [0, 1], "open": [1, 0]})
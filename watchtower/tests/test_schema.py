@@ -0,0 +1,59 @@
+import pandas as pd
+from numpy.testing import assert_equal
+
+from watchtower._schema import get_fields, project_records, flatten
+
+
+def test_project_records():
+    records = [
+        {"id": 1, "title": "a", "user": {"login": "bob", "id": 3},
+         "labels": [{"name": "doc", "color": "fff", "id": 4}],
+         "head": {"repo": {"full_name": "bob/project"}},
+         "pull_request": {"url": "u", "diff_url": "d"}},
+        {"id": 2, "title": "b", "user": None, "labels": []}]
+    projection = get_fields(
+        "issues", ["id", "user.login", "labels.name", "pull_request"])
+    assert_equal(
+        project_records(records, projection),
+        [{"id": 1, "user": {"login": "bob"}, "labels": [{"name": "doc"}],
+          "pull_request": {"url": "u", "diff_url": "d"}},
+         {"id": 2, "user": None, "labels": []}])
+
+    # A parent path keeps the whole object
+    projection = get_fields("issues", ["user", "user.login"])
+    assert_equal(project_records(records[:1], projection),
+                 [{"user": {"login": "bob", "id": 3}}])
+
+    assert get_fields("issues", "all") is None
+    assert project_records(records, None) is records
+    # Only the ref and sha of the head are kept, not its repository
+    pull = project_records(records, get_fields("pulls"))[0]
+    assert_equal(pull["head"], {})
+
+
+def test_flatten():
+    issues = pd.DataFrame([
+        {"id": 1, "user": {"login": "bob"},
+         "labels": [{"name": "doc"}, {"name": "bug"}]},
+        {"id": 2, "user": None, "labels": []}])
+    flatten(issues, "issues")
+    assert_equal(list(issues["user_login"]), ["bob", None])
+    assert_equal(list(issues["label_names"]), [["doc", "bug"], []])
+
+    commits = pd.DataFrame([
+        {"sha": "a", "commit": {"message": "DOC fix",
+                                "author": {"date": "2018-01-02T10:00:00Z"},
+                                "committer": {"date": "2018-01-03T10:00:00Z"}},
+         "author": None, "committer": {"login": "alice"}}])
+    flatten(commits, "commits")
+    assert_equal(list(commits["message"]), ["DOC fix"])
+    assert commits["authored_at"][0] == pd.Timestamp("2018-01-02 10:00Z")
+    assert_equal(list(commits["author_login"]), [None])
+    assert_equal(list(commits["committer_login"]), ["alice"])
+
+    # Existing columns are kept unless overwritten
+    commits["message"] = "kept"
+    flatten(commits, "commits", overwrite=False)
+    assert_equal(list(commits["message"]), ["kept"])
+    # Columns which nested object is missing are not added
+    assert "user_login" not in flatten(pd.DataFrame({"id": [1]}), "comments")
@@ -0,0 +1,70 @@
+import os
+
+import pandas as pd
+from watchtower import _sqlite
+from watchtower._config import set_storage
+from watchtower._io import _update_and_save, _load
+from watchtower._sqlite import query
+from watchtower.issues_ import load_issues
+from watchtower.datasets import _fake_datasets
+from watchtower.utils.testing import assert_equal
+
+
+def test_sqlite_storage(tmp_path):
+    data_home = str(tmp_path)
+    filename = os.path.join(data_home, "matplotlib", "matplotlib",
+                            "issues.json")
+    issues = _fake_datasets.get_fake_issues()
+    # Issues stored as files are imported in the database on first load
+    _update_and_save(filename, issues)
+    set_storage("sqlite")
+    try:
+        loaded = load_issues("matplotlib", "matplotlib", data_home=data_home)
+        assert_equal(sorted(loaded["id"]), sorted(issues["id"]))
+        assert_equal(str(loaded["created_at"].dtype), "datetime64[ns, UTC]")
+
+        # A stale version is ignored, a newer one replaces the stored one
+        stale = issues.iloc[:1].assign(title="stale",
+                                       updated_at="2019-01-01T00:00:00Z")
+        newer = issues.iloc[1:].assign(title="newer", state="closed",
+                                       updated_at="2019-03-01T00:00:00Z")
+        _update_and_save(filename, pd.concat([stale, newer]))
+        loaded = _load(filename, columns=["id", "title"])
+        assert_equal(list(loaded.columns), ["id", "title"])
+        assert_equal(sorted(loaded["title"]), sorted(["newer"] + list(
+            issues["title"].iloc[:1])))
+
+        def ids(**kwargs):
+            return list(query("matplotlib", "matplotlib", "issues",
+                              data_home=data_home, **kwargs)["id"])
+
+        assert_equal(ids(state="closed"), [407429547])
+        assert_equal(ids(label="bug"), [407430164])
+        assert_equal(ids(author="NelleV", since="2019-02-06T21:05:00Z"),
+                     [407430164])
+        assert_equal(ids(date_field="updated_at", until="2019-02-07"),
+                     [407430164])
+        assert_equal(len(query("numpy", "numpy", "issues",
+                               data_home=data_home)), 0)
+    finally:
+        set_storage(None)
+
+
+def test_sqlite_schema(tmp_path, monkeypatch):
+    filename = os.path.join(str(tmp_path), "matplotlib", "matplotlib",
+                            "issues.json")
+    created = []
+    create_schema = _sqlite._create_schema
+
+    def record_create(connection):
+        created.append(connection)
+        create_schema(connection)
+
+    monkeypatch.setattr(_sqlite, "_create_schema", record_create)
+    issues = _fake_datasets.get_fake_issues()
+    _sqlite.upsert(filename, issues)
+    # The schema is created with the database only
+    _sqlite.upsert(filename, issues)
+    assert_equal(_sqlite.has_dataset(filename), True)
+    assert_equal(_sqlite.count(filename), len(issues))
+    assert_equal(len(created), 1)
@@ -1,7 +1,13 @@
+import json
 import unittest
 
+import requests
+from requests.adapters import BaseAdapter
+
+from .._github_api import make_session
+
 __all__ = ["assert_equal", "assert_not_equal", "assert_true",
-           "assert_false", "assert_raises"]
+           "assert_false", "assert_raises", "FakeAdapter", "fake_session"]
 
 _dummy = unittest.TestCase('__init__')
 assert_equal = _dummy.assertEqual
@@ -9,3 +15,61 @@ assert_not_equal = _dummy.assertNotEqual
 assert_true = _dummy.assertTrue
 assert_false = _dummy.assertFalse
 assert_raises = _dummy.assertRaises
+
+
+class FakeAdapter(BaseAdapter):
+    """Serves pages from a dictionary instead of hitting github."""
+
+    def __init__(self, pages, links=True):
+        super(FakeAdapter, self).__init__()
+        self.pages = pages
+        self.links = links
+        self.requests = []
+        # Number of times each page fails before succeeding
+        self.failures = {}
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        url = requests.utils.urlparse(request.url)
+        query = dict(q.split("=") for q in url.query.split("&") if q)
+        page = int(query.get("page", 1))
+        body = json.dumps(self.pages.get(page, [])).encode("utf-8")
+        etag = '"%d"' % hash(body)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.headers["Content-Type"] = "application/json"
+        response.headers["ETag"] = etag
+        if self.failures.get(page, 0):
+            self.failures[page] -= 1
+            response.status_code = 502
+            response._content = b""
+            return response
+        last_page = max(self.pages) if self.pages else 1
+        if self.links and last_page > 1:
+            base = request.url.split("?")[0]
+            links = ['<%s?page=%d>; rel="last"' % (base, last_page)]
+            if page < last_page:
+                links.append('<%s?page=%d>; rel="next"' % (base, page + 1))
+            response.headers["Link"] = ", ".join(links)
+        if request.headers.get("If-None-Match") == etag:
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = body
+        return response
+
+    def close(self):
+        pass
+
+
+def fake_session(pages, links=True):
+    """
+    Return a session serving `pages` ({page number: list of records}) for
+    any URL, and the adapter recording the requests sent.
+    """
+    session = make_session()
+    adapter = FakeAdapter(pages, links=links)
+    session.mount("https://", adapter)
+    return session, adapter